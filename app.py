@@ -4,15 +4,28 @@ Performance : Cache + Queries optimisées
 """
 
 import os
-import json
+import hmac
+import base64
+import time
+import tempfile
 import logging
 import datetime
-from functools import lru_cache
-from flask import Flask, jsonify, request
+import threading
+from flask import Flask, Response, jsonify, request, current_app
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, current_user, login_required
 from werkzeug.security import generate_password_hash, check_password_hash
-import requests
+
+from video_store import video_store
+from upstream import upstream
+from catalog import Catalog, Record, load_catalog
+from projections import RawJSON, join_array, encode_object
+from http_cache import conditional, http_cache_stats, CATALOG_CACHE_CONTROL
+from streaming import streaming_stats
+from progress_buffer import ProgressBuffer, ProgressEntry
+from user_cache import UserStateCache
+from database import configure_database, bootstrap_database, database_stats, DB_AUTO_MIGRATE
 
 # ==================
 # CONFIGURATION
@@ -24,10 +37,6 @@ logger = logging.getLogger(__name__)
 db = SQLAlchemy()
 login_manager = LoginManager()
 
-# Session vidéo réutilisable
-USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-video_session = requests.Session()
-video_session.headers.update({'User-Agent': USER_AGENT})
 
 # ==================
 # MODÈLES DB (avec indexes)
@@ -84,88 +93,386 @@ class UserFavorite(db.Model):
 # 🔥 CACHE OPTIMISÉ
 # ==================
 
-# Cache le JSON en mémoire (rechargé seulement au redémarrage)
-_ANIME_CACHE = None
-_ANIME_DICT = None  # Dict pour recherche O(1)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ANIME_JSON_PATH = os.path.join(BASE_DIR, 'static', 'data', 'anime.json')
+DISCOVER_JSON_PATH = os.path.join(BASE_DIR, 'data_discover.json')
+
+# Intervalle du watcher de fichiers (secondes, 0 = désactivé)
+CATALOG_WATCH_INTERVAL = int(os.environ.get('CATALOG_WATCH_INTERVAL', 0))
+# Vérification des mtimes au fil des requêtes, dans chaque worker (secondes, 0 = désactivé) :
+# fonctionne après fork (gunicorn --preload), contrairement au thread watcher
+CATALOG_CHECK_INTERVAL = float(os.environ.get('CATALOG_CHECK_INTERVAL', 2))
+# Fichier témoin touché par l'endpoint admin : tous les workers rechargent
+CATALOG_RELOAD_STAMP = os.environ.get('CATALOG_RELOAD_STAMP',
+                                      os.path.join(tempfile.gettempdir(), 'animezone_catalog.reload'))
+# Token de l'endpoint admin de reload (vide = endpoint désactivé)
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# Taille max d'une page de résultats (API + /search)
+SEARCH_PAGE_MAX = int(os.environ.get('SEARCH_PAGE_MAX', 100))
+
+# Catalogue courant : UNE seule référence, remplacée atomiquement au reload
+_CATALOG = None
+_RELOAD_LOCK = threading.Lock()
+_NEXT_CHECK = 0.0
+_FAILED_MTIMES = None  # fichiers d'un reload échoué : pas de nouvel essai tant qu'ils ne changent pas
+_RELOAD_STATS = {
+    'reloads': 0,
+    'errors': 0,
+    'last_duration_ms': None,
+    'last_error': None,
+}
+
+
+def _catalog_mtimes():
+    mtimes = {}
+    for path in (ANIME_JSON_PATH, DISCOVER_JSON_PATH, CATALOG_RELOAD_STAMP):
+        try:
+            mtimes[path] = os.stat(path).st_mtime_ns
+        except OSError:
+            mtimes[path] = None
+    return mtimes
+
+
+def reload_catalog(if_changed=False):
+    """Construit un nouveau catalogue puis le publie (swap atomique)"""
+    global _CATALOG, _FAILED_MTIMES
+    
+    with _RELOAD_LOCK:
+        if if_changed and _CATALOG is not None and _catalog_mtimes() == _CATALOG.mtimes:
+            # Déjà rechargé par un autre thread
+            return _CATALOG
+        generation = (_CATALOG.generation if _CATALOG else 0) + 1
+        mtimes = _catalog_mtimes()
+        start = time.perf_counter()
+        
+        try:
+            catalog = load_catalog(ANIME_JSON_PATH, DISCOVER_JSON_PATH, generation)
+        except Exception as e:
+            _RELOAD_STATS['errors'] += 1
+            _RELOAD_STATS['last_error'] = str(e)
+            _FAILED_MTIMES = mtimes
+            logger.error(f"❌ Erreur chargement cache: {e}")
+            if _CATALOG is None:
+                # Catalogue vide : l'app démarre, un reload le remplacera
+                _CATALOG = Catalog([], [], generation=0)
+                _CATALOG.mtimes = mtimes
+            return None
+        
+        catalog.mtimes = mtimes
+        duration_ms = round((time.perf_counter() - start) * 1000, 1)
+        
+        # 🔥 Swap atomique : une seule affectation de référence
+        _CATALOG = catalog
+        
+        _RELOAD_STATS['reloads'] += 1
+        _RELOAD_STATS['last_duration_ms'] = duration_ms
+        _RELOAD_STATS['last_error'] = None
+        logger.info(f"✅ Cache chargé : {len(catalog)} animes "
+                    f"(génération {generation}, {duration_ms} ms)")
+        return catalog
+
+
+def get_catalog():
+    """Catalogue courant (chargé au premier appel)"""
+    catalog = _CATALOG
+    if catalog is None:
+        reload_catalog()
+        catalog = _CATALOG
+    elif CATALOG_CHECK_INTERVAL > 0 and time.monotonic() >= _NEXT_CHECK:
+        _check_catalog_files(catalog)
+    return catalog
+
+
+def _check_catalog_files(catalog):
+    """Fichiers modifiés (ou reload demandé) : rechargement en arrière-plan.
+
+    Les requêtes continuent sur l'ancienne génération jusqu'au swap.
+    """
+    global _NEXT_CHECK
+    _NEXT_CHECK = time.monotonic() + CATALOG_CHECK_INTERVAL
+    mtimes = _catalog_mtimes()
+    if mtimes != catalog.mtimes and mtimes != _FAILED_MTIMES and not _RELOAD_LOCK.locked():
+        logger.info("🔄 Catalogue modifié sur disque, rechargement")
+        threading.Thread(target=reload_catalog, kwargs={'if_changed': True},
+                         name='catalog-reload', daemon=True).start()
+
+
+def signal_catalog_reload():
+    """Touche le fichier témoin : chaque worker recharge à sa prochaine vérification"""
+    with open(CATALOG_RELOAD_STAMP, 'a'):
+        pass
+    os.utime(CATALOG_RELOAD_STAMP, None)
+
+
+def catalog_stats():
+    catalog = get_catalog()
+    return {
+        'generation': catalog.generation,
+        'version': catalog.version,
+        'animes': len(catalog),
+        'loaded_at': datetime.datetime.utcfromtimestamp(catalog.loaded_at).isoformat(),
+        'memory': catalog.memory_report(),
+        **_RELOAD_STATS,
+    }
+
+
+def _watch_catalog_files(interval):
+    """Recharge le catalogue quand anime.json / data_discover.json changent"""
+    while True:
+        time.sleep(interval)
+        try:
+            if _catalog_mtimes() != getattr(get_catalog(), 'mtimes', None):
+                logger.info("🔄 Catalogue modifié sur disque, rechargement")
+                reload_catalog(if_changed=True)
+        except Exception as e:
+            logger.error(f"❌ Watcher catalogue: {e}")
+
+
+def start_catalog_watcher(interval=CATALOG_WATCH_INTERVAL):
+    thread = threading.Thread(target=_watch_catalog_files, args=(interval,),
+                              name='catalog-watcher', daemon=True)
+    thread.start()
+    return thread
+
 
 def load_anime_data():
-    """Cache le JSON en mémoire - appelé UNE SEULE FOIS"""
-    global _ANIME_CACHE, _ANIME_DICT
-    
-    if _ANIME_CACHE is not None:
-        return _ANIME_CACHE
-    
-    try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        json_path = os.path.join(base_dir, 'static', 'data', 'anime.json')
-        
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            animes = data.get('anime', data) if isinstance(data, dict) else data
-            
-            # Normaliser les données
-            for anime in animes:
-                if 'anime_id' not in anime:
-                    anime['anime_id'] = anime.get('id', 0)
-                if 'has_episodes' not in anime:
-                    anime['has_episodes'] = len(anime.get('seasons', [])) > 0
-            
-            _ANIME_CACHE = animes
-            
-            # Créer dict pour recherche rapide
-            _ANIME_DICT = {int(a.get('anime_id', 0)): a for a in animes}
-            _ANIME_DICT.update({int(a.get('id', 0)): a for a in animes})
-            
-            logger.info(f"✅ Cache chargé : {len(animes)} animes")
-            return animes
-    except Exception as e:
-        logger.error(f"❌ Erreur chargement cache: {e}")
-        return []
+    """Animes du catalogue courant (snapshot en lecture seule)"""
+    return get_catalog().animes
 
 
 def get_anime_by_id(anime_id):
     """Recherche O(1) au lieu de O(n)"""
-    if _ANIME_DICT is None:
-        load_anime_data()
-    return _ANIME_DICT.get(int(anime_id))
+    return get_catalog().by_id.get(int(anime_id))
+
+
+def get_season(anime_id, season_number):
+    """Saison en O(1) (None si absente)"""
+    return get_catalog().season_index.get((int(anime_id), season_number))
+
+
+def get_episode(anime_id, season_number, episode_number):
+    """(season, episode) en O(1) ; (None, None) si absent"""
+    return get_catalog().episode_index.get((int(anime_id), season_number, episode_number), (None, None))
+
+
+def get_episode_links(anime_id, season_number, episode_number):
+    """(précédent, suivant) sous forme de tuples (saison, épisode) ou None"""
+    return get_catalog().episode_links.get((int(anime_id), season_number, episode_number), (None, None))
 
 
-@lru_cache(maxsize=1)
 def load_discover_data():
-    """Cache les données discover"""
-    try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        json_path = os.path.join(base_dir, 'data_discover.json')
-        
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            return data if isinstance(data, list) else data.get('anime', [])
-    except:
-        return []
+    """Données discover (rechargées avec le catalogue)"""
+    return get_catalog().discover
+
+
+def get_genre_index():
+    """genre -> animes, précalculé au chargement"""
+    return get_catalog().genre_index
+
+
+def get_genre_counts():
+    """genre -> nombre d'animes, précalculé au chargement"""
+    return get_catalog().genre_counts
 
 
-@lru_cache(maxsize=1)
 def get_all_genres():
-    """Cache les genres"""
-    anime_data = load_anime_data()
-    genres = set()
-    for anime in anime_data:
-        for genre in anime.get('genres', []):
-            genres.add(genre.lower())
-    return sorted(list(genres))
+    """Genres triés (clés de l'index)"""
+    return get_catalog().genres
+
+
+def get_featured_animes():
+    """Sélection discover jouable (accueil)"""
+    return get_catalog().featured
+
+
+def get_catalog_generation():
+    """Numéro de génération du catalogue courant (clés de cache)"""
+    return get_catalog().generation
+
+
+def get_projections():
+    """Fragments JSON card/detail/player de la génération courante"""
+    return get_catalog().projections
+
+
+def json_fragments_response(fields, status=200):
+    """Réponse JSON assemblée à partir de fragments pré-encodés (RawJSON)"""
+    return Response(encode_object(fields), status=status, mimetype='application/json')
+
+
+def encode_cursor(catalog, doc_id):
+    """Curseur opaque : génération + position + anime_id du dernier résultat"""
+    anime_id = catalog.animes[doc_id].get('anime_id', 0)
+    raw = f"{catalog.generation}:{doc_id}:{anime_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(catalog, cursor):
+    """Position après laquelle reprendre ; ValueError si curseur invalide"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        generation, doc_id, anime_id = (int(part) for part in raw.split(':'))
+    except Exception:
+        raise ValueError(f"Curseur invalide: {cursor!r}")
+    
+    if generation != catalog.generation:
+        # Catalogue rechargé entre deux pages : on se recale sur l'anime
+        doc_id = catalog.projections.positions.get(anime_id, min(doc_id, len(catalog) - 1))
+    elif not 0 <= doc_id < len(catalog):
+        raise ValueError(f"Curseur hors catalogue: {cursor!r}")
+    return doc_id
+
+
+def search_page(query='', genre='', playable_only=False, cursor=None, limit=SEARCH_PAGE_MAX,
+                language=''):
+    """Une page de résultats : (catalogue, doc_ids, curseur suivant, total, exact).
+
+    Le catalogue est renvoyé pour que l'appelant lise animes/cartes dans
+    la même génération que les doc_ids.
+    """
+    catalog = get_catalog()
+    # limit=0 : aucun résultat, seulement le total (comme l'ancien filtered[:0])
+    limit = max(0, min(limit, SEARCH_PAGE_MAX))
+    after = decode_cursor(catalog, cursor) if cursor else -1
+    
+    # limit + 1 : savoir s'il reste une page sans compter tout le reste
+    index = catalog.search_index
+    doc_ids, next_cursor = [], None
+    if limit:
+        doc_ids = index.search_ids(query, genre, playable_only, limit=limit + 1, after=after,
+                                   language=language)
+        if len(doc_ids) > limit:
+            next_cursor = encode_cursor(catalog, doc_ids[limit - 1])
+    total, exact = index.count(query, genre, playable_only, language)
+    return catalog, doc_ids[:limit], next_cursor, total, exact
 
 
 # ==================
 # 🔥 QUERIES OPTIMISÉES
 # ==================
 
+def _dialect_insert(model):
+    """INSERT avec support ON CONFLICT (SQLite / Postgres), sinon None"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        return None
+    return insert(model)
+
+
+def upsert_progress_batch(entries):
+    """Upsert d'un lot de progressions : 1 INSERT ... ON CONFLICT DO UPDATE"""
+    if not entries:
+        return
+    
+    rows = [{
+        'user_id': e.user_id,
+        'anime_id': e.anime_id,
+        'season_number': e.season_number,
+        'episode_number': e.episode_number,
+        'time_position': e.time_position,
+        'completed': e.completed,
+        'last_watched': e.last_watched,
+    } for e in entries]
+    
+    try:
+        _upsert_progress_rows(rows)
+        db.session.commit()
+    except Exception:
+        # Session réutilisable pour le lot suivant (ou la ligne suivante)
+        db.session.rollback()
+        raise
+
+
+def _upsert_progress_rows(rows):
+    stmt = _dialect_insert(UserProgress)
+    if stmt is not None:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'anime_id', 'season_number', 'episode_number'],
+            set_={
+                'time_position': stmt.excluded.time_position,
+                'completed': stmt.excluded.completed,
+                'last_watched': stmt.excluded.last_watched,
+            }
+        )
+        db.session.execute(stmt, rows)
+    else:
+        # Autres SGBD : lecture puis écriture, même transaction
+        for row in rows:
+            progress = UserProgress.query.filter_by(
+                user_id=row['user_id'],
+                anime_id=row['anime_id'],
+                season_number=row['season_number'],
+                episode_number=row['episode_number']
+            ).first()
+            if progress:
+                progress.time_position = row['time_position']
+                progress.completed = row['completed']
+                progress.last_watched = row['last_watched']
+            else:
+                db.session.add(UserProgress(**row))
+
+
+def toggle_user_favorite(user_id, anime_id):
+    """Toggle favori atomique : DELETE, sinon INSERT ... ON CONFLICT DO NOTHING"""
+    deleted = db.session.execute(
+        db.delete(UserFavorite).where(
+            UserFavorite.user_id == user_id,
+            UserFavorite.anime_id == anime_id
+        )
+    ).rowcount
+    
+    if deleted:
+        db.session.commit()
+        user_cache.update_favorite(user_id, anime_id, added=False)
+        return 'removed'
+    
+    row = {'user_id': user_id, 'anime_id': anime_id, 'added_at': datetime.datetime.utcnow()}
+    stmt = _dialect_insert(UserFavorite)
+    if stmt is not None:
+        db.session.execute(stmt.on_conflict_do_nothing(index_elements=['user_id', 'anime_id']), [row])
+    else:
+        db.session.add(UserFavorite(**row))
+    db.session.commit()
+    user_cache.update_favorite(user_id, anime_id, added=True)
+    return 'added'
+
+
+# Buffer write-behind des positions (flush périodique + à l'arrêt)
+progress_buffer = ProgressBuffer(upsert_progress_batch)
+
+# État utilisateur en mémoire (favoris + progression par anime)
+user_cache = UserStateCache()
+
+
+def _overlay_pending(rows, pending):
+    """Remplace les lignes DB par les positions en attente plus récentes"""
+    if not pending:
+        return list(rows)
+    merged = {(p.anime_id, p.season_number, p.episode_number): p for p in rows}
+    for entry in pending:
+        merged[entry.key] = entry
+    return list(merged.values())
+
+
 def get_user_progress_optimized(user_id, limit=20):
-    """Query optimisée avec limite"""
-    return (UserProgress.query
+    """Query optimisée avec limite (+ positions non flushées)"""
+    rows = (UserProgress.query
             .filter_by(user_id=user_id)
             .order_by(UserProgress.last_watched.desc())
             .limit(limit)
             .all())
+    
+    pending = progress_buffer.pending_for_user(user_id)
+    if not pending:
+        return rows
+    
+    merged = _overlay_pending(rows, pending)
+    merged.sort(key=lambda p: p.last_watched, reverse=True)
+    return merged[:limit]
 
 
 def get_user_favorites_optimized(user_id, limit=15):
@@ -177,20 +484,101 @@ def get_user_favorites_optimized(user_id, limit=15):
             .all())
 
 
+def _anime_progress_map(user_id, anime_id):
+    """{(saison, épisode): ProgressEntry} depuis le cache, sinon 1 query"""
+    progress = user_cache.get_progress(user_id, anime_id)
+    if progress is None:
+        rows = UserProgress.query.filter_by(user_id=user_id, anime_id=anime_id).all()
+        # Copies détachées de la session (réutilisables entre requêtes)
+        entries = [ProgressEntry(p.user_id, p.anime_id, p.season_number, p.episode_number,
+                                 p.time_position, p.completed, p.last_watched) for p in rows]
+        entries = _overlay_pending(entries, progress_buffer.pending_for_anime(user_id, anime_id))
+        progress = {(e.season_number, e.episode_number): e for e in entries}
+        user_cache.set_progress(user_id, anime_id, progress)
+    return progress
+
+
+def get_anime_progress(user_id, anime_id):
+    """Toute la progression d'un anime (cache utilisateur, sinon 1 query)"""
+    return list(_anime_progress_map(user_id, anime_id).values())
+
+
+def get_episode_progress(user_id, anime_id, season_number, episode_number):
+    """Progression d'un épisode (depuis la progression de l'anime)"""
+    return _anime_progress_map(user_id, anime_id).get((season_number, episode_number))
+
+
+def get_latest_progress(user_id, anime_id):
+    """Dernier épisode non terminé, déduit de la progression en cache"""
+    return max((p for p in get_anime_progress(user_id, anime_id) if not p.completed),
+               key=lambda p: p.last_watched, default=None)
+
+
+def is_user_favorite(user_id, anime_id):
+    """Favori ? (ensemble des favoris en cache, sinon 1 query)"""
+    favorites = user_cache.get_favorites(user_id)
+    if favorites is None:
+        favorites = {anime_id for (anime_id,) in
+                     db.session.query(UserFavorite.anime_id).filter_by(user_id=user_id)}
+        user_cache.set_favorites(user_id, favorites)
+    return anime_id in favorites
+
+
+def user_state_tag(user_id, anime_id):
+    """État utilisateur lu par les vues d'un anime (entre dans l'ETag).
+
+    Dérivé des données elles-mêmes (pas d'un compteur local) : l'ETag
+    reste identique d'un worker à l'autre.
+    """
+    progress = _anime_progress_map(user_id, anime_id)
+    return (
+        is_user_favorite(user_id, anime_id),
+        tuple(sorted((k, p.time_position, p.completed) for k, p in progress.items())),
+    )
+
+
+def catalog_etag(*parts):
+    """Éléments d'ETag d'une réponse catalogue (version du contenu + paramètres).
+
+    La génération est un compteur local au process : deux workers (ou un
+    redémarrage) peuvent porter le même numéro pour des contenus différents.
+    """
+    return (get_catalog().version, *parts)
+
+
+def record_progress(user_id, anime_id, season_number, episode_number, time_position, completed):
+    """Sauvegarde write-behind + mise à jour du cache utilisateur"""
+    entry = progress_buffer.record(user_id, anime_id, season_number, episode_number,
+                                   time_position, completed)
+    user_cache.update_progress(user_id, entry)
+    return entry
+
+
+def remove_anime_progress(user_id, anime_id):
+    """Supprime toute la progression d'un anime (buffer, DB, cache)"""
+    # Positions en attente d'abord (sinon le flush les recréerait)
+    buffered = progress_buffer.discard_anime(user_id, anime_id)
+    
+    query = UserProgress.query.filter_by(user_id=user_id, anime_id=anime_id)
+    # Un épisode à la fois en DB et dans le buffer ne compte qu'une fois
+    stored = {(anime_id, season, episode) for season, episode in
+              query.with_entities(UserProgress.season_number, UserProgress.episode_number)}
+    query.delete()
+    db.session.commit()
+    
+    user_cache.drop_progress(user_id, anime_id)
+    return len(stored | buffered)
+
+
 def get_episode_progress_batch(user_id, anime_id):
     """Récupère TOUTE la progression d'un anime en 1 query"""
-    progress_list = UserProgress.query.filter_by(
-        user_id=user_id,
-        anime_id=anime_id
-    ).all()
-    
     return {
         f"{p.season_number}_{p.episode_number}": {
             'time_position': p.time_position,
             'completed': p.completed,
             'last_watched': p.last_watched
         }
-        for p in progress_list
+        for p in get_anime_progress(user_id, anime_id)
     }
 
 
@@ -238,55 +626,79 @@ def register_api_routes(app):
     
     @app.route('/api/anime/list')
     @login_required
+    @conditional(lambda: catalog_etag('list', request.query_string), CATALOG_CACHE_CONTROL)
     def api_anime_list():
-        """Liste des animes (depuis cache)"""
-        anime_data = load_anime_data()
-        
+        """Liste des animes (depuis l'index)"""
         # Filtres
         query = request.args.get('query', '').lower()
         genre = request.args.get('genre', '').lower()
-        limit = int(request.args.get('limit', 100))
-        
-        filtered = anime_data
-        
-        if query:
-            filtered = [a for a in filtered if query in a.get('title', '').lower()]
+        language = request.args.get('language', '').lower()
+        playable_only = request.args.get('playable') == '1'
+        limit = request.args.get('limit', SEARCH_PAGE_MAX, type=int)
         
-        if genre:
-            filtered = [a for a in filtered if genre in [g.lower() for g in a.get('genres', [])]]
+        # 🔥 Index n-grammes + genres + langues, une page après le curseur
+        try:
+            catalog, doc_ids, next_cursor, total, total_exact = search_page(
+                query, genre, playable_only, cursor=request.args.get('cursor'), limit=limit,
+                language=language)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        # Limiter les résultats
-        filtered = filtered[:limit]
-        
-        return jsonify({'success': True, 'animes': filtered, 'total': len(filtered)})
+        # Cartes pré-encodées : concaténation, aucun ré-encodage
+        cards = catalog.projections.cards
+        return json_fragments_response({
+            'success': True,
+            'animes': join_array([cards[i] for i in doc_ids]),
+            'count': len(doc_ids),
+            'total': total,
+            'total_exact': total_exact,
+            'next_cursor': next_cursor
+        })
     
     
     @app.route('/api/anime/<int:anime_id>')
     @login_required
+    @conditional(lambda anime_id: catalog_etag('detail', anime_id, current_user.id,
+                                               user_state_tag(current_user.id, anime_id)))
     def api_anime_detail(anime_id):
         """Détails d'un anime (recherche O(1))"""
-        anime = get_anime_by_id(anime_id)
+        anime = get_projections().detail(anime_id)
         
-        if not anime:
+        if anime is None:
             return jsonify({'success': False, 'error': 'Not found'}), 404
         
         # Progression de l'utilisateur (1 seule query)
         episode_progress = get_episode_progress_batch(current_user.id, anime_id)
         
-        # Favori (1 query)
-        is_favorite = UserFavorite.query.filter_by(
-            user_id=current_user.id,
-            anime_id=anime_id
-        ).first() is not None
-        
-        return jsonify({
+        return json_fragments_response({
             'success': True,
-            'anime': anime,
-            'is_favorite': is_favorite,
+            'anime': RawJSON(anime),
+            'is_favorite': is_user_favorite(current_user.id, anime_id),
             'episode_progress': episode_progress
         })
     
     
+    @app.route('/api/anime/<int:anime_id>/<int:season_number>/<int:episode_number>')
+    @login_required
+    @conditional(lambda anime_id, season_number, episode_number: catalog_etag(
+        'episode', anime_id, season_number, episode_number, current_user.id,
+        user_state_tag(current_user.id, anime_id)))
+    def api_episode(anime_id, season_number, episode_number):
+        """Épisode à lire (projection player : URLs + précédent/suivant)"""
+        episode = get_projections().player(anime_id, season_number, episode_number)
+        
+        if episode is None:
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        
+        progress = get_episode_progress(current_user.id, anime_id, season_number, episode_number)
+        
+        return json_fragments_response({
+            'success': True,
+            'episode': RawJSON(episode),
+            'time_position': progress.time_position if progress else 0
+        })
+    
+    
     @app.route('/api/user/progress')
     @login_required
     def api_user_progress():
@@ -294,12 +706,13 @@ def register_api_routes(app):
         limit = int(request.args.get('limit', 20))
         progress_list = get_user_progress_optimized(current_user.id, limit)
         
-        # Enrichir avec les données anime (depuis cache)
+        # Enrichir avec les cartes anime (pré-encodées)
+        projections = get_projections()
         result = []
         for progress in progress_list:
-            anime = get_anime_by_id(progress.anime_id)
-            if anime:
-                result.append({
+            anime = projections.card(progress.anime_id)
+            if anime is not None:
+                result.append(encode_object({
                     'progress': {
                         'anime_id': progress.anime_id,
                         'season_number': progress.season_number,
@@ -308,10 +721,10 @@ def register_api_routes(app):
                         'completed': progress.completed,
                         'last_watched': progress.last_watched.isoformat()
                     },
-                    'anime': anime
-                })
+                    'anime': RawJSON(anime)
+                }))
         
-        return jsonify({'success': True, 'progress': result})
+        return json_fragments_response({'success': True, 'progress': join_array(result)})
     
     
     @app.route('/api/user/favorites')
@@ -321,51 +734,31 @@ def register_api_routes(app):
         limit = int(request.args.get('limit', 15))
         favorites = get_user_favorites_optimized(current_user.id, limit)
         
+        projections = get_projections()
         result = []
         for fav in favorites:
-            anime = get_anime_by_id(fav.anime_id)
-            if anime:
+            anime = projections.card(fav.anime_id)
+            if anime is not None:
                 result.append(anime)
         
-        return jsonify({'success': True, 'favorites': result})
+        return json_fragments_response({'success': True, 'favorites': join_array(result)})
     
     
     @app.route('/api/progress/save', methods=['POST'])
     @login_required
     def api_save_progress():
-        """Sauvegarde optimisée avec upsert"""
+        """Sauvegarde progression (buffer write-behind)"""
         data = request.get_json()
         
-        anime_id = data.get('anime_id', type=int)
-        season_number = data.get('season_number', type=int)
-        episode_number = data.get('episode_number', type=int)
-        time_position = data.get('time_position', type=float)
-        completed = data.get('completed', False)
-        
-        # Upsert en 1 query
-        progress = UserProgress.query.filter_by(
-            user_id=current_user.id,
-            anime_id=anime_id,
-            season_number=season_number,
-            episode_number=episode_number
-        ).first()
-        
-        if progress:
-            progress.time_position = time_position
-            progress.completed = completed
-            progress.last_watched = datetime.datetime.utcnow()
-        else:
-            progress = UserProgress(
-                user_id=current_user.id,
-                anime_id=anime_id,
-                season_number=season_number,
-                episode_number=episode_number,
-                time_position=time_position,
-                completed=completed
-            )
-            db.session.add(progress)
-        
-        db.session.commit()
+        # 🔥 Write-behind : dernière position gardée en mémoire, écrite par lots
+        record_progress(
+            current_user.id,
+            int(data.get('anime_id')),
+            int(data.get('season_number')),
+            int(data.get('episode_number')),
+            float(data.get('time_position', 0)),
+            bool(data.get('completed', False))
+        )
         return jsonify({'success': True})
     
     
@@ -374,44 +767,98 @@ def register_api_routes(app):
     def api_toggle_favorite():
         """Toggle favori optimisé"""
         data = request.get_json()
-        anime_id = data.get('anime_id', type=int)
+        anime_id = int(data.get('anime_id'))
         
-        favorite = UserFavorite.query.filter_by(
-            user_id=current_user.id,
-            anime_id=anime_id
-        ).first()
+        action = toggle_user_favorite(current_user.id, anime_id)
+        return jsonify({'success': True, 'action': action})
+    
+    
+    @app.route('/api/admin/catalog/reload', methods=['POST'])
+    def api_reload_catalog():
+        """Rechargement à chaud du catalogue dans tous les workers (hors chemin des requêtes)"""
+        token = request.headers.get('X-Admin-Token', '')
+        if not ADMIN_TOKEN or not hmac.compare_digest(token, ADMIN_TOKEN):
+            return jsonify({'success': False, 'error': 'Forbidden'}), 403
         
-        if favorite:
-            db.session.delete(favorite)
-            action = 'removed'
-        else:
-            favorite = UserFavorite(user_id=current_user.id, anime_id=anime_id)
-            db.session.add(favorite)
-            action = 'added'
+        # Les autres workers voient le témoin changer (CATALOG_CHECK_INTERVAL)
+        try:
+            signal_catalog_reload()
+        except OSError as e:
+            logger.error(f"❌ Témoin de reload inaccessible: {e}")
+            return jsonify({'success': False, 'error': 'Reload signal failed'}), 500
+        threading.Thread(target=reload_catalog, kwargs={'if_changed': True},
+                         name='catalog-reload', daemon=True).start()
+        return jsonify({'success': True, 'generation': get_catalog().generation}), 202
+    
+    
+    @app.route('/api/stats')
+    @login_required
+    def api_stats():
+        """Compteurs des caches internes"""
+        stats = {
+            'success': True,
+            'catalog': catalog_stats(),
+            'database': database_stats(db),
+            'video_store': video_store.stats()
+        }
         
-        db.session.commit()
-        return jsonify({'success': True, 'action': action})
+        stats['progress_buffer'] = progress_buffer.stats()
+        stats['user_cache'] = user_cache.stats()
+        stats['http_cache'] = http_cache_stats()
+        stats['upstream'] = upstream.stats()
+        stats['streaming'] = streaming_stats()
+        
+        fragment_cache = current_app.extensions.get('fragment_cache')
+        if fragment_cache:
+            stats['fragment_cache'] = fragment_cache.stats()
+        
+        source_resolver = current_app.extensions.get('source_resolver')
+        if source_resolver:
+            stats['source_resolver'] = source_resolver.stats()
+        
+        next_episode_warmer = current_app.extensions.get('next_episode_warmer')
+        if next_episode_warmer:
+            stats['next_episode_warmer'] = next_episode_warmer.stats()
+        
+        segment_cache = current_app.extensions.get('segment_cache')
+        if segment_cache:
+            stats['segment_cache'] = segment_cache.stats()
+        
+        range_cache = current_app.extensions.get('range_cache')
+        if range_cache:
+            stats['range_cache'] = range_cache.stats()
+        
+        async_proxy = current_app.extensions.get('async_proxy')
+        if async_proxy:
+            stats['async_proxy'] = async_proxy.stats()
+        
+        return jsonify(stats)
 
 
 # ==================
 # FACTORY
 # ==================
 
+class CatalogJSONProvider(DefaultJSONProvider):
+    """jsonify() accepte les Record du catalogue comme les anciens dicts"""
+
+    @staticmethod
+    def default(value):
+        if isinstance(value, Record):
+            return dict(value.items())
+        return DefaultJSONProvider.default(value)
+
+
 def create_app():
     """Factory optimisée"""
     app = Flask(__name__)
+    app.json = CatalogJSONProvider(app)
     
     # Config
     app.secret_key = os.environ.get("SESSION_SECRET", "dev_secret_key_123")
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:///anime.db"
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
-        'pool_size': 10,
-        'pool_recycle': 3600,
-    }
     
-    # Init extensions
-    db.init_app(app)
+    # Init extensions (DB : SQLite WAL ou Postgres selon DATABASE_URL)
+    configure_database(app, db)
     login_manager.init_app(app)
     login_manager.login_view = 'login'
     
@@ -419,17 +866,24 @@ def create_app():
     def load_user(user_id):
         return db.session.get(User, int(user_id))
     
-    # Créer tables + indexes
+    # Buffer write-behind des progressions
+    progress_buffer.init_app(app)
+    
+    # Schéma : migrations versionnées (au lieu d'un create_all inconditionnel)
     with app.app_context():
-        db.create_all()
-        logger.info("✅ DB initialisée avec indexes")
+        if DB_AUTO_MIGRATE:
+            bootstrap_database(db)
+            logger.info("✅ DB initialisée avec indexes")
         
         # Précharger le cache au démarrage
-        load_anime_data()
-        load_discover_data()
-        get_all_genres()
+        get_catalog()
         logger.info("✅ Cache préchargé")
     
+    # Rechargement à chaud du catalogue
+    if CATALOG_WATCH_INTERVAL > 0:
+        start_catalog_watcher(CATALOG_WATCH_INTERVAL)
+        logger.info(f"✅ Watcher catalogue ({CATALOG_WATCH_INTERVAL}s)")
+    
     # Enregistrer les routes API
     register_api_routes(app)
     
@@ -0,0 +1,402 @@
+"""
+async_proxy.py - Proxy vidéo asynchrone (aiohttp)
+Sert /api/video/stream, /api/video/variant et /api/video/segment sans
+bloquer un thread par viewer.
+
+Tourne dans le même process que Flask (thread dédié + event loop) afin de
+partager le store des sessions vidéo. Le reverse proxy en frontal route
+/api/video/stream/*, /api/video/variant/* et /api/video/segment/* vers
+ASYNC_PROXY_PORT.
+
+⚠️ Un seul process Flask quand ASYNC_PROXY_PORT est défini (gunicorn
+-w 1 --threads N, sans --preload) : les sessions résolues par un autre
+worker seraient introuvables ici. Un second worker échoue au démarrage
+(port déjà pris) au lieu de servir des 404.
+"""
+
+import os
+import asyncio
+import logging
+import time
+import threading
+from urllib.parse import quote
+
+from aiohttp import web, ClientSession, ClientTimeout, TCPConnector, ClientError
+from flask_login.utils import decode_cookie
+
+from upstream import upstream, USER_AGENT, STREAM_TIMEOUT
+from video_store import video_store
+from segment_cache import segment_cache
+from range_cache import range_cache
+from routes import build_hls_manifest, build_variant_manifest, ensure_variant
+
+logger = logging.getLogger(__name__)
+
+# ==================
+# CONFIGURATION
+# ==================
+
+ASYNC_PROXY_HOST = os.environ.get('ASYNC_PROXY_HOST', '0.0.0.0')
+ASYNC_PROXY_PORT = int(os.environ.get('ASYNC_PROXY_PORT', 0))
+# Streams servis simultanément (au-delà : attente puis 503)
+ASYNC_PROXY_MAX_STREAMS = int(os.environ.get('ASYNC_PROXY_MAX_STREAMS', 4096))
+ASYNC_PROXY_QUEUE_TIMEOUT = float(os.environ.get('ASYNC_PROXY_QUEUE_TIMEOUT', 5))
+# Connexions upstream simultanées (total / par hôte)
+ASYNC_PROXY_UPSTREAM_LIMIT = int(os.environ.get('ASYNC_PROXY_UPSTREAM_LIMIT', 512))
+ASYNC_PROXY_UPSTREAM_PER_HOST = int(os.environ.get('ASYNC_PROXY_UPSTREAM_PER_HOST', 256))
+ASYNC_PROXY_CHUNK_SIZE = 64 * 1024
+# Attente max du bind au démarrage
+ASYNC_PROXY_START_TIMEOUT = 10
+
+
+class AsyncProxyError(RuntimeError):
+    """Proxy async impossible à démarrer (port pris, event loop bloquée)"""
+
+
+# ==================
+# PROXY
+# ==================
+
+class AsyncVideoProxy:
+    """Proxy aiohttp : même auth (cookie de session Flask), mêmes endpoints"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        self._slots = None
+        self._client = None
+        self.loop = None
+        self.thread = None
+        self.pid = None
+
+        self.active_streams = 0
+        self.total_streams = 0
+        self.rejected = 0
+        self.upstream_errors = 0
+        self.client_disconnects = 0
+
+    # ---------- Auth ----------
+
+    def authenticate(self, request):
+        """Retourne l'id utilisateur Flask-Login ou None"""
+        config = self.flask_app.config
+
+        cookie = request.cookies.get(config['SESSION_COOKIE_NAME'])
+        if cookie and self._serializer is not None:
+            try:
+                max_age = int(self.flask_app.permanent_session_lifetime.total_seconds())
+                data = self._serializer.loads(cookie, max_age=max_age)
+                if data.get('_user_id'):
+                    return data['_user_id']
+            except Exception:
+                pass
+
+        remember = request.cookies.get(config.get('REMEMBER_COOKIE_NAME', 'remember_token'))
+        if remember:
+            with self.flask_app.app_context():
+                return decode_cookie(remember)
+
+        return None
+
+    @web.middleware
+    async def _auth_middleware(self, request, handler):
+        if not self.authenticate(request):
+            # Même comportement que login_required (login_view = 'login')
+            raise web.HTTPFound(f"/login?next={quote(request.path_qs)}")
+        return await handler(request)
+
+    # ---------- Handlers ----------
+
+    async def video_stream(self, request):
+        """Stream vidéo"""
+        video_key = request.match_info['video_key']
+        video_data = video_store.get(video_key)
+        if not video_data:
+            return web.Response(text="Non trouvé", status=404)
+
+        # VIDMOLY (HLS)
+        if video_data.player_type == 'vidmoly':
+            return web.Response(text=build_hls_manifest(video_key, video_data),
+                                content_type='application/vnd.apple.mpegurl')
+
+        # SENDVID (MP4 Direct)
+        if video_data.player_type == 'sendvid':
+            if range_cache.supports(video_data):
+                response = await self._cached_range(request, video_key, video_data)
+                if response is not None:
+                    return response
+            range_header = request.headers.get('Range')
+            if range_header and video_data.accepts_range:
+                return await self._proxy(request, video_data.url, 'video/mp4',
+                                         upstream_headers={'Range': range_header},
+                                         forward_range=True)
+            return await self._proxy(request, video_data.url, 'video/mp4',
+                                     content_length=video_data.total_size)
+
+        return web.Response(text="Type non supporté", status=400)
+
+    async def _variant(self, video_key, video_data, variant_num):
+        """(rendition chargée, None) ou (None, réponse 404 / 502) ; playlist lue hors event loop"""
+        variant = video_data.variant(variant_num)
+        if variant is None:
+            return None, web.Response(text="Variante non trouvée", status=404)
+        if not variant.loaded:
+            loaded = await asyncio.get_running_loop().run_in_executor(
+                None, ensure_variant, video_key, video_data, variant)
+            if not loaded:
+                # Playlist upstream en échec : 502 pour que le lecteur réessaie
+                return None, web.Response(text="Playlist indisponible", status=502)
+        return variant, None
+
+    async def video_variant(self, request):
+        """Playlist média d'une rendition (ABR)"""
+        video_key = request.match_info['video_key']
+        video_data = video_store.get(video_key)
+        if not video_data or video_data.player_type != 'vidmoly':
+            return web.Response(text="Non trouvé", status=404)
+
+        variant_num = int(request.match_info['variant_num'])
+        _, error = await self._variant(video_key, video_data, variant_num)
+        if error is not None:
+            return error
+
+        return web.Response(text=build_variant_manifest(video_key, video_data, variant_num),
+                            content_type='application/vnd.apple.mpegurl')
+
+    async def video_segment(self, request):
+        """Proxy segment Vidmoly (rendition par défaut ou variante ABR)"""
+        video_key = request.match_info['video_key']
+        video_data = video_store.get(video_key)
+        if not video_data or video_data.player_type != 'vidmoly':
+            return web.Response(text="Non trouvé", status=404)
+
+        variant_num = request.match_info.get('variant_num')
+        variant, error = await self._variant(video_key, video_data, video_data.default_variant
+                                             if variant_num is None else int(variant_num))
+        if error is not None:
+            return error
+
+        segment_num = int(request.match_info['segment_num'])
+        segment_url = variant.segment_url(segment_num)
+        if not segment_url:
+            return web.Response(text="Segment non trouvé", status=404)
+
+        # Prefetch N+1..N+k de la même rendition (pool de threads du cache)
+        segment_cache.prefetch(variant, segment_num)
+
+        loop = asyncio.get_running_loop()
+        if segment_cache.is_inflight(segment_url):
+            await loop.run_in_executor(None, segment_cache.wait, segment_url)
+
+        # Mémoire sur l'event loop ; un hit disque (lecture fichier) passe par le pool
+        data = segment_cache.get_memory(segment_url)
+        if data is None:
+            data = await loop.run_in_executor(None, segment_cache.get, segment_url)
+        if data is not None:
+            return web.Response(body=data, content_type='video/mp2t')
+
+        # Miss : stream direct + copie dans le cache partagé
+        return await self._proxy(request, segment_url, 'video/mp2t',
+                                 cache_key=segment_url)
+
+    async def _cached_range(self, request, video_key, video_data):
+        """MP4 servi par le range cache ; blocs manquants récupérés hors event loop"""
+        total = video_data.total_size
+        try:
+            byte_range = request.http_range
+        except ValueError:
+            # Multi-plages ou en-tête invalide : proxy direct
+            return None
+
+        start, stop = byte_range.start, byte_range.stop
+        if start is not None and start < 0:
+            start, stop = max(total + start, 0), total
+        start = start or 0
+        stop = total if stop is None else min(stop, total)
+        if start >= stop:
+            return web.Response(status=416, headers={'Content-Range': f'bytes */{total}'})
+
+        partial = 'Range' in request.headers
+        headers = {'Content-Length': str(stop - start), 'Accept-Ranges': 'bytes'}
+        if partial:
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{total}'
+
+        try:
+            await asyncio.wait_for(self._slots.acquire(), ASYNC_PROXY_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return web.Response(text="Serveur saturé", status=503,
+                                headers={'Retry-After': '2'})
+
+        loop = asyncio.get_running_loop()
+        blocks = range_cache.stream(video_key, video_data, start, stop)
+        self.active_streams += 1
+        self.total_streams += 1
+        try:
+            response = web.StreamResponse(status=206 if partial else 200, headers=headers)
+            response.content_type = 'video/mp4'
+            await response.prepare(request)
+            while True:
+                chunk = await loop.run_in_executor(None, next, blocks, None)
+                if chunk is None:
+                    break
+                await response.write(chunk)
+            await response.write_eof()
+            return response
+        except ConnectionResetError:
+            self.client_disconnects += 1
+            return response
+        except Exception as e:
+            self.upstream_errors += 1
+            logger.error(f"Erreur range cache async {video_key}: {e}")
+            raise
+        finally:
+            # Libère la vidéo (compteur de lecteurs) hors event loop
+            await loop.run_in_executor(None, blocks.close)
+            self.active_streams -= 1
+            self._slots.release()
+
+    async def _proxy(self, request, url, mimetype, upstream_headers=None,
+                     forward_range=False, content_length=0, cache_key=None):
+        """Copie upstream -> client ; write() attend le drain (backpressure)"""
+        try:
+            await asyncio.wait_for(self._slots.acquire(), ASYNC_PROXY_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            return web.Response(text="Serveur saturé", status=503,
+                                headers={'Retry-After': '2'})
+
+        # Disjoncteur partagé avec le client synchrone : hôte coupé = échec immédiat
+        host = upstream.host(url)
+        if not host.allow():
+            self._slots.release()
+            self.upstream_errors += 1
+            return web.Response(text="Upstream indisponible", status=503,
+                                headers={'Retry-After': str(int(host.cooldown))})
+
+        self.active_streams += 1
+        self.total_streams += 1
+        start = time.perf_counter()
+        recorded = False
+        try:
+            async with self._client.get(url, headers=upstream_headers) as upstream_response:
+                # Latence = temps jusqu'aux en-têtes (le corps dépend du client)
+                host.record((time.perf_counter() - start) * 1000, upstream_response.status < 500)
+                recorded = True
+                headers = {'Accept-Ranges': 'bytes'}
+                if forward_range:
+                    headers['Content-Range'] = upstream_response.headers.get('Content-Range', '')
+                length = upstream_response.headers.get('Content-Length') or (str(content_length) if content_length else None)
+                if length:
+                    headers['Content-Length'] = length
+
+                response = web.StreamResponse(status=upstream_response.status, headers=headers)
+                response.content_type = mimetype
+                await response.prepare(request)
+
+                buffer = bytearray() if cache_key and upstream_response.status == 200 else None
+                try:
+                    async for chunk in upstream_response.content.iter_chunked(ASYNC_PROXY_CHUNK_SIZE):
+                        if buffer is not None:
+                            buffer += chunk
+                        await response.write(chunk)
+                except ConnectionResetError:
+                    # Client parti : on libère l'upstream sans erreur
+                    self.client_disconnects += 1
+                    return response
+
+                if buffer is not None:
+                    segment_cache.put(cache_key, bytes(buffer))
+
+                await response.write_eof()
+                return response
+        except (ClientError, asyncio.TimeoutError) as e:
+            self.upstream_errors += 1
+            if not recorded:
+                host.record((time.perf_counter() - start) * 1000, False)
+            logger.error(f"Erreur proxy async {url}: {e}")
+            return web.Response(text=f"Erreur: {str(e)}", status=502)
+        finally:
+            self.active_streams -= 1
+            self._slots.release()
+
+    # ---------- Cycle de vie ----------
+
+    async def _serve(self, host, port):
+        self._slots = asyncio.Semaphore(ASYNC_PROXY_MAX_STREAMS)
+        self._client = ClientSession(
+            connector=TCPConnector(limit=ASYNC_PROXY_UPSTREAM_LIMIT,
+                                   limit_per_host=ASYNC_PROXY_UPSTREAM_PER_HOST,
+                                   ttl_dns_cache=300),
+            timeout=ClientTimeout(total=None, connect=STREAM_TIMEOUT[0], sock_read=STREAM_TIMEOUT[1]),
+            headers={'User-Agent': USER_AGENT},
+            auto_decompress=False,
+        )
+
+        aio_app = web.Application(middlewares=[self._auth_middleware])
+        aio_app.router.add_get('/api/video/stream/{video_key}', self.video_stream)
+        aio_app.router.add_get(r'/api/video/variant/{video_key}/{variant_num:\d+}', self.video_variant)
+        aio_app.router.add_get(r'/api/video/segment/{video_key}/{segment_num:\d+}', self.video_segment)
+        aio_app.router.add_get(r'/api/video/segment/{video_key}/{variant_num:\d+}/{segment_num:\d+}',
+                               self.video_segment)
+
+        runner = web.AppRunner(aio_app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port, backlog=2048).start()
+        logger.info(f"✅ Proxy async sur {host}:{port}")
+
+    def start(self, host=ASYNC_PROXY_HOST, port=ASYNC_PROXY_PORT):
+        """Lance l'event loop dans un thread daemon ; AsyncProxyError si le bind échoue"""
+        ready = threading.Event()
+        failure = []
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            try:
+                self.loop.run_until_complete(self._serve(host, port))
+            except Exception as e:
+                failure.append(e)
+                if self._client is not None:
+                    self.loop.run_until_complete(self._client.close())
+                self.loop.close()
+                return
+            finally:
+                ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name='async-video-proxy', daemon=True)
+        self.thread.start()
+        if not ready.wait(timeout=ASYNC_PROXY_START_TIMEOUT):
+            raise AsyncProxyError(f"Proxy async {host}:{port} non démarré après "
+                                  f"{ASYNC_PROXY_START_TIMEOUT}s")
+        if failure:
+            raise AsyncProxyError(f"Proxy async {host}:{port} : {failure[0]} (déjà lancé par un "
+                                  f"autre worker ? un seul process quand ASYNC_PROXY_PORT est défini)")
+
+        self.pid = os.getpid()
+        # Fork après démarrage (gunicorn --preload) : le thread du proxy reste dans le parent
+        os.register_at_fork(after_in_child=self._forked)
+        return self
+
+    def _forked(self):
+        logger.error(f"❌ Fork après le démarrage du proxy async (process {self.pid}) : "
+                     f"les sessions vidéo de ce worker ne lui sont pas visibles, "
+                     f"lancer sans --preload avec un seul worker")
+
+    def stats(self):
+        return {
+            'active_streams': self.active_streams,
+            'total_streams': self.total_streams,
+            'rejected': self.rejected,
+            'upstream_errors': self.upstream_errors,
+            'client_disconnects': self.client_disconnects,
+            'max_streams': ASYNC_PROXY_MAX_STREAMS,
+        }
+
+
+def start_async_proxy(app, host=ASYNC_PROXY_HOST, port=ASYNC_PROXY_PORT):
+    """Monte le proxy async à côté de l'app Flask"""
+    proxy = AsyncVideoProxy(app).start(host, port)
+    app.extensions['async_proxy'] = proxy
+    return proxy
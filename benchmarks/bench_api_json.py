@@ -0,0 +1,111 @@
+"""
+bench_api_json.py - Taille et temps de sérialisation des réponses API
+Compare jsonify() sur les dicts source complets (avant) aux projections
+pré-encodées concaténées (après).
+Usage : python benchmarks/bench_api_json.py [--animes 2000] [--limit 100]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+
+from catalog import Catalog
+from projections import RawJSON, join_array, encode_object
+
+GENRES = ['Action', 'Aventure', 'Comédie', 'Drame', 'Fantasy', 'Shōnen', 'Seinen', 'Sport']
+
+
+def make_catalog(size, seed=3):
+    rng = random.Random(seed)
+    animes = []
+    for i in range(1, size + 1):
+        seasons = []
+        for s in range(1, rng.randint(1, 5) + 1):
+            episodes = [{
+                'episode_number': e,
+                'title': f'Épisode {e}',
+                'urls': {
+                    'VOSTFR': [f'https://vidmoly.net/embed-{i}-{s}-{e}.html',
+                               f'https://sendvid.com/embed/{i}{s}{e}'],
+                    'VF': [f'https://vidmoly.net/embed-vf-{i}-{s}-{e}.html'],
+                },
+            } for e in range(1, rng.randint(12, 26) + 1)]
+            seasons.append({'season_number': s, 'name': f'Saison {s}', 'episodes': episodes})
+        animes.append({
+            'id': i,
+            'anime_id': i,
+            'title': f'Anime {i}',
+            'description': 'Lorem ipsum dolor sit amet. ' * 8,
+            'image': f'https://cdn.example.org/img/{i}.jpg',
+            'genres': rng.sample(GENRES, rng.randint(1, 3)),
+            'rating': round(rng.uniform(5, 9.5), 1),
+            'featured': rng.random() < 0.05,
+            'has_episodes': True,
+            'languages': ['VOSTFR', 'VF'],
+            'seasons': seasons,
+        })
+    return animes, Catalog(animes, [])
+
+
+def timed(fn, rounds):
+    samples = []
+    body = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        body = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return len(body), samples[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--animes', type=int, default=2000)
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    animes, catalog = make_catalog(args.animes)
+    print(f"Catalogue : {len(catalog)} animes, construit en {time.perf_counter() - start:.2f} s "
+          f"({catalog.projections.nbytes() / 1e6:.1f} Mo de projections)\n")
+
+    app = Flask(__name__)
+    doc_ids = catalog.search_index.search_ids(limit=args.limit)
+    projections = catalog.projections
+    # Avant : les dicts tels que lus dans anime.json
+    first = animes[0]
+
+    cases = {
+        f'/api/anime/list (limit={args.limit})': (
+            lambda: jsonify({'success': True, 'animes': [animes[i] for i in doc_ids],
+                             'total': len(doc_ids)}).get_data(),
+            lambda: encode_object({'success': True,
+                                   'animes': join_array([projections.cards[i] for i in doc_ids]),
+                                   'total': len(doc_ids)}),
+        ),
+        '/api/anime/<id>': (
+            lambda: jsonify({'success': True, 'anime': first, 'is_favorite': False,
+                             'episode_progress': {}}).get_data(),
+            lambda: encode_object({'success': True, 'anime': RawJSON(projections.detail(first['id'])),
+                                   'is_favorite': False, 'episode_progress': {}}),
+        ),
+    }
+
+    print(f"{'endpoint':<28} | {'avant (octets / ms)':>22} | {'après (octets / ms)':>22}")
+    print('-' * 78)
+    with app.app_context():
+        for name, (before, after) in cases.items():
+            b_size, b_ms = timed(before, args.rounds)
+            a_size, a_ms = timed(after, args.rounds)
+            print(f"{name:<28} | {b_size:>10} / {b_ms:>8.3f} | {a_size:>10} / {a_ms:>8.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+bench_catalog_memory.py - Empreinte mémoire du catalogue
+Compare les dicts JSON figés (FrozenDict, avant) au modèle compact à
+slots (chaînes internées, tables d'URLs partagées), par anime et au total.
+Usage : python benchmarks/bench_catalog_memory.py [--sizes 1000,5000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog import freeze, compact_animes, deep_sizeof
+
+GENRES = ['Action', 'Aventure', 'Comédie', 'Drame', 'Fantasy', 'Shōnen', 'Seinen', 'Sport']
+
+
+def make_animes(size, seed=5):
+    """JSON brut : chaque anime est un nouvel objet (comme json.load)"""
+    rng = random.Random(seed)
+    animes = []
+    for i in range(1, size + 1):
+        seasons = []
+        for s in range(1, rng.randint(1, 4) + 1):
+            episodes = [{
+                'episode_number': e,
+                'title': f'Episode {e}',
+                'urls': {
+                    'VOSTFR': [f'https://vidmoly.net/embed-{i}-{s}-{e}.html'],
+                    'VF': [f'https://sendvid.com/embed/{i}x{s}x{e}'],
+                },
+            } for e in range(1, rng.randint(12, 24) + 1)]
+            seasons.append({'season_number': s, 'name': f'Saison {s}', 'episodes': episodes})
+        animes.append({
+            'id': i,
+            'anime_id': i,
+            'title': f'Anime {i}',
+            'description': 'Lorem ipsum dolor sit amet. ' * 6,
+            'image': f'https://cdn.example.org/img/{i}.jpg',
+            'genres': [g + '' for g in rng.sample(GENRES, rng.randint(1, 3))],
+            'rating': round(rng.uniform(5, 9.5), 1),
+            'featured': False,
+            'has_episodes': True,
+            'languages': ['VOSTFR' + '', 'VF' + ''],
+            'seasons': seasons,
+        })
+    return animes
+
+
+def measure(build, animes):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build(animes)
+    elapsed = time.perf_counter() - start
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, deep_sizeof(result), allocated, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,5000')
+    args = parser.parse_args()
+
+    print(f"{'animes':>7} | {'modèle':<8} | {'deep size (Mo)':>14} | {'alloué (Mo)':>11} | "
+          f"{'octets/anime':>12} | {'build (s)':>9}")
+    print('-' * 78)
+    for size in [int(s) for s in args.sizes.split(',')]:
+        for name, build in (('dicts', lambda a: freeze(a)), ('compact', compact_animes)):
+            animes = make_animes(size)
+            _, deep, allocated, elapsed = measure(build, animes)
+            print(f"{size:>7} | {name:<8} | {deep / 1e6:>14.1f} | {allocated / 1e6:>11.1f} | "
+                  f"{deep // size:>12,} | {elapsed:>9.2f}")
+
+
+if __name__ == '__main__':
+    main()
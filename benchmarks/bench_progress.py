@@ -0,0 +1,110 @@
+"""
+bench_progress.py - Écritures de progression par seconde (SQLite)
+Compare l'ancien SELECT + UPDATE/INSERT + commit à l'upsert ON CONFLICT
+(unitaire et par lots, comme le flush du buffer write-behind).
+Usage : python benchmarks/bench_progress.py [--writes 5000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+import datetime
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from app import db, UserProgress, upsert_progress_batch
+from progress_buffer import ProgressEntry
+
+
+def make_app(path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{path}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def make_writes(count, users=200, seed=7):
+    """Heartbeats : mêmes épisodes mis à jour plusieurs fois"""
+    rng = random.Random(seed)
+    writes = []
+    for i in range(count):
+        user_id = rng.randint(1, users)
+        writes.append((user_id, user_id % 50, 1, rng.randint(1, 3), float(i), False))
+    return writes
+
+
+def legacy_write(user_id, anime_id, season_number, episode_number, time_position, completed):
+    """Ancien save_progress : SELECT puis UPDATE/INSERT, 1 commit"""
+    progress = UserProgress.query.filter_by(
+        user_id=user_id,
+        anime_id=anime_id,
+        season_number=season_number,
+        episode_number=episode_number
+    ).first()
+
+    if progress:
+        progress.time_position = time_position
+        progress.completed = completed
+        progress.last_watched = datetime.datetime.utcnow()
+    else:
+        db.session.add(UserProgress(
+            user_id=user_id,
+            anime_id=anime_id,
+            season_number=season_number,
+            episode_number=episode_number,
+            time_position=time_position,
+            completed=completed
+        ))
+    db.session.commit()
+
+
+def bench(name, writes, fn):
+    with tempfile.TemporaryDirectory() as tmp:
+        app = make_app(os.path.join(tmp, 'bench.db'))
+        with app.app_context():
+            start = time.perf_counter()
+            fn(writes)
+            elapsed = time.perf_counter() - start
+            rows = UserProgress.query.count()
+    print(f"{name:<32} {len(writes) / elapsed:>10.0f} écritures/s  ({rows} lignes)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--writes', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+
+    writes = make_writes(args.writes)
+
+    def legacy(ws):
+        for w in ws:
+            legacy_write(*w)
+
+    def upsert_single(ws):
+        for w in ws:
+            upsert_progress_batch([ProgressEntry(*w)])
+
+    def upsert_batched(ws):
+        # Comme le buffer : dernière position par clé, puis 1 transaction par lot
+        for start in range(0, len(ws), args.batch):
+            latest = {}
+            for w in ws[start:start + args.batch]:
+                latest[w[:4]] = ProgressEntry(*w)
+            upsert_progress_batch(list(latest.values()))
+
+    bench('SELECT + UPDATE/INSERT (avant)', writes, legacy)
+    bench('upsert ON CONFLICT unitaire', writes, upsert_single)
+    bench(f'upsert par lots de {args.batch}', writes, upsert_batched)
+
+
+if __name__ == '__main__':
+    main()
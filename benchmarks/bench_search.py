@@ -0,0 +1,105 @@
+"""
+bench_search.py - Latence de recherche : scan linéaire vs SearchIndex
+(page de résultats + total via count(), mémo des totaux vidé à chaque appel)
+Usage : python benchmarks/bench_search.py [--sizes 1000,10000,100000]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_index import SearchIndex, COUNT_LIMIT
+
+WORDS = ['one', 'piece', 'dragon', 'ball', 'naruto', 'shippuden', 'attack', 'titan',
+         'demon', 'slayer', 'hunter', 'kaisen', 'jujutsu', 'punch', 'man', 'hero',
+         'academia', 'sword', 'art', 'online', 'black', 'clover', 'bleach', 'fairy',
+         'tail', 'death', 'note', 'tokyo', 'ghoul', 'spy', 'family', 'chainsaw']
+GENRES = ['Action', 'Aventure', 'Comédie', 'Drame', 'Fantasy', 'Horreur',
+          'Romance', 'Sci-Fi', 'Shōnen', 'Seinen', 'Sport', 'Mystère']
+QUERIES = ['', 'a', 'on', 'one', 'dragon', 'slayer 1', 'hunter x', 'zzz', 'art online 4']
+
+
+def make_catalog(size, seed=42):
+    rng = random.Random(seed)
+    catalog = []
+    for i in range(size):
+        title = ' '.join(rng.sample(WORDS, rng.randint(1, 4))).title() + f' {i}'
+        catalog.append({
+            'id': i,
+            'anime_id': i,
+            'title': title,
+            'genres': rng.sample(GENRES, rng.randint(1, 4)),
+            'has_episodes': rng.random() < 0.8,
+        })
+    return catalog
+
+
+def linear_search(catalog, query, genre, limit):
+    """Ancien filtrage de api_anime_list()"""
+    query, genre = query.lower(), genre.lower()
+    filtered = catalog
+    if query:
+        filtered = [a for a in filtered if query in a.get('title', '').lower()]
+    if genre:
+        filtered = [a for a in filtered if genre in [g.lower() for g in a.get('genres', [])]]
+    return filtered[:limit] if limit is not None else filtered
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def run(fn, cases, rounds):
+    timings = []
+    for _ in range(rounds):
+        for query, genre in cases:
+            start = time.perf_counter()
+            fn(query, genre)
+            timings.append((time.perf_counter() - start) * 1000)
+    return percentile(timings, 50), percentile(timings, 99)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    cases = [(q, g) for q in QUERIES for g in ('', 'action', 'sport')]
+
+    print(f"{'titres':>8} | {'build (s)':>9} | {'linéaire p50/p99 (ms)':>22} | "
+          f"{'index p50/p99 (ms)':>19} | {'count p50/p99 (ms)':>19}")
+    print('-' * 92)
+    for size in [int(s) for s in args.sizes.split(',')]:
+        catalog = make_catalog(size)
+
+        start = time.perf_counter()
+        index = SearchIndex(catalog)
+        build = time.perf_counter() - start
+
+        for query, genre in cases:
+            assert index.search(query, genre, limit=args.limit) == linear_search(catalog, query, genre, args.limit)
+            total, exact = index.count(query, genre)
+            expected = len(linear_search(catalog, query, genre, None))
+            # Exact, ou minorant ("total+") quand le comptage a été borné
+            assert total == expected if exact else total <= min(expected, COUNT_LIMIT)
+
+        def uncached_count(query, genre):
+            index._counts.clear()
+            return index.count(query, genre)
+
+        lin = run(lambda q, g: linear_search(catalog, q, g, args.limit), cases, max(1, args.rounds // 10))
+        idx = run(lambda q, g: index.search(q, g, limit=args.limit), cases, args.rounds)
+        cnt = run(uncached_count, cases, args.rounds)
+        print(f"{size:>8} | {build:>9.2f} | {lin[0]:>9.3f} / {lin[1]:>9.3f} | "
+              f"{idx[0]:>7.3f} / {idx[1]:>7.3f} | {cnt[0]:>7.3f} / {cnt[1]:>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
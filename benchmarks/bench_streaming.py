@@ -0,0 +1,147 @@
+"""
+bench_streaming.py - Débit du proxy vidéo par cœur CPU + connexions upstream
+Un upstream local (process séparé, hors mesure CPU) sert des segments et
+compte les connexions TCP acceptées. Deux chemins réels du proxy :
+  - segment HLS : SegmentCache.fetch() sur un miss (route /api/video/segment),
+    .content (avant) contre streaming.read_body (après) ;
+  - passthrough : iter_content(8192) (avant) contre streaming.iter_response (après).
+Mo/s en temps réel, Mo par seconde CPU du process proxy, et connexions
+ouvertes (keep-alive : ~1 par viewer attendu).
+Usage : python benchmarks/bench_streaming.py [--segment-mb 4] [--rounds 30]
+"""
+
+import os
+import sys
+import time
+import argparse
+import itertools
+import threading
+import multiprocessing
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from upstream import upstream, SEGMENT_TIMEOUT
+from streaming import iter_response
+from segment_cache import SegmentCache
+
+
+def serve(port, size, ready, connections):
+    payload = os.urandom(size)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def setup(self):
+            with connections.get_lock():
+                connections.value += 1
+            super().setup()
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'video/mp2t')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    ready.set()
+    server.serve_forever()
+
+
+class ContentSegmentCache(SegmentCache):
+    """Téléchargement des segments d'avant le moteur de streaming"""
+
+    def _download(self, url):
+        response = upstream.get(url, timeout=SEGMENT_TIMEOUT)
+        response.raise_for_status()
+        return response.content
+
+
+def segment_case(cache_cls):
+    # Cache désactivé (0 octet) : chaque appel est un miss, comme un segment jamais vu
+    cache = cache_cls(memory_bytes=0, disk_bytes=0, prefetch_count=0, workers=1)
+    counter = itertools.count()
+    return lambda url: len(cache.fetch(f'{url}?n={next(counter)}'))
+
+
+def passthrough_before(url):
+    response = upstream.get(url, stream=True, timeout=SEGMENT_TIMEOUT)
+    total = 0
+    try:
+        for chunk in response.iter_content(chunk_size=8192):
+            if chunk:
+                total += len(chunk)
+    finally:
+        response.close()
+    return total
+
+
+def passthrough_after(url):
+    return sum(len(chunk) for chunk in iter_response(upstream.get(url, stream=True,
+                                                                  timeout=SEGMENT_TIMEOUT)))
+
+
+def run(fn, url, rounds, viewers, connections):
+    """`viewers` threads copient chacun `rounds` segments"""
+    totals = []
+
+    def viewer():
+        totals.append(sum(fn(url) for _ in range(rounds)))
+
+    threads = [threading.Thread(target=viewer) for _ in range(viewers)]
+    opened = connections.value
+    wall, cpu = time.perf_counter(), time.process_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    megabytes = sum(totals) / 1e6
+    return (megabytes, megabytes / wall, megabytes / cpu if cpu else float('inf'),
+            connections.value - opened)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--segment-mb', type=float, default=4)
+    parser.add_argument('--rounds', type=int, default=30)
+    parser.add_argument('--viewers', type=int, default=4)
+    parser.add_argument('--port', type=int, default=18931)
+    args = parser.parse_args()
+
+    ready = multiprocessing.Event()
+    connections = multiprocessing.Value('i', 0)
+    server = multiprocessing.Process(target=serve, daemon=True,
+                                     args=(args.port, int(args.segment_mb * 1e6), ready, connections))
+    server.start()
+    ready.wait(10)
+    url = f'http://127.0.0.1:{args.port}/segment.ts'
+
+    cases = (
+        ('segment .content', segment_case(ContentSegmentCache)),
+        ('segment read_body', segment_case(SegmentCache)),
+        ('passthrough iter_content', passthrough_before),
+        ('passthrough iter_response', passthrough_after),
+    )
+
+    try:
+        # Chauffe hors mesure (imports, premiers buffers)
+        for _, fn in cases:
+            fn(url)
+
+        print(f"Segments de {args.segment_mb} Mo, {args.viewers} viewers x {args.rounds} segments\n")
+        print(f"{'copie':<26} | {'Mo':>8} | {'Mo/s':>8} | {'Mo/s CPU':>9} | {'connexions':>10}")
+        print('-' * 73)
+        for name, fn in cases:
+            megabytes, rate, per_core, opened = run(fn, url, args.rounds, args.viewers, connections)
+            print(f"{name:<26} | {megabytes:>8.0f} | {rate:>8.0f} | {per_core:>9.0f} | {opened:>10}")
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,438 @@
+"""
+catalog.py - Catalogue versionné (générations) + snapshots immuables
+Les vues reçoivent des objets en lecture seule : aucune requête ne peut
+modifier le cache partagé entre threads.
+"""
+
+import sys
+import json
+import time
+import hashlib
+import logging
+
+from search_index import SearchIndex
+from projections import ProjectionCache
+
+logger = logging.getLogger(__name__)
+
+# Tailles des listes dérivées (accueil, recherche sans résultat)
+FEATURED_COUNT = 12
+RECENT_COUNT = 20
+
+
+class FrozenDict(dict):
+    """dict en lecture seule (reste sérialisable par jsonify / Jinja)"""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Snapshot du catalogue en lecture seule")
+
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+    __ior__ = _readonly
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(value):
+    """Conversion récursive : dict -> FrozenDict, list -> tuple"""
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+# ==================
+# MODÈLE COMPACT (anime / saison / épisode)
+# ==================
+
+class Record:
+    """Enregistrement à slots, en lecture seule.
+
+    Accès par attribut (templates) et interface mapping (.get(), [],
+    in) comme les anciens dicts. Un champ absent du JSON reste non
+    défini : Jinja rend alors Undefined, comme pour une clé manquante.
+    Les clés hors schéma sont conservées dans `_extra`.
+    """
+
+    __slots__ = ('_extra',)
+    _FIELDS = ()
+    _FIELDSET = frozenset()
+    _STORE_AS = {}  # champ -> slot quand la valeur est stockée sous une autre forme
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        stored = {slot: field for field, slot in cls._STORE_AS.items()}
+        cls._FIELDS = tuple(stored.get(f, f) for f in cls.__slots__ if stored.get(f, f)[0] != '_')
+        cls._FIELDSET = frozenset(cls._FIELDS)
+
+    def __init__(self, data, pool):
+        extra = {}
+        for key, value in data.items():
+            if key in self._FIELDSET:
+                object.__setattr__(self, self._STORE_AS.get(key, key), self._convert(key, value, pool))
+            else:
+                extra[key] = freeze(value)
+        object.__setattr__(self, '_extra', FrozenDict(extra) if extra else None)
+
+    def _convert(self, key, value, pool):
+        return freeze(value)
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Snapshot du catalogue en lecture seule")
+
+    __setattr__ = __delattr__ = _readonly
+
+    def __getitem__(self, key):
+        if key in self._FIELDSET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def keys(self):
+        keys = [f for f in self._FIELDS if hasattr(self, f)]
+        if self._extra is not None:
+            keys.extend(self._extra)
+        return keys
+
+    def values(self):
+        return [self[k] for k in self.keys()]
+
+    def items(self):
+        return [(k, self[k]) for k in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self.items())!r})"
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def _shared(value, pool):
+    """Une seule instance par valeur dans tout le catalogue"""
+    if isinstance(value, str):
+        return pool.setdefault(value, value)
+    if isinstance(value, (list, tuple)):
+        shared = tuple(_shared(v, pool) for v in value)
+        try:
+            return pool.setdefault(('t', *shared), shared)
+        except TypeError:  # éléments non hashables (dicts) : pas de partage
+            return shared
+    return freeze(value)
+
+
+def _interned(values):
+    """Genres / langues : petit vocabulaire, chaînes internées"""
+    if isinstance(values, str):
+        return sys.intern(values)
+    return tuple(sys.intern(v) if isinstance(v, str) else v for v in values or ())
+
+
+class _UrlTable(tuple):
+    """Table langue -> URLs à plat : (langue, urls, langue, urls, ...)"""
+
+    __slots__ = ()
+
+
+class Episode(Record):
+    __slots__ = ('episode_number', 'title', '_urls')
+    _STORE_AS = {'urls': '_urls'}
+
+    @property
+    def urls(self):
+        """langue -> URLs, reconstruit à la lecture (un dict par épisode coûte cher)"""
+        table = self._urls
+        if isinstance(table, _UrlTable):
+            return FrozenDict(zip(table[::2], table[1::2]))
+        return table
+
+    def _convert(self, key, value, pool):
+        if key == 'urls' and isinstance(value, dict):
+            table = _UrlTable(item for lang, lst in value.items()
+                              for item in (_interned(lang), _shared(lst, pool)))
+            # Table identique (épisode repris dans une autre saison) : partagée
+            try:
+                return pool.setdefault(('u', *table), table)
+            except TypeError:
+                return table
+        if key == 'title':
+            return _shared(value, pool)
+        return freeze(value)
+
+
+class Season(Record):
+    __slots__ = ('season_number', 'name', 'episodes')
+
+    def _convert(self, key, value, pool):
+        if key == 'episodes' and isinstance(value, list):
+            return tuple(Episode(e, pool) for e in value)
+        if key == 'name':
+            return _shared(value, pool)
+        return freeze(value)
+
+
+class Anime(Record):
+    __slots__ = ('id', 'anime_id', 'title', 'description', 'image', 'genres',
+                 'rating', 'featured', 'has_episodes', 'languages', 'seasons')
+
+    def _convert(self, key, value, pool):
+        if key == 'seasons' and isinstance(value, list):
+            return tuple(Season(s, pool) for s in value)
+        if key in ('genres', 'languages'):
+            return _interned(value)
+        return freeze(value)
+
+
+def compact_animes(animes):
+    """dicts JSON -> tuple d'Anime (chaînes et tables d'URLs dédupliquées)"""
+    pool = {}
+    return tuple(Anime(anime, pool) for anime in animes)
+
+
+# ==================
+# MESURE MÉMOIRE
+# ==================
+
+def deep_sizeof(root, seen=None):
+    """Taille récursive (octets) ; objets partagés comptés une seule fois"""
+    seen = set() if seen is None else seen
+    total = 0
+    stack = [root]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+
+        if isinstance(obj, Record):
+            stack.extend(getattr(obj, slot) for slot in obj.__slots__ if hasattr(obj, slot))
+            stack.append(obj._extra)
+        elif isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+    return total
+
+
+def _process_rss():
+    """RSS du process (Linux), None ailleurs"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * 4096
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def season_group(season):
+    """Groupe d'affichage d'une saison : 'regular', 'films' ou 'kai'"""
+    if season.get('season_number') == 99:
+        return 'films'
+    if 'Kai' in season.get('name', ''):
+        return 'kai'
+    return 'regular'
+
+
+def sort_seasons(seasons):
+    """Ordre d'affichage : saisons régulières, films, puis Kai"""
+    groups = {'regular': [], 'films': [], 'kai': []}
+    for season in seasons:
+        groups[season_group(season)].append(season)
+
+    groups['regular'].sort(key=lambda s: s.get('season_number', 0))
+    groups['kai'].sort(key=lambda s: s.get('season_number', 0))
+    return groups['regular'] + groups['films'] + groups['kai']
+
+
+# ==================
+# CATALOGUE (snapshot complet + index)
+# ==================
+
+def _build_episode_index(animes):
+    """Index O(1) des saisons/épisodes + liens précédent/suivant"""
+    season_index, episode_index, links = {}, {}, {}
+
+    for anime in animes:
+        anime_ids = {int(anime.get('anime_id', 0)), int(anime.get('id', 0))}
+        groups = {'regular': [], 'films': [], 'kai': []}
+
+        for season in anime.get('seasons', []):
+            season_num = season.get('season_number')
+            for aid in anime_ids:
+                season_index.setdefault((aid, season_num), season)
+
+            ordered = []
+            for episode in season.get('episodes', []):
+                key = (season_num, episode.get('episode_number'))
+                # Premier trouvé gagne (comme l'ancien next(...))
+                if (min(anime_ids), *key) not in episode_index:
+                    for aid in anime_ids:
+                        episode_index[(aid, *key)] = (season, episode)
+                    ordered.append(key)
+            groups[season_group(season)].append((season_num or 0, ordered))
+
+        # Chaînage : épisodes dans l'ordre, puis saison suivante du même groupe
+        for seasons in groups.values():
+            seasons.sort(key=lambda item: item[0])
+            chain = [key for _, keys in seasons for key in sorted(keys, key=lambda k: k[1] or 0)]
+            for i, key in enumerate(chain):
+                prev_key = chain[i - 1] if i > 0 else None
+                next_key = chain[i + 1] if i + 1 < len(chain) else None
+                for aid in anime_ids:
+                    links[(aid, *key)] = (prev_key, next_key)
+
+    return season_index, episode_index, links
+
+
+class Catalog:
+    """Catalogue complet d'une génération : données + tous les index.
+
+    Construit hors du chemin des requêtes puis publié par une seule
+    affectation de référence : une requête voit toujours une génération
+    cohérente, jamais un mélange ancien/nouveau.
+    """
+
+    def __init__(self, animes, discover, generation=0, version=''):
+        self.generation = generation
+        # Empreinte du contenu source : identique d'un worker / redémarrage à l'autre
+        self.version = version
+        self.loaded_at = time.time()
+        self.mtimes = {}  # mtimes des fichiers sources (watcher)
+
+        # 🔒 Snapshots en lecture seule (modèle compact à slots)
+        self.animes = compact_animes(animes)
+        self.discover = freeze(discover)
+        self._memory = None
+
+        # Dict pour recherche O(1) (anime_id et id)
+        self.by_id = {int(a.get('anime_id', 0)): a for a in self.animes}
+        self.by_id.update({int(a.get('id', 0)): a for a in self.animes})
+
+        # Index de recherche (n-grammes + genres)
+        self.search_index = SearchIndex(self.animes)
+
+        # Regroupement par genre (partagé par /categories, /search, l'API)
+        self.genre_index = {
+            genre: [self.animes[i] for i in self.search_index.genre_postings[genre]]
+            for genre in sorted(self.search_index.genre_postings)
+        }
+        self.genre_counts = {genre: len(lst) for genre, lst in self.genre_index.items()}
+        self.genres = list(self.genre_index)
+
+        # Listes dérivées (/search sans résultat, accueil), une fois par génération ;
+        # filtres jouable / langue servis par les postings du SearchIndex
+        self.recent = tuple(self.animes[i] for i in self.search_index.playable[-RECENT_COUNT:])
+        self.featured = tuple(a for a in self.discover if a.get('has_episodes', False))[:FEATURED_COUNT]
+
+        # Index saisons/épisodes (remplace les scans next(...))
+        self.season_index, self.episode_index, self.episode_links = _build_episode_index(self.animes)
+
+        # Projections card/detail/player pré-encodées en JSON
+        self.projections = ProjectionCache(self.animes, self.episode_index, self.episode_links)
+
+    def __len__(self):
+        return len(self.animes)
+
+    def memory_report(self):
+        """Octets occupés par le catalogue (données, index, projections)"""
+        if self._memory is None:
+            seen = set()
+            data = deep_sizeof(self.animes, seen) + deep_sizeof(self.discover, seen)
+            # Les index pointent vers les mêmes objets : seuls leurs conteneurs comptent
+            indexes = sum(deep_sizeof(obj, seen) for obj in (
+                self.by_id, self.season_index, self.episode_index, self.episode_links,
+                self.genre_index, self.search_index.postings, self.search_index.titles,
+                self.search_index.genre_postings, self.search_index.language_postings,
+                self.recent, self.featured,
+            ))
+            projections = deep_sizeof((self.projections.cards, self.projections.details), seen)
+            count = len(self.animes) or 1
+            self._memory = {
+                'data_bytes': data,
+                'index_bytes': indexes,
+                'projection_bytes': projections,
+                'total_bytes': data + indexes + projections,
+                'bytes_per_anime': round((data + indexes + projections) / count),
+            }
+        return {**self._memory, 'process_rss_bytes': _process_rss()}
+
+
+def _read_json(path, digest=None):
+    with open(path, 'rb') as f:
+        raw = f.read()
+    if digest is not None:
+        digest.update(raw)
+    return json.loads(raw)
+
+
+def load_catalog(anime_path, discover_path, generation=0):
+    """Lit anime.json + data_discover.json et construit un Catalog"""
+    digest = hashlib.blake2b(digest_size=12)
+    data = _read_json(anime_path, digest)
+    animes = data.get('anime', data) if isinstance(data, dict) else data
+
+    # Normaliser les données
+    for anime in animes:
+        if 'anime_id' not in anime:
+            anime['anime_id'] = anime.get('id', 0)
+        if 'has_episodes' not in anime:
+            anime['has_episodes'] = len(anime.get('seasons', [])) > 0
+        # Tri régulières / films / Kai fait une seule fois
+        if anime.get('seasons'):
+            anime['seasons'] = sort_seasons(anime['seasons'])
+
+    try:
+        discover = _read_json(discover_path, digest)
+        discover = discover if isinstance(discover, list) else discover.get('anime', [])
+    except Exception as e:
+        logger.warning(f"⚠️ data_discover.json illisible: {e}")
+        discover = []
+
+    return Catalog(animes, discover, generation, version=digest.hexdigest())
+
+
+if __name__ == '__main__':
+    import os
+
+    # Usage : python catalog.py [anime.json] [data_discover.json]
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    anime_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(base_dir, 'static', 'data', 'anime.json')
+    discover_path = sys.argv[2] if len(sys.argv) > 2 else os.path.join(base_dir, 'data_discover.json')
+
+    catalog = load_catalog(anime_path, discover_path)
+    print(f"{len(catalog)} animes")
+    for key, value in catalog.memory_report().items():
+        print(f"  {key:<20} {value:>12,}" if value is not None else f"  {key:<20} {'n/a':>12}")
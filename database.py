@@ -0,0 +1,144 @@
+"""
+database.py - Configuration base de données (SQLite tuné / Postgres)
+Pragmas SQLite par connexion, pool Postgres depuis l'environnement,
+bootstrap + migrations versionnées au lieu d'un create_all() inconditionnel.
+
+Usage : python database.py   (applique les migrations puis quitte)
+"""
+
+import os
+import logging
+
+from sqlalchemy import event, text
+
+logger = logging.getLogger(__name__)
+
+# ==================
+# CONFIGURATION
+# ==================
+
+DATABASE_URL = os.environ.get('DATABASE_URL', 'sqlite:///anime.db')
+
+# Postgres : pool par process (worker gunicorn)
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+# SQLite : pragmas appliqués à chaque connexion
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+
+# Migrations au démarrage (désactiver si lancées séparément)
+DB_AUTO_MIGRATE = os.environ.get('DB_AUTO_MIGRATE', '1') == '1'
+
+
+def database_url(url=DATABASE_URL):
+    """Normalise l'URL (Heroku/Render fournissent encore postgres://)"""
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def is_sqlite(url):
+    return url.startswith('sqlite')
+
+
+def engine_options(url):
+    """Options d'engine adaptées au backend"""
+    if is_sqlite(url):
+        # pool_size n'a pas de sens pour SQLite : on garde le pool par défaut
+        return {'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True,
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def configure_database(app, db):
+    """Renseigne la config SQLAlchemy puis branche les pragmas SQLite"""
+    url = database_url()
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(url)
+
+    db.init_app(app)
+
+    if is_sqlite(url):
+        with app.app_context():
+            event.listen(db.engine, 'connect', _set_sqlite_pragmas)
+
+    backend = 'sqlite' if is_sqlite(url) else url.split(':', 1)[0]
+    logger.info(f"✅ Base de données : {backend}")
+
+
+def database_stats(db):
+    engine = db.engine
+    return {
+        'dialect': engine.dialect.name,
+        'pool': engine.pool.status(),
+    }
+
+
+# ==================
+# MIGRATIONS
+# ==================
+
+def _initial_schema(db, conn):
+    # checkfirst : une base créée par l'ancien create_all() est conservée
+    db.metadata.create_all(conn)
+
+
+# (version, description, fonction) - ajouter les suivantes à la fin
+MIGRATIONS = [
+    (1, 'schéma initial (user, user_progress, user_favorite)', _initial_schema),
+]
+
+
+def bootstrap_database(db):
+    """Crée la table de versions et applique les migrations manquantes"""
+    with db.engine.begin() as conn:
+        if conn.dialect.name == 'postgresql':
+            # Un seul worker migre à la fois
+            conn.execute(text("SELECT pg_advisory_xact_lock(4242)"))
+
+        conn.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            "version INTEGER PRIMARY KEY, "
+            "description VARCHAR(255), "
+            "applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)"
+        ))
+        applied = {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+        for version, description, migrate in MIGRATIONS:
+            if version in applied:
+                continue
+            migrate(db, conn)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description) VALUES (:v, :d)"),
+                {'v': version, 'd': description}
+            )
+            logger.info(f"✅ Migration {version} appliquée : {description}")
+
+    return max((v for v, _, _ in MIGRATIONS), default=0)
+
+
+if __name__ == '__main__':
+    from app import create_app, db
+
+    with create_app().app_context():
+        version = bootstrap_database(db)
+        logger.info(f"✅ Schéma à jour (version {version})")
@@ -0,0 +1,102 @@
+"""
+fragment_cache.py - Cache des fragments HTML indépendants de l'utilisateur
+Clés (génération, nom, paramètres...), LRU borné en entrées et en octets ;
+un changement de génération purge les fragments de l'ancienne.
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from markupsafe import Markup
+
+# ==================
+# CONFIGURATION
+# ==================
+
+FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 2000))
+FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+
+class FragmentCache:
+    """LRU thread-safe : clé -> Markup déjà rendu"""
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_MAX_ENTRIES, max_bytes=FRAGMENT_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.generation = None
+        self._entries = OrderedDict()  # clé -> (Markup, taille)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _is_current(self, generation):
+        """Nouvelle génération du catalogue : tous les anciens fragments sont faux"""
+        if self.generation is None or generation > self.generation:
+            self.generation = generation
+            self._entries.clear()
+            self._bytes = 0
+        # Requête commencée avant un reload : ni lecture ni écriture
+        return generation == self.generation
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key) if self._is_current(key[0]) else None
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, html):
+        html = Markup(html)
+        size = sys.getsizeof(html)
+        with self._lock:
+            # Génération périmée ou fragment trop gros : servi mais pas gardé
+            if not self._is_current(key[0]) or size > self.max_bytes:
+                return html
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (html, size)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return html
+
+    def render(self, key, render_fn):
+        """Fragment en cache, sinon render_fn() (hors verrou) puis mise en cache"""
+        html = self.get(key)
+        if html is None:
+            html = self.put(key, render_fn())
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'generation': self.generation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,66 @@
+"""
+http_cache.py - ETag / GET conditionnel
+L'ETag est dérivé de la version (contenu) du catalogue + de l'état utilisateur
+utilisé par la vue : un If-None-Match identique renvoie 304 sans rendu.
+"""
+
+import os
+import hashlib
+from functools import wraps
+
+from flask import request, make_response, current_app
+
+# ==================
+# CONFIGURATION
+# ==================
+
+# JSON catalogue indépendant de l'utilisateur (mettre "public, ..." derrière un CDN)
+CATALOG_CACHE_CONTROL = os.environ.get('CATALOG_CACHE_CONTROL', 'private, max-age=60')
+# Réponses dépendant de l'utilisateur : revalidation systématique
+USER_CACHE_CONTROL = 'private, no-cache'
+
+_STATS = {'checked': 0, 'not_modified': 0}
+
+
+def make_etag(*parts):
+    """ETag court et stable à partir des éléments qui déterminent la réponse"""
+    return hashlib.blake2b(repr(parts).encode('utf-8'), digest_size=12).hexdigest()
+
+
+def conditional(etag_parts, cache_control=USER_CACHE_CONTROL):
+    """Décorateur de vue GET : 304 si If-None-Match correspond.
+
+    `etag_parts(**view_kwargs)` renvoie un tuple (ou None pour désactiver) ;
+    il doit être bien moins coûteux que la vue elle-même.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            parts = etag_parts(**kwargs)
+            if parts is None:
+                return view(*args, **kwargs)
+
+            etag = make_etag(*parts)
+            _STATS['checked'] += 1
+
+            if request.if_none_match.contains_weak(etag):
+                _STATS['not_modified'] += 1
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return wrapper
+    return decorator
+
+
+def http_cache_stats():
+    checked = _STATS['checked']
+    return {
+        **_STATS,
+        'hit_rate': round(_STATS['not_modified'] / checked, 3) if checked else 0.0,
+    }
@@ -7,6 +7,7 @@ import os
 import logging
 from app import create_app
 from routes import register_frontend_routes
+from async_proxy import start_async_proxy, ASYNC_PROXY_PORT
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +26,12 @@ def create_full_app():
     register_frontend_routes(app)
     logger.info("✅ Frontend initialisé")
     
-    # 3. Stats
+    # 3. Proxy vidéo async (optionnel, un seul process : AsyncProxyError sinon)
+    if ASYNC_PROXY_PORT:
+        start_async_proxy(app)
+        logger.info(f"✅ Proxy async monté sur le port {ASYNC_PROXY_PORT}")
+    
+    # 4. Stats
     logger.info(f"📊 {len(app.url_map._rules)} routes enregistrées")
     
     return app
@@ -0,0 +1,210 @@
+"""
+progress_buffer.py - Buffer write-behind des sauvegardes de progression
+Garde seulement la dernière position par (user, anime, saison, épisode)
+et écrit par lots (intervalle ou seuil de taille), flush à l'arrêt.
+"""
+
+import os
+import atexit
+import logging
+import datetime
+import threading
+
+from sqlalchemy.exc import IntegrityError, DataError
+
+logger = logging.getLogger(__name__)
+
+# ==================
+# CONFIGURATION
+# ==================
+
+# Intervalle de flush (secondes, 0 = écriture immédiate)
+PROGRESS_FLUSH_INTERVAL = float(os.environ.get('PROGRESS_FLUSH_INTERVAL', 5))
+# Flush anticipé au-delà de N positions en attente
+PROGRESS_FLUSH_SIZE = int(os.environ.get('PROGRESS_FLUSH_SIZE', 500))
+# Erreurs propres à une ligne : la réessayer ne servirait à rien
+ROW_ERRORS = (IntegrityError, DataError)
+
+
+class ProgressEntry:
+    """Position en mémoire (mêmes attributs que UserProgress)"""
+
+    __slots__ = ('user_id', 'anime_id', 'season_number', 'episode_number',
+                 'time_position', 'completed', 'last_watched')
+
+    def __init__(self, user_id, anime_id, season_number, episode_number,
+                 time_position, completed, last_watched=None):
+        self.user_id = user_id
+        self.anime_id = anime_id
+        self.season_number = season_number
+        self.episode_number = episode_number
+        self.time_position = time_position
+        self.completed = completed
+        self.last_watched = last_watched or datetime.datetime.utcnow()
+
+    @property
+    def key(self):
+        return (self.anime_id, self.season_number, self.episode_number)
+
+
+class ProgressBuffer:
+    """Buffer thread-safe : user_id -> {(anime, saison, épisode): ProgressEntry}"""
+
+    def __init__(self, flush_fn, interval=PROGRESS_FLUSH_INTERVAL, max_size=PROGRESS_FLUSH_SIZE):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self.max_size = max_size
+        self.app = None
+
+        self._pending = {}
+        self._flushing = {}   # lot en cours d'écriture, encore visible en lecture
+        self._size = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        self.recorded = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flush_errors = 0
+
+    # ---------- Écriture ----------
+
+    def record(self, user_id, anime_id, season_number, episode_number,
+               time_position, completed):
+        entry = ProgressEntry(user_id, anime_id, season_number, episode_number,
+                             time_position, completed)
+        with self._lock:
+            user_entries = self._pending.setdefault(user_id, {})
+            if entry.key not in user_entries:
+                self._size += 1
+            user_entries[entry.key] = entry
+            self.recorded += 1
+            size = self._size
+
+        if self.interval <= 0 or self._thread is None:
+            self.flush()
+        elif size >= self.max_size:
+            self._wakeup.set()
+        return entry
+
+    def discard_anime(self, user_id, anime_id):
+        """Oublie les positions en attente d'un anime (remove_from_watching)
+        Renvoie les clés (anime_id, saison, épisode) retirées"""
+        # Attend un flush en cours : la suppression DB passe après lui
+        with self._flush_lock, self._lock:
+            user_entries = self._pending.get(user_id, {})
+            removed = {k for k in user_entries if k[0] == anime_id}
+            for key in removed:
+                del user_entries[key]
+            self._size -= len(removed)
+            return removed
+
+    # ---------- Lecture (positions non flushées) ----------
+
+    def _user_entries(self, user_id):
+        merged = dict(self._flushing.get(user_id, {}))
+        merged.update(self._pending.get(user_id, {}))
+        return merged
+
+    def pending_for_user(self, user_id):
+        with self._lock:
+            return list(self._user_entries(user_id).values())
+
+    def pending_for_anime(self, user_id, anime_id):
+        with self._lock:
+            return [e for k, e in self._user_entries(user_id).items() if k[0] == anime_id]
+
+    def get(self, user_id, anime_id, season_number, episode_number):
+        with self._lock:
+            return self._user_entries(user_id).get((anime_id, season_number, episode_number))
+
+    # ---------- Flush ----------
+
+    def flush(self):
+        """Écrit toutes les positions en attente en une transaction"""
+        with self._flush_lock:
+            with self._lock:
+                if not self._size:
+                    return 0
+                batch, self._pending, self._size = self._pending, {}, 0
+                self._flushing = batch
+
+            entries = [e for user_entries in batch.values() for e in user_entries.values()]
+            try:
+                try:
+                    self._write(entries)
+                    written = len(entries)
+                except ROW_ERRORS:
+                    # Une ligne invalide ne doit pas bloquer tout le lot
+                    written = self._write_rows(entries)
+            except Exception as e:
+                logger.error(f"❌ Flush progression échoué ({len(entries)} lignes): {e}")
+                with self._lock:
+                    self.flush_errors += 1
+                    # Réinjecte le lot sans écraser les positions plus récentes
+                    for user_id, user_entries in batch.items():
+                        current = self._pending.setdefault(user_id, {})
+                        for key, entry in user_entries.items():
+                            if key not in current:
+                                current[key] = entry
+                                self._size += 1
+                    self._flushing = {}
+                return 0
+
+            with self._lock:
+                self._flushing = {}
+                self.flushes += 1
+                self.rows_written += written
+            return written
+
+    def _write(self, entries):
+        if self.app is not None:
+            with self.app.app_context():
+                self.flush_fn(entries)
+        else:
+            self.flush_fn(entries)
+
+    def _write_rows(self, entries):
+        """Lot refusé par la base : ligne par ligne, les lignes invalides sont écartées"""
+        written = 0
+        for entry in entries:
+            try:
+                self._write([entry])
+                written += 1
+            except ROW_ERRORS as e:
+                logger.error(f"❌ Progression invalide écartée (user {entry.user_id}, "
+                             f"{entry.key}): {e}")
+                with self._lock:
+                    self.rows_dropped += 1
+        return written
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def init_app(self, app):
+        """Démarre le flusher périodique + flush à l'arrêt"""
+        self.app = app
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='progress-flusher', daemon=True)
+            self._thread.start()
+        atexit.register(self.flush)
+        app.extensions['progress_buffer'] = self
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': self._size,
+                'recorded': self.recorded,
+                'flushes': self.flushes,
+                'rows_written': self.rows_written,
+                'rows_dropped': self.rows_dropped,
+                'flush_errors': self.flush_errors,
+                'interval': self.interval,
+                'max_size': self.max_size,
+            }
@@ -0,0 +1,147 @@
+"""
+projections.py - Projections compactes du catalogue + JSON pré-encodé
+Chaque anime est projeté une fois par génération (card, detail, player)
+et encodé en bytes : les endpoints de liste ne font que concaténer.
+"""
+
+import json
+import datetime
+
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # encodeur standard si orjson absent
+    orjson = None
+
+
+def _default(value):
+    # Même rendu que jsonify pour les dates (HTTP-date, RFC 822)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return http_date(value)
+    raise TypeError(f"Type non sérialisable: {type(value).__name__}")
+
+
+def dumps(value):
+    """Encode en JSON compact (bytes, UTF-8)"""
+    if orjson is not None:
+        # Dates via _default (orjson les rendrait en ISO 8601)
+        return orjson.dumps(value, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'),
+                      default=_default).encode('utf-8')
+
+
+class RawJSON(bytes):
+    """Fragment JSON déjà encodé, inséré tel quel par encode_object()"""
+
+    __slots__ = ()
+
+
+def join_array(fragments):
+    """[frag, frag, ...] sans ré-encoder les éléments"""
+    return RawJSON(b'[' + b','.join(fragments) + b']')
+
+
+def encode_object(fields):
+    """Objet JSON dont certaines valeurs sont des fragments RawJSON"""
+    parts = []
+    for key, value in fields.items():
+        encoded = value if isinstance(value, RawJSON) else dumps(value)
+        parts.append(dumps(key) + b':' + encoded)
+    return b'{' + b','.join(parts) + b'}'
+
+
+# ==================
+# PROJECTIONS
+# ==================
+
+CARD_FIELDS = ('id', 'anime_id', 'title', 'image', 'genres', 'rating',
+               'featured', 'has_episodes', 'languages')
+
+
+def card(anime):
+    """Vignette de liste : pas de saisons ni d'URLs"""
+    projection = {field: anime.get(field) for field in CARD_FIELDS}
+    seasons = anime.get('seasons', ())
+    projection['season_count'] = len(seasons)
+    projection['episode_count'] = sum(len(s.get('episodes', ())) for s in seasons)
+    return projection
+
+
+def _plain(value):
+    """Record / FrozenDict -> dict, tuple -> list (récursif)"""
+    if hasattr(value, 'items'):
+        return {key: _plain(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_plain(item) for item in value]
+    return value
+
+
+def detail(anime):
+    """Fiche anime complète, URLs comprises (même contenu que l'ancien jsonify)"""
+    return _plain(anime)
+
+
+def player(anime, season, episode, links):
+    """Épisode à lire : URLs par langue + précédent/suivant"""
+    prev_key, next_key = links
+    return {
+        'anime_id': anime.get('anime_id'),
+        'title': anime.get('title'),
+        'image': anime.get('image'),
+        'season_number': season.get('season_number'),
+        'season_name': season.get('name', ''),
+        'episode_number': episode.get('episode_number'),
+        'episode_title': episode.get('title', ''),
+        'urls': episode.get('urls', {}),
+        'prev': list(prev_key) if prev_key else None,
+        'next': list(next_key) if next_key else None,
+    }
+
+
+class ProjectionCache:
+    """Fragments JSON d'une génération du catalogue.
+
+    `cards` et `details` sont encodés au chargement et alignés sur les
+    positions du catalogue (les doc_id du SearchIndex). Les fragments
+    `player` (un par épisode, URLs comprises) sont encodés au premier
+    accès puis gardés jusqu'à la génération suivante.
+    """
+
+    def __init__(self, animes, episode_index, episode_links):
+        self.animes = animes
+        self.episode_index = episode_index
+        self.episode_links = episode_links
+
+        self.cards = [dumps(card(anime)) for anime in animes]
+        self.details = [dumps(detail(anime)) for anime in animes]
+        self.players = {}
+
+        # Même résolution des ids que Catalog.by_id (id prioritaire)
+        self.positions = {int(a.get('anime_id', 0)): pos for pos, a in enumerate(animes)}
+        self.positions.update({int(a.get('id', 0)): pos for pos, a in enumerate(animes)})
+
+    def card(self, anime_id):
+        pos = self.positions.get(int(anime_id))
+        return None if pos is None else self.cards[pos]
+
+    def detail(self, anime_id):
+        pos = self.positions.get(int(anime_id))
+        return None if pos is None else self.details[pos]
+
+    def player(self, anime_id, season_number, episode_number):
+        key = (int(anime_id), season_number, episode_number)
+        encoded = self.players.get(key)
+        if encoded is None:
+            found = self.episode_index.get(key)
+            if found is None:
+                return None
+            anime = self.animes[self.positions[key[0]]]
+            links = self.episode_links.get(key, (None, None))
+            # Course bénigne : deux threads encodent le même fragment
+            encoded = self.players[key] = dumps(player(anime, *found, links))
+        return encoded
+
+    def nbytes(self):
+        return (sum(map(len, self.cards)) + sum(map(len, self.details))
+                + sum(map(len, list(self.players.values()))))
@@ -0,0 +1,317 @@
+"""
+range_cache.py - Cache par blocs des MP4 directs (SendVid)
+Un fichier creux par vidéo (taille finale), blocs alignés de taille fixe
+écrits/lus via mmap. Une requête Range est servie depuis les blocs déjà
+présents ; seuls les blocs manquants sont demandés à l'upstream, par
+plages contiguës, une seule fois même si plusieurs viewers les attendent.
+"""
+
+import os
+import mmap
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from upstream import upstream, STREAM_TIMEOUT
+from streaming import read_exact, close_response
+from segment_cache import ProcessDir
+
+logger = logging.getLogger(__name__)
+
+# ==================
+# CONFIGURATION
+# ==================
+
+RANGE_CACHE_BLOCK_SIZE = int(os.environ.get('RANGE_CACHE_BLOCK_SIZE', 1024 * 1024))
+RANGE_CACHE_MAX_BYTES = int(os.environ.get('RANGE_CACHE_MAX_BYTES', 4 * 1024 * 1024 * 1024))
+RANGE_CACHE_DIR = os.environ.get('RANGE_CACHE_DIR',
+                                 os.path.join(tempfile.gettempdir(), 'animezone_mp4'))
+# Blocs manquants demandés en une seule requête Range, lue en tâche de fond :
+# le viewer lit chaque bloc dès sa publication
+RANGE_FETCH_BLOCKS = int(os.environ.get('RANGE_FETCH_BLOCKS', 8))
+RANGE_FETCH_WORKERS = int(os.environ.get('RANGE_FETCH_WORKERS', 16))
+RANGE_WAIT_TIMEOUT = STREAM_TIMEOUT[1]
+
+
+class RangeFetchError(Exception):
+    """Upstream n'a pas renvoyé la plage demandée"""
+
+
+# ==================
+# VIDÉO EN CACHE
+# ==================
+
+class CachedVideo:
+    """Fichier creux + bitmap des blocs présents"""
+
+    def __init__(self, key, url, total_size, block_size, path):
+        self.key = key
+        self.url = url
+        self.total_size = total_size
+        self.block_size = block_size
+        self.path = path
+        self.block_count = (total_size + block_size - 1) // block_size
+        self.present = bytearray(self.block_count)
+        self.inflight = {}  # index bloc -> threading.Event
+        self.cached_bytes = 0
+        self.readers = 0
+        self.dropped = False
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # Taille finale sans allouer : le FS ne stocke que les blocs écrits
+        os.ftruncate(self._fd, total_size)
+        self.mm = mmap.mmap(self._fd, total_size)
+
+    def block_range(self, index):
+        start = index * self.block_size
+        return start, min(start + self.block_size, self.total_size)
+
+    def read(self, start, end):
+        return self.mm[start:end]
+
+    def close(self):
+        try:
+            self.mm.close()
+            os.close(self._fd)
+        except (OSError, ValueError):
+            pass
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+# ==================
+# CACHE
+# ==================
+
+class RangeCache:
+    """Cache thread-safe des MP4 par blocs, LRU par vidéo, borné en octets disque"""
+
+    def __init__(self, block_size=RANGE_CACHE_BLOCK_SIZE, max_bytes=RANGE_CACHE_MAX_BYTES,
+                 cache_dir=RANGE_CACHE_DIR, fetch_blocks=RANGE_FETCH_BLOCKS,
+                 workers=RANGE_FETCH_WORKERS):
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.fetch_blocks = fetch_blocks
+        # Un sous-dossier par process (workers gunicorn), résolu à la première vidéo
+        self.cache_dir = ProcessDir(cache_dir) if max_bytes > 0 else None
+
+        self._videos = OrderedDict()  # video_key -> CachedVideo
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='range-fetch')
+
+        self.block_hits = 0
+        self.block_misses = 0
+        self.upstream_requests = 0
+        self.upstream_errors = 0
+        self.bytes_served = 0
+        self.bytes_fetched = 0
+        self.evictions = 0
+
+    def supports(self, video_data):
+        """MP4 direct, taille connue et upstream qui accepte les Range"""
+        return (self.cache_dir is not None and video_data.player_type == 'sendvid'
+                and video_data.accepts_range and video_data.total_size > 0)
+
+    # ---------- Vidéos ----------
+
+    def _open(self, video_key, video_data):
+        with self._lock:
+            video = self._videos.get(video_key)
+            if video is not None and video.total_size != video_data.total_size:
+                # Re-résolution vers un autre fichier : l'ancien cache est faux
+                self._drop(video_key)
+                video = None
+            if video is None:
+                # Nom unique : une ancienne version peut encore être lue
+                path = os.path.join(self.cache_dir.path(), f"{os.urandom(8).hex()}.mp4")
+                video = self._videos[video_key] = CachedVideo(
+                    video_key, video_data.url, video_data.total_size, self.block_size, path)
+            # URL signée rafraîchie à chaque résolution
+            video.url = video_data.url
+            video.readers += 1
+            self._videos.move_to_end(video_key)
+            return video
+
+    def _release(self, video):
+        with self._lock:
+            video.readers -= 1
+            if video.dropped:
+                # Retirée pendant la lecture : le dernier lecteur ferme le fichier
+                if video.readers == 0:
+                    video.close()
+                return
+            self._evict()
+
+    def _drop(self, video_key):
+        video = self._videos.pop(video_key)
+        self._bytes -= video.cached_bytes
+        video.dropped = True
+        if video.readers == 0:
+            video.close()
+
+    def _evict(self):
+        for video_key in list(self._videos):
+            if self._bytes <= self.max_bytes:
+                break
+            if self._videos[video_key].readers == 0:
+                self._drop(video_key)
+                self.evictions += 1
+
+    # ---------- Lecture ----------
+
+    def open_range(self, video_key, video_data, start, stop):
+        """Fichier ouvert si [start, stop) est entièrement en cache, sinon None.
+
+        Le descripteur reste valide même si la vidéo est évincée ensuite.
+        """
+        with self._lock:
+            video = self._videos.get(video_key)
+            if video is None or video.dropped or video.total_size != video_data.total_size:
+                return None
+            first, last = start // self.block_size, (stop - 1) // self.block_size
+            if not all(video.present[first:last + 1]):
+                return None
+            self.block_hits += last - first + 1
+            self.bytes_served += stop - start
+            self._videos.move_to_end(video_key)
+            return open(video.path, 'rb', buffering=0)
+
+    def stream(self, video_key, video_data, start, stop):
+        """Générateur des octets [start, stop) ; blocs manquants récupérés au fil de l'eau"""
+        video = self._open(video_key, video_data)
+        try:
+            last = (stop - 1) // self.block_size
+            pos = start
+            while pos < stop:
+                index = pos // self.block_size
+                self._ensure(video, index, last)
+                end = min(video.block_range(index)[1], stop)
+                data = video.read(pos, end)
+                with self._lock:
+                    self.bytes_served += len(data)
+                yield data
+                pos = end
+        finally:
+            self._release(video)
+
+    def _ensure(self, video, index, last):
+        """Bloque jusqu'à ce que le bloc `index` soit présent"""
+        if video.present[index]:
+            with self._lock:
+                self.block_hits += 1
+            return
+
+        with self._lock:
+            self.block_misses += 1
+
+        while not video.present[index]:
+            with self._lock:
+                event = video.inflight.get(index)
+                claimed = []
+                if event is None:
+                    # Plage contiguë de blocs manquants non déjà demandés
+                    block = index
+                    while (block <= last and len(claimed) < self.fetch_blocks
+                           and not video.present[block] and block not in video.inflight):
+                        video.inflight[block] = threading.Event()
+                        claimed.append(block)
+                        block += 1
+                    if not claimed:
+                        continue
+                    event = video.inflight[index]
+                    # Le fetch garde la vidéo ouverte même si le viewer part avant la fin
+                    video.readers += 1
+
+            if not claimed:
+                # Un autre viewer récupère déjà ce bloc
+                event.wait(RANGE_WAIT_TIMEOUT)
+                continue
+
+            # Lecture de la plage en tâche de fond : on sert `index` dès sa publication
+            future = self._executor.submit(self._fetch, video, claimed)
+            if event.wait(RANGE_WAIT_TIMEOUT) and not video.present[index]:
+                # Bloc relâché sans être publié : l'erreur upstream remonte au viewer
+                error = future.exception()
+                if error is not None:
+                    raise error
+
+    def _fetch(self, video, blocks):
+        """Une requête Range pour des blocs contigus, chaque bloc publié dès complet"""
+        first, last = blocks[0], blocks[-1]
+        start = video.block_range(first)[0]
+        end = video.block_range(last)[1]
+        with self._lock:
+            self.upstream_requests += 1
+
+        pending = list(blocks)
+        response = None
+        try:
+            response = upstream.get(video.url, headers={'Range': f'bytes={start}-{end - 1}'},
+                                    stream=True, timeout=STREAM_TIMEOUT)
+            if response.status_code != 206 and not (response.status_code == 200 and start == 0):
+                raise RangeFetchError(f"Range {start}-{end - 1}: HTTP {response.status_code}")
+
+            # Lecture directe dans le fichier mappé, bloc par bloc
+            with memoryview(video.mm) as mapped:
+                while pending:
+                    block_start, block_end = video.block_range(pending[0])
+                    with mapped[block_start:block_end] as block:
+                        if read_exact(response, block) < len(block):
+                            raise RangeFetchError(f"Range {start}-{end - 1}: réponse tronquée")
+                    self._publish(video, pending.pop(0), block_end - block_start)
+        except Exception as e:
+            with self._lock:
+                self.upstream_errors += 1
+            logger.warning(f"Erreur range cache {video.key}: {e}")
+            raise
+        finally:
+            if response is not None:
+                close_response(response)
+            # Blocs non obtenus : les viewers en attente retenteront eux-mêmes
+            with self._lock:
+                for block in pending:
+                    event = video.inflight.pop(block, None)
+                    if event is not None:
+                        event.set()
+            self._release(video)
+
+    def _publish(self, video, index, size):
+        with self._lock:
+            video.present[index] = 1
+            video.cached_bytes += size
+            self.bytes_fetched += size
+            if not video.dropped:
+                self._bytes += size
+                self._evict()
+            event = video.inflight.pop(index, None)
+        if event is not None:
+            event.set()
+
+    # ---------- Stats ----------
+
+    def stats(self):
+        with self._lock:
+            total = self.block_hits + self.block_misses
+            return {
+                'videos': len(self._videos),
+                'disk_bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'block_size': self.block_size,
+                'block_hits': self.block_hits,
+                'block_misses': self.block_misses,
+                'hit_rate': round(self.block_hits / total, 4) if total else 0.0,
+                'upstream_requests': self.upstream_requests,
+                'upstream_errors': self.upstream_errors,
+                'bytes_served': self.bytes_served,
+                'bytes_fetched': self.bytes_fetched,
+                'evictions': self.evictions,
+            }
+
+
+# Instance partagée (process)
+range_cache = RangeCache()
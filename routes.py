@@ -3,19 +3,32 @@ routes.py - Frontend (templates + logique utilisateur)
 À importer dans app.py
 """
 
-import re
 import logging
-import m3u8
 import requests
-from urllib.parse import urljoin
 from flask import render_template, request, redirect, url_for, flash, jsonify, Response
 from flask_login import login_user, login_required, logout_user, current_user
 
 from app import (
-    db, User, UserProgress, UserFavorite,
-    load_anime_data, get_anime_by_id, load_discover_data,
-    get_all_genres, get_user_progress_optimized,
-    get_user_favorites_optimized, video_session
+    db, User,
+    load_anime_data, get_anime_by_id,
+    get_all_genres, get_genre_index, get_genre_counts,
+    get_season, get_episode, get_episode_links,
+    get_user_progress_optimized, get_user_favorites_optimized,
+    get_anime_progress, get_episode_progress, get_latest_progress,
+    is_user_favorite, toggle_user_favorite, record_progress, remove_anime_progress,
+    catalog_etag, get_catalog, get_catalog_generation, search_page, decode_cursor,
+    get_featured_animes
+)
+from http_cache import conditional
+from fragment_cache import fragment_cache
+from video_store import video_store
+from segment_cache import segment_cache
+from upstream import upstream, STREAM_TIMEOUT, UpstreamUnavailable
+from range_cache import range_cache
+from streaming import iter_response, file_stream
+from source_resolver import (
+    parse_video_url, load_variant, source_resolver, resolve_candidates, next_episode_warmer,
+    ResolveError, PLAYER_RESOLVE_DEADLINE
 )
 
 logger = logging.getLogger(__name__)
@@ -24,107 +37,132 @@ logger = logging.getLogger(__name__)
 # SYSTÈME VIDÉO (inchangé mais optimisé)
 # ==================
 
-def parse_video_url(url):
-    """Parse URL vidéo"""
-    if not url:
-        return None, None
-    
-    url_clean = url.strip().lower()
-    
-    # SENDVID
-    if 'sendvid' in url_clean:
-        match = re.search(r'sendvid\.com/embed/([a-zA-Z0-9]+)', url, re.IGNORECASE)
-        if match:
-            return ('sendvid', match.group(1))
-        
-        match = re.search(r'sendvid\.com/([a-zA-Z0-9]+)', url, re.IGNORECASE)
-        if match:
-            return ('sendvid', match.group(1))
-    
-    # VIDMOLY
-    if 'vidmoly' in url_clean:
-        match = re.search(r'embed-([a-zA-Z0-9]+)\.html', url, re.IGNORECASE)
-        if match:
-            return ('vidmoly', match.group(1))
-    
-    return None, None
+def _media_playlist(variant, segment_prefix):
+    """Playlist média dont les segments pointent vers notre proxy"""
+    manifest = "#EXTM3U\n#EXT-X-VERSION:3\n"
+    manifest += f"#EXT-X-TARGETDURATION:{variant.target_duration}\n"
+    manifest += "#EXT-X-MEDIA-SEQUENCE:0\n\n"
+    
+    for i, (_, duration) in enumerate(variant.segments):
+        manifest += f"#EXTINF:{duration},\n{segment_prefix}{i}\n"
+    
+    manifest += "#EXT-X-ENDLIST\n"
+    return manifest
 
 
-def extract_vidmoly_m3u8(embed_url):
-    """Extrait M3U8 Vidmoly"""
-    try:
-        response = video_session.get(embed_url, timeout=10)
-        html = response.text
-        
-        pattern = r'sources\s*:\s*\[\s*{\s*file\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']'
-        match = re.search(pattern, html, re.IGNORECASE)
-        
-        if match:
-            return match.group(1)
-        
-        pattern2 = r'file\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']'
-        match = re.search(pattern2, html, re.IGNORECASE)
-        
-        return match.group(1) if match else None
-    except Exception as e:
-        logger.error(f"Erreur Vidmoly M3U8: {e}")
-        return None
+def _master_playlist(video_key, video_data):
+    """Master ABR : chaque rendition pointe vers sa playlist proxifiée"""
+    manifest = "#EXTM3U\n#EXT-X-VERSION:3\n\n"
+    
+    # Rendition par défaut en tête : le client démarre dessus (segments déjà chauffés)
+    order = [video_data.default_variant] + [i for i in range(len(video_data.variants))
+                                            if i != video_data.default_variant]
+    for i in order:
+        variant = video_data.variants[i]
+        attributes = [f"BANDWIDTH={variant.bandwidth}"]
+        if variant.resolution:
+            attributes.append(f"RESOLUTION={variant.resolution[0]}x{variant.resolution[1]}")
+        if variant.codecs:
+            attributes.append(f'CODECS="{variant.codecs}"')
+        if variant.frame_rate:
+            attributes.append(f"FRAME-RATE={variant.frame_rate:.3f}")
+        manifest += f"#EXT-X-STREAM-INF:{','.join(attributes)}\n/api/video/variant/{video_key}/{i}\n"
+    
+    return manifest
+
+
+def build_hls_manifest(video_key, video_data):
+    """Playlist de /api/video/stream : master ABR si plusieurs renditions, sinon média"""
+    manifest = video_data.manifests.get('master')
+    if manifest is None:
+        if len(video_data.variants) > 1:
+            manifest = _master_playlist(video_key, video_data)
+        else:
+            manifest = _media_playlist(video_data.variants[0], f"/api/video/segment/{video_key}/")
+        # Réécrite une fois par session (donc par video_key), comptée dans le budget du store
+        video_data.manifests['master'] = manifest
+        video_store.resize(video_key, video_data)
+    return manifest
 
 
-def extract_sendvid_video(embed_url):
-    """Extrait URL MP4 SendVid"""
-    try:
-        response = video_session.get(embed_url, timeout=10)
-        html = response.text
-        
-        # Pattern 1: <source>
-        pattern1 = r'<source[^>]*src=["\']([^"\']+\.mp4[^"\']*)["\']'
-        match = re.search(pattern1, html, re.IGNORECASE)
-        if match:
-            url = match.group(1)
-            return url if url.startswith('http') else urljoin('https://sendvid.com', url)
-        
-        # Pattern 2: file variable
-        pattern2 = r'file\s*:\s*["\']([^"\']+\.(mp4|webm)[^"\']*)["\']'
-        match = re.search(pattern2, html, re.IGNORECASE)
-        if match:
-            url = match.group(1)
-            return url if url.startswith('http') else urljoin('https://sendvid.com', url)
-        
-        return None
-    except Exception as e:
-        logger.error(f"Erreur SendVid: {e}")
-        return None
+def build_variant_manifest(video_key, video_data, variant_num):
+    """Playlist média d'une rendition déjà chargée"""
+    manifest = video_data.manifests.get(variant_num)
+    if manifest is None:
+        manifest = video_data.manifests[variant_num] = _media_playlist(
+            video_data.variants[variant_num], f"/api/video/segment/{video_key}/{variant_num}/")
+        video_store.resize(video_key, video_data)
+    return manifest
 
 
-def get_hls_segments(master_url):
-    """Récupère segments HLS"""
-    try:
-        response = video_session.get(master_url, timeout=10)
-        master = m3u8.loads(response.text)
-        
-        if master.segments:
-            return master_url, master
-        
-        if master.playlists:
-            base_url = master_url.rsplit('/', 1)[0] + '/'
-            playlist_url = urljoin(base_url, master.playlists[-1].uri)
-            response = video_session.get(playlist_url, timeout=10)
-            playlist = m3u8.loads(response.text)
-            return playlist_url, playlist
-        
-        return None, None
-    except Exception as e:
-        logger.error(f"Erreur HLS: {e}")
-        return None, None
+def ensure_variant(video_key, video_data, variant):
+    """Charge la rendition au besoin ; la session est alors recomptée dans le store"""
+    if variant.loaded:
+        return True
+    if not load_variant(variant):
+        return False
+    video_store.resize(video_key, video_data)
+    return True
+
+
+def upstream_unavailable(url):
+    """503 + Retry-After quand l'hôte est coupé (disjoncteur) ou saturé"""
+    host = upstream.host(url)
+    retry_after = int(host.cooldown) if host.state == 'open' else 2
+    return Response("Upstream indisponible", status=503, headers={'Retry-After': str(retry_after)})
+
+
+def range_cache_response(video_key, video_data):
+    """Réponse 200/206 depuis le range cache ; None si la requête n'est pas servable"""
+    total = video_data.total_size
+    byte_range = request.range
+    if byte_range is None:
+        start, stop, status = 0, total, 200
+    else:
+        bounds = byte_range.range_for_length(total)
+        if bounds is None:
+            # Multi-plages : laissées à l'upstream
+            if len(byte_range.ranges) > 1:
+                return None
+            return Response(status=416, headers={'Content-Range': f'bytes */{total}'})
+        (start, stop), status = bounds, 206
+    
+    headers = {'Content-Length': str(stop - start), 'Accept-Ranges': 'bytes'}
+    if status == 206:
+        headers['Content-Range'] = f'bytes {start}-{stop - 1}/{total}'
+    
+    # Plage entièrement en cache : fichier servi par sendfile quand le serveur le permet
+    cached = range_cache.open_range(video_key, video_data, start, stop)
+    if cached is not None:
+        return Response(file_stream(request.environ, cached, start, stop - start),
+                        status=status, mimetype='video/mp4', headers=headers,
+                        direct_passthrough=True)
+    return Response(range_cache.stream(video_key, video_data, start, stop),
+                    status=status, mimetype='video/mp4', headers=headers)
 
 
 # ==================
 # ROUTES FRONTEND
 # ==================
 
+def page_etag(*parts):
+    """ETag d'une page catalogue : la barre de navigation affiche l'utilisateur"""
+    return catalog_etag(*parts, current_user.id, current_user.username)
+
+
+def render_fragment(name, params, template, context_fn):
+    """Fragment HTML indépendant de l'utilisateur, rendu une fois par génération"""
+    key = (get_catalog_generation(), name, *params)
+    return fragment_cache.render(key, lambda: render_template(template, **context_fn()))
+
+
 def register_frontend_routes(app):
     """Enregistre toutes les routes frontend"""
+    app.extensions['segment_cache'] = segment_cache
+    app.extensions['range_cache'] = range_cache
+    app.extensions['fragment_cache'] = fragment_cache
+    app.extensions['source_resolver'] = source_resolver
+    app.extensions['next_episode_warmer'] = next_episode_warmer
     
     @app.route('/')
     def index():
@@ -144,19 +182,17 @@ def register_frontend_routes(app):
             if progress.anime_id not in processed:
                 anime = get_anime_by_id(progress.anime_id)  # 🔥 O(1)
                 if anime:
-                    season = next((s for s in anime.get('seasons', []) 
-                                 if s.get('season_number') == progress.season_number), None)
-                    if season:
-                        episode = next((e for e in season.get('episodes', []) 
-                                      if e.get('episode_number') == progress.episode_number), None)
-                        if episode:
-                            continue_watching.append({
-                                'anime': anime,
-                                'progress': progress,
-                                'season': season,
-                                'episode': episode
-                            })
-                            processed.add(progress.anime_id)
+                    season, episode = get_episode(progress.anime_id,
+                                                  progress.season_number,
+                                                  progress.episode_number)  # 🔥 O(1)
+                    if episode:
+                        continue_watching.append({
+                            'anime': anime,
+                            'progress': progress,
+                            'season': season,
+                            'episode': episode
+                        })
+                        processed.add(progress.anime_id)
         
         # Favoris (query optimisée)
         favorite_anime = []
@@ -166,12 +202,13 @@ def register_frontend_routes(app):
             if anime:
                 favorite_anime.append(anime)
         
-        # Featured (depuis cache)
-        featured = load_discover_data()
-        featured = [a for a in featured if a.get('has_episodes', False)][:12]
+        # Featured : fragment commun à tous les utilisateurs
+        featured_html = render_fragment('featured', (), '_featured_grid.html', lambda: {
+            'anime_list': get_featured_animes()
+        })
         
         return render_template('index_new.html',
-                              anime_list=featured,
+                              featured_html=featured_html,
                               continue_watching=continue_watching,
                               favorite_anime=favorite_anime)
     
@@ -240,32 +277,54 @@ def register_frontend_routes(app):
     
     @app.route('/search')
     @login_required
+    @conditional(lambda: page_etag('search', request.query_string))
     def search():
         """Recherche OPTIMISÉE"""
         query = request.args.get('query', '').lower()
         genre = request.args.get('genre', '').lower()
         
-        # 🔥 Depuis cache
-        anime_data = load_anime_data()
-        
-        filtered = []
-        for anime in anime_data:
-            title_match = query in anime.get('title', '').lower() if query else True
-            genre_match = not genre or genre in [g.lower() for g in anime.get('genres', [])]
-            has_episodes = anime.get('has_episodes', False)
+        # Page suivante demandée par "Charger plus" : cartes seules
+        if request.args.get('partial') == '1':
+            cursor = request.args.get('cursor', '')
+            try:
+                after = decode_cursor(get_catalog(), cursor) if cursor else -1
+            except ValueError:
+                return '', 400
             
-            if title_match and genre_match and has_episodes:
-                filtered.append(anime)
+            def page_context():
+                catalog, doc_ids, next_cursor, _, _ = search_page(query, genre, playable_only=True,
+                                                                  cursor=cursor)
+                return {
+                    'anime_list': [catalog.animes[i] for i in doc_ids],
+                    'next_cursor': next_cursor
+                }
+            
+            # Clé sur la position décodée : un curseur arbitraire ne crée pas d'entrée
+            return render_fragment('search-page', (query, genre, after), '_search_cards.html',
+                                   page_context)
+        
+        def results_context():
+            # 🔥 Depuis l'index : première page + total précalculé
+            catalog, doc_ids, next_cursor, total, total_exact = search_page(query, genre, playable_only=True)
+            filtered = [catalog.animes[i] for i in doc_ids]
+            return {
+                'anime_list': filtered,
+                'next_cursor': next_cursor,
+                'total': total,
+                'total_exact': total_exact,
+                'query': query,
+                'selected_genre': genre,
+                'other_anime_list': catalog.recent if not filtered else []
+            }
         
-        filtered = filtered[:100]
-        recent = [a for a in anime_data if a.get('has_episodes', False)][-20:]
+        # Résultats mis en cache par (génération, requête, genre)
+        results_html = render_fragment('search', (query, genre), '_search_results.html', results_context)
         
         return render_template('search.html',
-                              anime_list=filtered,
+                              results_html=results_html,
                               query=query,
                               selected_genre=genre,
-                              genres=get_all_genres(),
-                              other_anime_list=recent if not filtered else [])
+                              genres=get_all_genres())
     
     
     @app.route('/anime/<int:anime_id>')
@@ -278,31 +337,14 @@ def register_frontend_routes(app):
         if not anime:
             return render_template('404.html', message="Anime non trouvé"), 404
         
-        # Trier saisons
-        if anime.get('seasons'):
-            regular, kai, films = [], [], []
-            for season in anime['seasons']:
-                name = season.get('name', '')
-                if season.get('season_number') == 99:
-                    films.append(season)
-                elif 'Kai' in name:
-                    kai.append(season)
-                else:
-                    regular.append(season)
-            
-            regular.sort(key=lambda s: s.get('season_number', 0))
-            kai.sort(key=lambda s: s.get('season_number', 0))
-            anime['seasons'] = regular + films + kai
+        # Saisons déjà triées au chargement (snapshot en lecture seule)
         
-        # Infos utilisateur (queries optimisées)
-        is_favorite = UserFavorite.query.filter_by(
-            user_id=current_user.id,
-            anime_id=anime_id
-        ).first() is not None
+        # Infos utilisateur (cache mémoire, sinon 1 query chacune)
+        is_favorite = is_user_favorite(current_user.id, anime_id)
         
-        # 🔥 1 seule query pour TOUTE la progression
+        # 🔥 Progression de l'anime (cache utilisateur + positions non flushées)
         episode_progress = {}
-        for progress in UserProgress.query.filter_by(user_id=current_user.id, anime_id=anime_id).all():
+        for progress in get_anime_progress(current_user.id, anime_id):
             key = f"{progress.season_number}_{progress.episode_number}"
             episode_progress[key] = {
                 'time_position': progress.time_position,
@@ -310,11 +352,8 @@ def register_frontend_routes(app):
                 'last_watched': progress.last_watched
             }
         
-        latest_progress = UserProgress.query.filter_by(
-            user_id=current_user.id,
-            anime_id=anime_id,
-            completed=False
-        ).order_by(UserProgress.last_watched.desc()).first()
+        # Dernier épisode non terminé (déduit de la même map, pas d'ORDER BY)
+        latest_progress = get_latest_progress(current_user.id, anime_id)
         
         return render_template('anime_new.html',
                               anime=anime,
@@ -333,71 +372,38 @@ def register_frontend_routes(app):
         if not anime:
             return render_template('404.html', message="Anime non trouvé"), 404
         
-        season = next((s for s in anime.get('seasons', []) 
-                      if s.get('season_number') == season_num), None)
-        if not season:
-            return render_template('404.html', message="Saison non trouvée"), 404
-        
-        episode = next((e for e in season.get('episodes', []) 
-                       if e.get('episode_number') == episode_num), None)
+        # 🔥 O(1) via l'index du catalogue
+        season, episode = get_episode(anime_id, season_num, episode_num)
         if not episode:
+            if not get_season(anime_id, season_num):
+                return render_template('404.html', message="Saison non trouvée"), 404
             return render_template('404.html', message="Épisode non trouvé"), 404
         
-        # Sélection URL
-        def select_best_url(urls_dict):
-            if not urls_dict:
-                return None, None
-            
-            def prioritize(url_list):
-                if not url_list:
-                    return None
-                if isinstance(url_list, str):
-                    url_list = [url_list]
-                
-                vidmoly = [u for u in url_list if 'vidmoly' in u.lower()]
-                sendvid = [u for u in url_list if 'sendvid' in u.lower()]
-                
-                return (vidmoly or sendvid or url_list)[0] if (vidmoly or sendvid or url_list) else None
-            
-            for lang in ['VF', 'VOSTFR']:
-                if lang in urls_dict:
-                    url = prioritize(urls_dict[lang])
-                    if url:
-                        return url, lang
-            
-            for lang, urls in urls_dict.items():
-                url = prioritize(urls)
-                if url:
-                    return url, lang
-            
-            return None, None
+        prev_episode, next_episode = get_episode_links(anime_id, season_num, episode_num)
         
-        video_url, episode_lang = select_best_url(episode.get('urls', {}))
+        # 🔥 Toutes les sources lancées en parallèle, attente courte avant le rendu : source
+        # saine la plus rapide en tête, sinon classement statique ; /api/video/info rejoint
+        # la résolution en vol
+        video_sources = resolve_candidates(episode.get('urls', {}), deadline=PLAYER_RESOLVE_DEADLINE)
         
-        if not video_url:
+        if not video_sources:
             return render_template('404.html', message="Source vidéo non disponible"), 404
         
+        video_url, episode_lang = video_sources[0]['url'], video_sources[0]['lang']
+        
         download_url = video_url
         if "sendvid.com" in video_url and "/embed/" not in video_url:
             video_id = video_url.split("/")[-1].split(".")[0]
             download_url = f"https://sendvid.com/embed/{video_id}"
         
-        # Progression (1 query)
+        # Progression (cache utilisateur)
         time_position = 0
-        progress = UserProgress.query.filter_by(
-            user_id=current_user.id,
-            anime_id=anime_id,
-            season_number=season_num,
-            episode_number=episode_num
-        ).first()
+        progress = get_episode_progress(current_user.id, anime_id, season_num, episode_num)
         
         if progress:
             time_position = progress.time_position
         
-        is_favorite = UserFavorite.query.filter_by(
-            user_id=current_user.id,
-            anime_id=anime_id
-        ).first() is not None
+        is_favorite = is_user_favorite(current_user.id, anime_id)
         
         return render_template('player.html',
                               anime=anime,
@@ -406,7 +412,10 @@ def register_frontend_routes(app):
                               download_url=download_url,
                               time_position=time_position,
                               is_favorite=is_favorite,
-                              episode_lang=episode_lang)
+                              episode_lang=episode_lang,
+                              video_sources=video_sources,
+                              prev_episode=prev_episode,
+                              next_episode=next_episode)
     
     
     @app.route('/profile')
@@ -420,10 +429,11 @@ def register_frontend_routes(app):
         for progress in get_user_progress_optimized(current_user.id, limit=50):
             anime = get_anime_by_id(progress.anime_id)  # O(1)
             if anime:
-                season = next((s for s in anime.get('seasons', []) 
-                             if s.get('season_number') == progress.season_number), None)
-                episode = next((e for e in season.get('episodes', []) 
-                              if e.get('episode_number') == progress.episode_number), None) if season else None
+                season, episode = get_episode(progress.anime_id,
+                                              progress.season_number,
+                                              progress.episode_number)  # O(1)
+                if not season:
+                    season = get_season(progress.anime_id, progress.season_number)
                 
                 watching_anime.append({
                     'progress': progress,
@@ -477,21 +487,17 @@ def register_frontend_routes(app):
 
     @app.route('/categories')
     @login_required
+    @conditional(lambda: page_etag('categories'))
     def categories():
         """Catégories (depuis cache)"""
-        anime_data = load_anime_data()
-        genres = get_all_genres()
-        
-        genres_dict = {genre: [] for genre in genres}
-        for anime in anime_data:
-            for genre in anime.get('genres', []):
-                if genre.lower() in genres_dict:
-                    genres_dict[genre.lower()].append(anime)
-        
-        return render_template('categories.html',
-                              all_anime=anime_data,
-                              genres=genres,
-                              genres_dict=genres_dict)
+        # 🔥 Regroupement précalculé, rendu une fois par génération
+        categories_html = render_fragment('categories', (), '_categories_body.html', lambda: {
+            'all_anime': load_anime_data(),
+            'genres': get_all_genres(),
+            'genres_dict': get_genre_index(),
+            'genre_counts': get_genre_counts()
+        })
+        return render_template('categories.html', categories_html=categories_html)
     
     
     # ==================
@@ -514,63 +520,26 @@ def register_frontend_routes(app):
             if not player_type:
                 return jsonify({'success': False, 'error': 'Type non supporté', 'use_iframe': True}), 400
             
-            video_key = f"{player_type}_{video_id}"
+            # 🔥 Cache de résolution + une seule résolution en vol par vidéo
+            try:
+                video_key, session = source_resolver.resolve(player_type, video_id)
+            except ResolveError as e:
+                return jsonify({'success': False, 'error': e.message}), e.status
             
-            # VIDMOLY
-            if player_type == 'vidmoly':
-                embed_url = f"https://vidmoly.net/embed-{video_id}.html"
-                m3u8_url = extract_vidmoly_m3u8(embed_url)
-                
-                if not m3u8_url:
-                    return jsonify({'success': False, 'error': 'M3U8 non trouvé'}), 404
-                
-                playlist_url, playlist = get_hls_segments(m3u8_url)
-                
-                if not playlist or not playlist.segments:
-                    return jsonify({'success': False, 'error': 'Segments non trouvés'}), 500
-                
-                app.config[f'video_{video_key}'] = {
-                    'player_type': 'vidmoly',
-                    'url': playlist_url,
-                    'playlist': playlist
-                }
-                
+            if session.player_type == 'vidmoly':
                 return jsonify({
                     'success': True,
                     'player_type': 'vidmoly',
                     'video_key': video_key,
-                    'segments': len(playlist.segments)
+                    'segments': len(session.segments)
                 })
             
-            # SENDVID
-            elif player_type == 'sendvid':
-                embed_url = f"https://sendvid.com/embed/{video_id}"
-                video_url = extract_sendvid_video(embed_url)
-                
-                if not video_url:
-                    return jsonify({'success': False, 'error': 'Vidéo non trouvée'}), 404
-                
-                try:
-                    head_response = video_session.head(video_url, timeout=10, allow_redirects=True)
-                    accepts_range = 'bytes' in head_response.headers.get('Accept-Ranges', '').lower()
-                    total_size = int(head_response.headers.get('Content-Length', 0))
-                except:
-                    accepts_range = False
-                    total_size = 0
-                
-                app.config[f'video_{video_key}'] = {
-                    'player_type': 'sendvid',
-                    'url': head_response.url if 'head_response' in locals() else video_url,
-                    'accepts_range': accepts_range,
-                    'total_size': total_size
-                }
-                
-                return jsonify({
-                    'success': True,
-                    'player_type': 'sendvid',
-                    'video_key': video_key,
-                    'direct_mp4': True
-                })
+            return jsonify({
+                'success': True,
+                'player_type': 'sendvid',
+                'video_key': video_key,
+                'direct_mp4': True
+            })
             
         except Exception as e:
             logger.error(f"Erreur API info: {e}")
@@ -581,47 +550,40 @@ def register_frontend_routes(app):
     @login_required
     def video_stream(video_key):
         """Stream vidéo"""
-        video_data = app.config.get(f'video_{video_key}')
+        video_data = video_store.get(video_key)
         if not video_data:
             return "Non trouvé", 404
         
-        player_type = video_data['player_type']
+        player_type = video_data.player_type
         
         # VIDMOLY (HLS)
         if player_type == 'vidmoly':
-            playlist = video_data['playlist']
-            base_url = video_data['url'].rsplit('/', 1)[0] + '/'
-            
-            manifest = "#EXTM3U\n#EXT-X-VERSION:3\n"
-            manifest += f"#EXT-X-TARGETDURATION:{int(max(s.duration for s in playlist.segments if s.duration) + 1)}\n"
-            manifest += "#EXT-X-MEDIA-SEQUENCE:0\n\n"
-            
-            for i, seg in enumerate(playlist.segments):
-                seg_url = seg.uri if seg.uri.startswith('http') else urljoin(base_url, seg.uri)
-                app.config[f'segment_{video_key}_{i}'] = seg_url
-                manifest += f"#EXTINF:{seg.duration},\n/api/video/segment/{video_key}/{i}\n"
-            
-            manifest += "#EXT-X-ENDLIST\n"
-            
-            return Response(manifest, mimetype='application/vnd.apple.mpegurl')
+            return Response(build_hls_manifest(video_key, video_data),
+                            mimetype='application/vnd.apple.mpegurl')
         
         # SENDVID (MP4 Direct)
         elif player_type == 'sendvid':
-            video_url = video_data['url']
+            # 🔥 Blocs déjà en cache servis localement, seuls les manquants vont upstream
+            if range_cache.supports(video_data):
+                response = range_cache_response(video_key, video_data)
+                if response is not None:
+                    return response
+            
+            video_url = video_data.url
             range_header = request.headers.get('Range')
             
-            if range_header and video_data.get('accepts_range'):
-                headers = video_session.headers.copy()
-                headers['Range'] = range_header
-                response = video_session.get(video_url, headers=headers, stream=True, timeout=30)
-                
-                def generate():
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            yield chunk
-                
+            forward_range = bool(range_header and video_data.accepts_range)
+            try:
+                response = upstream.get(video_url,
+                                        headers={'Range': range_header} if forward_range else None,
+                                        stream=True, timeout=STREAM_TIMEOUT)
+            except UpstreamUnavailable:
+                return upstream_unavailable(video_url)
+            
+            if forward_range:
+                # close() rend la connexion (et la place upstream) même si le client coupe
                 return Response(
-                    generate(),
+                    iter_response(response),
                     status=response.status_code,
                     mimetype='video/mp4',
                     headers={
@@ -631,18 +593,11 @@ def register_frontend_routes(app):
                     }
                 )
             else:
-                response = video_session.get(video_url, stream=True, timeout=30)
-                
-                def generate():
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            yield chunk
-                
                 return Response(
-                    generate(),
+                    iter_response(response),
                     mimetype='video/mp4',
                     headers={
-                        'Content-Length': str(video_data.get('total_size', 0)),
+                        'Content-Length': str(video_data.total_size),
                         'Accept-Ranges': 'bytes'
                     }
                 )
@@ -650,27 +605,52 @@ def register_frontend_routes(app):
         return "Type non supporté", 400
     
     
+    @app.route('/api/video/variant/<video_key>/<int:variant_num>')
+    @login_required
+    def video_variant(video_key, variant_num):
+        """Playlist média d'une rendition (ABR)"""
+        video_data = video_store.get(video_key)
+        if not video_data or video_data.player_type != 'vidmoly':
+            return "Non trouvé", 404
+        
+        variant = video_data.variant(variant_num)
+        if variant is None:
+            return "Variante non trouvée", 404
+        
+        # 🔥 Renditions chargées à la première demande du client, puis en cache
+        if not ensure_variant(video_key, video_data, variant):
+            return "Playlist indisponible", 502
+        
+        return Response(build_variant_manifest(video_key, video_data, variant_num),
+                        mimetype='application/vnd.apple.mpegurl')
+    
+    
     @app.route('/api/video/segment/<video_key>/<int:segment_num>')
+    @app.route('/api/video/segment/<video_key>/<int:variant_num>/<int:segment_num>')
     @login_required
-    def video_segment(video_key, segment_num):
-        """Proxy segment Vidmoly"""
-        video_data = app.config.get(f'video_{video_key}')
-        if not video_data or video_data['player_type'] != 'vidmoly':
+    def video_segment(video_key, segment_num, variant_num=None):
+        """Proxy segment Vidmoly (rendition par défaut ou variante ABR)"""
+        video_data = video_store.get(video_key)
+        if not video_data or video_data.player_type != 'vidmoly':
             return "Non trouvé", 404
         
-        segment_url = app.config.get(f'segment_{video_key}_{segment_num}')
+        variant = video_data.variant(video_data.default_variant if variant_num is None else variant_num)
+        if variant is None:
+            return "Variante non trouvée", 404
+        # Playlist upstream en échec : 502 pour que le lecteur réessaie
+        if not ensure_variant(video_key, video_data, variant):
+            return "Playlist indisponible", 502
+        
+        segment_url = variant.segment_url(segment_num)
         if not segment_url:
             return "Segment non trouvé", 404
         
         try:
-            response = video_session.get(segment_url, timeout=20, stream=True)
+            # 🔥 Cache partagé entre viewers + prefetch N+1..N+k de la même rendition
+            data = segment_cache.fetch(segment_url)
+            segment_cache.prefetch(variant, segment_num)
             
-            def generate():
-                for chunk in response.iter_content(chunk_size=8192):
-                    if chunk:
-                        yield chunk
-            
-            return Response(generate(), mimetype='video/mp2t')
+            return Response(data, mimetype='video/mp2t')
         except Exception as e:
             logger.error(f"Erreur segment {segment_num}: {e}")
             return f"Erreur: {str(e)}", 500
@@ -683,37 +663,25 @@ def register_frontend_routes(app):
     @app.route('/save-progress', methods=['POST'])
     @login_required
     def save_progress():
-        """Sauvegarde progression"""
-        import datetime
+        """Sauvegarde progression (buffer write-behind)"""
         anime_id = request.form.get('anime_id', type=int)
         season_number = request.form.get('season_number', type=int)
         episode_number = request.form.get('episode_number', type=int)
         time_position = request.form.get('time_position', type=float)
         completed = request.form.get('completed') == 'true'
+        duration = request.form.get('duration', type=float)
         
-        progress = UserProgress.query.filter_by(
-            user_id=current_user.id,
-            anime_id=anime_id,
-            season_number=season_number,
-            episode_number=episode_number
-        ).first()
+        # Sans identifiants valides, la ligne ferait échouer le flush du buffer
+        if None in (anime_id, season_number, episode_number):
+            return jsonify({'success': False, 'error': 'Paramètres invalides'}), 400
         
-        if progress:
-            progress.time_position = time_position
-            progress.completed = completed
-            progress.last_watched = datetime.datetime.utcnow()
-        else:
-            progress = UserProgress(
-                user_id=current_user.id,
-                anime_id=anime_id,
-                season_number=season_number,
-                episode_number=episode_number,
-                time_position=time_position,
-                completed=completed
-            )
-            db.session.add(progress)
-        
-        db.session.commit()
+        # 🔥 Dernière position gardée en mémoire, écrite par lots
+        record_progress(current_user.id, anime_id, season_number,
+                        episode_number, time_position, completed)
+        
+        # 🔥 Seuil de visionnage passé : épisode suivant résolu + premiers segments chauffés
+        next_episode_warmer.maybe_warm(anime_id, season_number, episode_number,
+                                       time_position, duration, completed)
         return jsonify({'success': True})
     
     
@@ -722,17 +690,10 @@ def register_frontend_routes(app):
     def toggle_favorite():
         """Toggle favori"""
         anime_id = request.form.get('anime_id', type=int)
-        favorite = UserFavorite.query.filter_by(user_id=current_user.id, anime_id=anime_id).first()
         
-        if favorite:
-            db.session.delete(favorite)
-            db.session.commit()
-            return jsonify({'success': True, 'action': 'removed'})
-        else:
-            favorite = UserFavorite(user_id=current_user.id, anime_id=anime_id)
-            db.session.add(favorite)
-            db.session.commit()
-            return jsonify({'success': True, 'action': 'added'})
+        # 🔥 Toggle atomique (pas de lecture préalable)
+        action = toggle_user_favorite(current_user.id, anime_id)
+        return jsonify({'success': True, 'action': action})
     
     
     # 🔥 ROUTE MANQUANTE - AJOUTÉE ICI
@@ -746,13 +707,8 @@ def register_frontend_routes(app):
             return jsonify({'success': False, 'error': 'ID manquant'}), 400
         
         try:
-            # Supprimer toutes les progressions de cet anime pour l'utilisateur
-            deleted_count = UserProgress.query.filter_by(
-                user_id=current_user.id,
-                anime_id=anime_id
-            ).delete()
-            
-            db.session.commit()
+            # Supprimer toutes les progressions de cet anime (buffer, DB, cache)
+            deleted_count = remove_anime_progress(current_user.id, anime_id)
             
             logger.info(f"✅ Supprimé {deleted_count} progressions pour anime {anime_id}")
             return jsonify({'success': True, 'deleted': deleted_count})
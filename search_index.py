@@ -0,0 +1,203 @@
+"""
+search_index.py - Index de recherche du catalogue (construit au chargement)
+N-grammes (1 à 3 caractères) -> postings, bitmap de genres par anime
+"""
+
+import threading
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+
+# Taille max des n-grammes indexés
+NGRAM_SIZE = 3
+# Totaux mémorisés pour les requêtes texte (plus ancien évincé au-delà)
+COUNT_CACHE_SIZE = 4096
+# Comptage texte arrêté au-delà : total affiché "1000+", coût indépendant du catalogue
+COUNT_LIMIT = 1000
+# Candidats examinés au plus par un comptage (filtres peu sélectifs : total minoré)
+COUNT_SCAN_LIMIT = 2000
+
+
+def normalize(text):
+    """Normalisation identique à l'ancien filtre (.lower())"""
+    return (text or '').lower()
+
+
+def _ngrams(text, size):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class SearchIndex:
+    """Recherche sous-chaîne + genre + langue sans rescanner le catalogue.
+
+    Les postings sont triés dans l'ordre du catalogue : les résultats
+    gardent donc le même ordre que l'ancien filtrage linéaire.
+    """
+
+    def __init__(self, animes):
+        self.animes = animes
+        self.titles = []              # titres normalisés
+        self.genre_masks = []         # bitmap des genres par anime
+        self.genre_bits = {}          # genre -> bit
+        self.genre_postings = {}      # genre -> array d'ids
+        self.playable = array('I')    # animes avec épisodes
+        self.playable_mask = bytearray(len(animes))
+        self.postings = {}            # n-gramme -> array d'ids
+        self.genre_playable_counts = {}  # genre -> nb d'animes jouables
+        self.language_masks = []      # bitmap des langues par anime
+        self.language_bits = {}       # langue -> bit
+        self.language_postings = {}   # langue -> array d'ids
+        self._counts = OrderedDict()  # (query, genre, language, playable_only) -> total
+        self._counts_lock = threading.Lock()
+
+        for doc_id, anime in enumerate(animes):
+            title = normalize(anime.get('title', ''))
+            self.titles.append(title)
+
+            mask = 0
+            for genre in {normalize(g) for g in anime.get('genres', [])}:
+                bit = self.genre_bits.get(genre)
+                if bit is None:
+                    bit = self.genre_bits[genre] = 1 << len(self.genre_bits)
+                    self.genre_postings[genre] = array('I')
+                mask |= bit
+                self.genre_postings[genre].append(doc_id)
+                if anime.get('has_episodes', False):
+                    self.genre_playable_counts[genre] = self.genre_playable_counts.get(genre, 0) + 1
+            self.genre_masks.append(mask)
+
+            mask = 0
+            for language in {normalize(l) for l in anime.get('languages', [])}:
+                bit = self.language_bits.get(language)
+                if bit is None:
+                    bit = self.language_bits[language] = 1 << len(self.language_bits)
+                    self.language_postings[language] = array('I')
+                mask |= bit
+                self.language_postings[language].append(doc_id)
+            self.language_masks.append(mask)
+
+            if anime.get('has_episodes', False):
+                self.playable.append(doc_id)
+                self.playable_mask[doc_id] = 1
+
+            for size in range(1, NGRAM_SIZE + 1):
+                for gram in _ngrams(title, size):
+                    posting = self.postings.get(gram)
+                    if posting is None:
+                        posting = self.postings[gram] = array('I')
+                    posting.append(doc_id)
+
+    def __len__(self):
+        return len(self.animes)
+
+    def _query_posting(self, query):
+        """Posting le plus sélectif pour la sous-chaîne"""
+        if len(query) <= NGRAM_SIZE:
+            return self.postings.get(query, ())
+
+        best = None
+        for gram in _ngrams(query, NGRAM_SIZE):
+            posting = self.postings.get(gram)
+            if not posting:
+                return ()
+            if best is None or len(posting) < len(best):
+                best = posting
+        return best
+
+    def _driver(self, query, genre, language, playable_only):
+        """Posting "moteur" le plus court parmi les filtres (normalisés)"""
+        candidates = []
+        if query:
+            candidates.append(self._query_posting(query))
+        if genre:
+            candidates.append(self.genre_postings.get(genre, ()))
+        if language:
+            candidates.append(self.language_postings.get(language, ()))
+        if playable_only:
+            candidates.append(self.playable)
+        return min(candidates, key=len) if candidates else range(len(self.animes))
+
+    def search_ids(self, query='', genre='', playable_only=False, limit=None, after=-1, language='',
+                   scan_limit=None):
+        """Positions (doc_id) des animes correspondants, dans l'ordre du catalogue.
+
+        `after` : reprend strictement après ce doc_id (pagination par curseur).
+        `scan_limit` : nombre max de candidats examinés.
+        """
+        query = normalize(query)
+        genre = normalize(genre)
+        language = normalize(language)
+
+        driver = self._driver(query, genre, language, playable_only)
+        # Postings triés : reprise après le curseur par dichotomie
+        start = bisect_right(driver, after) if after >= 0 else 0
+        end = len(driver) if scan_limit is None else min(len(driver), start + scan_limit)
+
+        genre_bit = self.genre_bits.get(genre, 0) if genre else 0
+        language_bit = self.language_bits.get(language, 0) if language else 0
+        titles = self.titles
+        genre_masks = self.genre_masks
+        language_masks = self.language_masks
+        playable = self.playable_mask
+
+        results = []
+        for i in range(start, end):
+            doc_id = driver[i]
+            # Vérification finale (trigrammes présents != sous-chaîne contiguë)
+            if query and query not in titles[doc_id]:
+                continue
+            if genre and not genre_masks[doc_id] & genre_bit:
+                continue
+            if language and not language_masks[doc_id] & language_bit:
+                continue
+            if playable_only and not playable[doc_id]:
+                continue
+            results.append(doc_id)
+            if limit is not None and len(results) >= limit:
+                break
+
+        return results
+
+    def count(self, query='', genre='', playable_only=False, language=''):
+        """(total, exact) : exact quand précalculé, minoré sinon.
+
+        Une recherche texte croisée avec d'autres filtres s'arrête au-delà
+        de COUNT_LIMIT résultats ou de COUNT_SCAN_LIMIT candidats examinés :
+        exact=False signifie "au moins total".
+        """
+        query = normalize(query)
+        genre = normalize(genre)
+        language = normalize(language)
+
+        if not query and not language:
+            if genre:
+                if playable_only:
+                    return self.genre_playable_counts.get(genre, 0), True
+                return len(self.genre_postings.get(genre, ())), True
+            return (len(self.playable) if playable_only else len(self.animes)), True
+        if not query and not genre and not playable_only:
+            return len(self.language_postings.get(language, ())), True
+        if len(query) <= NGRAM_SIZE and not genre and not language and not playable_only:
+            # Tous les n-grammes courts sont indexés : le posting est exact
+            return len(self.postings.get(query, ())), True
+
+        key = (query, genre, language, playable_only)
+        counted = self._counts.get(key)
+        if counted is None:
+            total = len(self.search_ids(query, genre, playable_only, limit=COUNT_LIMIT + 1,
+                                        language=language, scan_limit=COUNT_SCAN_LIMIT))
+            # Exact seulement si le posting moteur a été parcouru en entier
+            exact = (total <= COUNT_LIMIT
+                     and len(self._driver(query, genre, language, playable_only)) <= COUNT_SCAN_LIMIT)
+            counted = (min(total, COUNT_LIMIT), exact)
+            # Insertions concurrentes (threads de requêtes) : éviction sous verrou
+            with self._counts_lock:
+                self._counts[key] = counted
+                while len(self._counts) > COUNT_CACHE_SIZE:
+                    self._counts.popitem(last=False)
+        return counted
+
+    def search(self, query='', genre='', playable_only=False, limit=None):
+        """Animes dont le titre contient `query` et ayant le genre `genre`"""
+        animes = self.animes
+        return [animes[doc_id] for doc_id in self.search_ids(query, genre, playable_only, limit)]
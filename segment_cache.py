@@ -0,0 +1,306 @@
+"""
+segment_cache.py - Cache partagé des segments HLS + prefetch
+Mémoire (LRU en octets) avec débordement disque borné, clé = URL upstream
+"""
+
+import os
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from upstream import upstream, SEGMENT_TIMEOUT
+from streaming import read_body
+
+logger = logging.getLogger(__name__)
+
+# ==================
+# CONFIGURATION
+# ==================
+
+SEGMENT_CACHE_MEMORY_BYTES = int(os.environ.get('SEGMENT_CACHE_MEMORY_BYTES', 256 * 1024 * 1024))
+SEGMENT_CACHE_DISK_BYTES = int(os.environ.get('SEGMENT_CACHE_DISK_BYTES', 2 * 1024 * 1024 * 1024))
+SEGMENT_CACHE_DIR = os.environ.get('SEGMENT_CACHE_DIR',
+                                   os.path.join(tempfile.gettempdir(), 'animezone_segments'))
+SEGMENT_PREFETCH_COUNT = int(os.environ.get('SEGMENT_PREFETCH_COUNT', 3))
+SEGMENT_PREFETCH_WORKERS = int(os.environ.get('SEGMENT_PREFETCH_WORKERS', 8))
+# Attente d'un fetch lancé par un autre viewer : même borne que la lecture upstream
+SEGMENT_FETCH_TIMEOUT = SEGMENT_TIMEOUT[1]
+
+
+# ==================
+# CACHE
+# ==================
+
+def _cleanup_stale_dirs(root):
+    """Supprime les spills laissés par des process terminés"""
+    if not os.path.isdir(root):
+        return
+    for name in os.listdir(root):
+        if not name.isdigit():
+            continue
+        pid = int(name)
+        if pid != os.getpid():
+            try:
+                os.kill(pid, 0)
+                continue
+            except ProcessLookupError:
+                pass
+            except OSError:
+                continue
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+class ProcessDir:
+    """Sous-dossier du process courant, créé au premier usage.
+
+    Résolu après le fork : avec gunicorn --preload, le cache est construit
+    dans le master et chaque worker doit écrire sous son propre pid.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def path(self):
+        pid = os.getpid()
+        path = os.path.join(self.root, str(pid))
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    _cleanup_stale_dirs(self.root)
+                    os.makedirs(path, exist_ok=True)
+                    self._pid = pid
+        return path
+
+
+class SegmentCache:
+    """Cache thread-safe mémoire + disque, fetch single-flight par URL"""
+
+    def __init__(self, memory_bytes=SEGMENT_CACHE_MEMORY_BYTES,
+                 disk_bytes=SEGMENT_CACHE_DISK_BYTES, cache_dir=SEGMENT_CACHE_DIR,
+                 prefetch_count=SEGMENT_PREFETCH_COUNT, workers=SEGMENT_PREFETCH_WORKERS):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        # Un sous-dossier par process (workers gunicorn), résolu au premier spill
+        self.cache_dir = ProcessDir(cache_dir) if disk_bytes > 0 else None
+        self.prefetch_count = prefetch_count
+
+        self._memory = OrderedDict()   # url -> bytes
+        self._memory_size = 0
+        self._disk = OrderedDict()     # url -> taille fichier
+        self._disk_size = 0
+        self._inflight = {}            # url -> threading.Event
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='segment-prefetch')
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.prefetch_errors = 0
+        self.evictions = 0
+
+    # ---------- Lecture ----------
+
+    def get_memory(self, url, count=True):
+        """Segment en mémoire ou None, sans I/O (sûr depuis l'event loop)"""
+        with self._lock:
+            data = self._memory.get(url)
+            if data is not None:
+                self._memory.move_to_end(url)
+                if count:
+                    self.memory_hits += 1
+            return data
+
+    def get(self, url, count=True):
+        """Segment en cache (mémoire puis disque) ou None"""
+        data = self.get_memory(url, count)
+        if data is not None:
+            return data
+
+        with self._lock:
+            on_disk = url in self._disk
+            if on_disk:
+                self._disk.move_to_end(url)
+
+        if on_disk:
+            try:
+                with open(self._path(url), 'rb') as f:
+                    data = f.read()
+                if count:
+                    with self._lock:
+                        self.disk_hits += 1
+                return data
+            except OSError:
+                with self._lock:
+                    self._drop_disk(url)
+
+        if count:
+            with self._lock:
+                self.misses += 1
+        return None
+
+    def fetch(self, url, count=True):
+        """Segment depuis le cache, sinon upstream (un seul fetch par URL)"""
+        data = self.get(url, count)
+        if data is not None:
+            return data
+
+        with self._lock:
+            event = self._inflight.get(url)
+            owner = event is None
+            if owner:
+                event = self._inflight[url] = threading.Event()
+
+        if not owner:
+            # Un autre viewer (ou le prefetch) télécharge déjà ce segment
+            event.wait(SEGMENT_FETCH_TIMEOUT)
+            data = self.get(url, count=False)
+            if data is not None:
+                return data
+            # Propriétaire trop lent ou en échec : on garde notre copie pour les suivants
+            data = self._download(url)
+            self.put(url, data)
+            return data
+
+        try:
+            data = self._download(url)
+            self.put(url, data)
+            return data
+        finally:
+            with self._lock:
+                self._inflight.pop(url, None)
+            event.set()
+
+    def is_inflight(self, url):
+        return url in self._inflight
+
+    def wait(self, url, timeout=SEGMENT_FETCH_TIMEOUT):
+        event = self._inflight.get(url)
+        if event is not None:
+            event.wait(timeout)
+
+    # ---------- Écriture ----------
+
+    def put(self, url, data):
+        if not data or len(data) > self.memory_bytes // 4:
+            return
+
+        with self._lock:
+            if url in self._memory:
+                self._memory_size -= len(self._memory.pop(url))
+            self._memory[url] = data
+            self._memory_size += len(data)
+
+            spilled = []
+            while self._memory_size > self.memory_bytes:
+                old_url, old_data = self._memory.popitem(last=False)
+                self._memory_size -= len(old_data)
+                if old_url not in self._disk:
+                    spilled.append((old_url, old_data))
+
+        for old_url, old_data in spilled:
+            self._spill(old_url, old_data)
+
+    def _spill(self, url, data):
+        """Débordement disque (sinon l'entrée est simplement évincée)"""
+        if not self.cache_dir or len(data) > self.disk_bytes:
+            with self._lock:
+                self.evictions += 1
+            return
+
+        try:
+            path = self._path(url)
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Erreur spill segment: {e}")
+            return
+
+        with self._lock:
+            if url in self._disk:
+                return
+            self._disk[url] = len(data)
+            self._disk_size += len(data)
+            while self._disk_size > self.disk_bytes:
+                old_url = next(iter(self._disk))
+                self._drop_disk(old_url)
+                self.evictions += 1
+
+    def _drop_disk(self, url):
+        size = self._disk.pop(url, None)
+        if size is None:
+            return
+        self._disk_size -= size
+        try:
+            os.remove(self._path(url))
+        except OSError:
+            pass
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir.path(), hashlib.sha1(url.encode()).hexdigest() + '.ts')
+
+    # ---------- Upstream ----------
+
+    def _download(self, url):
+        response = upstream.get(url, stream=True, timeout=SEGMENT_TIMEOUT)
+        try:
+            response.raise_for_status()
+        except Exception:
+            response.close()
+            raise
+        return read_body(response)
+
+    def prefetch(self, video_data, segment_num, count=None):
+        """Télécharge N+1..N+k en arrière-plan"""
+        count = self.prefetch_count if count is None else count
+        for index in range(segment_num + 1, segment_num + 1 + count):
+            url = video_data.segment_url(index)
+            if not url:
+                break
+            with self._lock:
+                if url in self._memory or url in self._disk or url in self._inflight:
+                    continue
+            self._executor.submit(self._prefetch_one, url)
+
+    def _prefetch_one(self, url):
+        try:
+            self.fetch(url, count=False)
+            with self._lock:
+                self.prefetched += 1
+        except Exception as e:
+            with self._lock:
+                self.prefetch_errors += 1
+            logger.warning(f"Prefetch segment échoué: {e}")
+
+    def stats(self):
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                'memory_entries': len(self._memory),
+                'memory_bytes': self._memory_size,
+                'max_memory_bytes': self.memory_bytes,
+                'disk_entries': len(self._disk),
+                'disk_bytes': self._disk_size,
+                'max_disk_bytes': self.disk_bytes,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(hits / total, 4) if total else 0.0,
+                'inflight': len(self._inflight),
+                'prefetched': self.prefetched,
+                'prefetch_errors': self.prefetch_errors,
+                'evictions': self.evictions,
+            }
+
+
+# Instance partagée (process)
+segment_cache = SegmentCache()
@@ -0,0 +1,653 @@
+"""
+source_resolver.py - Résolution des sources Vidmoly / SendVid
+Cache par (player_type, video_id) dans le video_store, TTL calé sur la
+durée de vie du token des URLs signées, une seule résolution en vol par clé.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urljoin, urlsplit, parse_qs
+
+import m3u8
+
+from app import get_episode, get_episode_links
+from upstream import upstream, PAGE_TIMEOUT
+from video_store import VideoSession, Variant, video_store
+from segment_cache import segment_cache
+
+logger = logging.getLogger(__name__)
+
+# ==================
+# CONFIGURATION
+# ==================
+
+# Marge retirée à la durée de vie du token (le client doit finir de lire)
+RESOLVE_EXPIRY_MARGIN = int(os.environ.get('RESOLVE_EXPIRY_MARGIN', 120))
+# TTL plancher : /api/video/stream doit retrouver la session juste après
+RESOLVE_MIN_TTL = int(os.environ.get('RESOLVE_MIN_TTL', 30))
+# Attente max d'une résolution lancée par une autre requête
+RESOLVE_WAIT_TIMEOUT = 30
+
+# Course entre sources d'un épisode (player) : délai max et parallélisme
+RESOLVE_DEADLINE = float(os.environ.get('RESOLVE_DEADLINE', 3.0))
+# Attente dans player() : courte pour ne pas retarder le rendu. Sur cache froid,
+# une source saine trouvée dans ce délai passe en tête ; sinon classement statique,
+# la course continue et /api/video/info la rejoint (0 = jamais d'attente)
+PLAYER_RESOLVE_DEADLINE = float(os.environ.get('PLAYER_RESOLVE_DEADLINE', 0.5))
+RESOLVE_RACE_WORKERS = int(os.environ.get('RESOLVE_RACE_WORKERS', 8))
+
+# Préférences statiques : langue d'abord, puis hôte (départage sans mesure)
+LANGUAGE_ORDER = ('VF', 'VOSTFR')
+HOST_ORDER = ('vidmoly', 'sendvid')
+# Latence supposée d'un hôte jamais mesuré
+HOST_PRIOR_MS = 1000.0
+HOST_EWMA_ALPHA = 0.3
+
+# Pré-résolution de l'épisode suivant : fraction vue, segments chauffés
+PRERESOLVE_THRESHOLD = float(os.environ.get('PRERESOLVE_THRESHOLD', 0.8))
+PRERESOLVE_SEGMENTS = int(os.environ.get('PRERESOLVE_SEGMENTS', 3))
+# Pas de nouvelle tentative pour le même épisode avant ce délai (s)
+PRERESOLVE_COOLDOWN = 300
+PRERESOLVE_MAX_TRACKED = 4096
+
+# Paramètres d'expiration rencontrés dans les URLs signées des CDN
+EXPIRY_PARAMS = ('expires', 'expire', 'exp', 'e', 'validto', 'deadline')
+
+
+# ==================
+# EXTRACTION (scraping des pages embed)
+# ==================
+
+def parse_video_url(url):
+    """Parse URL vidéo"""
+    if not url:
+        return None, None
+    
+    url_clean = url.strip().lower()
+    
+    # SENDVID
+    if 'sendvid' in url_clean:
+        match = re.search(r'sendvid\.com/embed/([a-zA-Z0-9]+)', url, re.IGNORECASE)
+        if match:
+            return ('sendvid', match.group(1))
+        
+        match = re.search(r'sendvid\.com/([a-zA-Z0-9]+)', url, re.IGNORECASE)
+        if match:
+            return ('sendvid', match.group(1))
+    
+    # VIDMOLY
+    if 'vidmoly' in url_clean:
+        match = re.search(r'embed-([a-zA-Z0-9]+)\.html', url, re.IGNORECASE)
+        if match:
+            return ('vidmoly', match.group(1))
+    
+    return None, None
+
+
+def extract_vidmoly_m3u8(embed_url):
+    """Extrait M3U8 Vidmoly"""
+    try:
+        response = upstream.get(embed_url, timeout=PAGE_TIMEOUT)
+        html = response.text
+        
+        pattern = r'sources\s*:\s*\[\s*{\s*file\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']'
+        match = re.search(pattern, html, re.IGNORECASE)
+        
+        if match:
+            return match.group(1)
+        
+        pattern2 = r'file\s*:\s*["\']([^"\']+\.m3u8[^"\']*)["\']'
+        match = re.search(pattern2, html, re.IGNORECASE)
+        
+        return match.group(1) if match else None
+    except Exception as e:
+        logger.error(f"Erreur Vidmoly M3U8: {e}")
+        return None
+
+
+def extract_sendvid_video(embed_url):
+    """Extrait URL MP4 SendVid"""
+    try:
+        response = upstream.get(embed_url, timeout=PAGE_TIMEOUT)
+        html = response.text
+        
+        # Pattern 1: <source>
+        pattern1 = r'<source[^>]*src=["\']([^"\']+\.mp4[^"\']*)["\']'
+        match = re.search(pattern1, html, re.IGNORECASE)
+        if match:
+            url = match.group(1)
+            return url if url.startswith('http') else urljoin('https://sendvid.com', url)
+        
+        # Pattern 2: file variable
+        pattern2 = r'file\s*:\s*["\']([^"\']+\.(mp4|webm)[^"\']*)["\']'
+        match = re.search(pattern2, html, re.IGNORECASE)
+        if match:
+            url = match.group(1)
+            return url if url.startswith('http') else urljoin('https://sendvid.com', url)
+        
+        return None
+    except Exception as e:
+        logger.error(f"Erreur SendVid: {e}")
+        return None
+
+
+def _fill_variant(variant, playlist):
+    """Segments absolus + target duration d'une playlist média"""
+    base_url = variant.url.rsplit('/', 1)[0] + '/'
+    segments = [
+        (seg.uri if seg.uri.startswith('http') else urljoin(base_url, seg.uri), seg.duration)
+        for seg in playlist.segments
+    ]
+    durations = [d for _, d in segments if d]
+    variant.target_duration = int(max(durations) + 1) if durations else 10
+    variant.segments = segments
+
+
+def get_hls_variants(master_url):
+    """Renditions du master : (variantes, index par défaut), ([], 0) si échec"""
+    try:
+        response = upstream.get(master_url, timeout=PAGE_TIMEOUT)
+        master = m3u8.loads(response.text)
+        
+        # Playlist média directe : une seule rendition, déjà chargée
+        if master.segments:
+            variant = Variant(master_url)
+            _fill_variant(variant, master)
+            return [variant], 0
+        
+        if master.playlists:
+            base_url = master_url.rsplit('/', 1)[0] + '/'
+            variants = []
+            for playlist in master.playlists:
+                info = playlist.stream_info
+                variants.append(Variant(
+                    urljoin(base_url, playlist.uri),
+                    bandwidth=info.bandwidth or info.average_bandwidth or 0,
+                    resolution=info.resolution,
+                    codecs=info.codecs,
+                    frame_rate=info.frame_rate
+                ))
+            # Même rendition de départ qu'avant : la dernière du master
+            return variants, len(variants) - 1
+        
+        return [], 0
+    except Exception as e:
+        logger.error(f"Erreur HLS: {e}")
+        return [], 0
+
+
+def load_variant(variant):
+    """Charge une fois les segments d'une rendition ; False si la playlist est inutilisable"""
+    if variant.loaded:
+        return True
+    with variant.lock:
+        if variant.loaded:
+            return True
+        try:
+            response = upstream.get(variant.url, timeout=PAGE_TIMEOUT)
+            playlist = m3u8.loads(response.text)
+        except Exception as e:
+            logger.error(f"Erreur HLS variante {variant.url}: {e}")
+            return False
+        if not playlist.segments:
+            return False
+        _fill_variant(variant, playlist)
+        return True
+
+
+# ==================
+# RÉSOLUTION
+# ==================
+
+class ResolveError(Exception):
+    """Source introuvable : message + statut HTTP renvoyés par /api/video/info"""
+
+    def __init__(self, message, status=404):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def token_ttl(url, now=None):
+    """Durée de vie restante (s) du token d'une URL signée, None si inconnue"""
+    now = time.time() if now is None else now
+    params = parse_qs(urlsplit(url).query)
+
+    for name in EXPIRY_PARAMS:
+        value = params.get(name, [''])[0]
+        if not value.isdigit():
+            continue
+        value = int(value)
+        if value > 1_000_000_000:
+            # Timestamp absolu
+            return value - now
+        # Durée relative au début de validité (s=) sinon à maintenant
+        start = params.get('s', [''])[0]
+        start = int(start) if start.isdigit() and int(start) > 1_000_000_000 else now
+        return start + value - now
+    return None
+
+
+def session_ttl(*urls):
+    """TTL de cache : token le plus court moins la marge, None si aucun token"""
+    remaining = [ttl for ttl in (token_ttl(url) for url in urls if url) if ttl is not None]
+    if not remaining:
+        return None
+    return max(min(remaining) - RESOLVE_EXPIRY_MARGIN, RESOLVE_MIN_TTL)
+
+
+def resolve_source(player_type, video_id):
+    """Scrape l'embed + playlists ; VideoSession prête à streamer"""
+    # VIDMOLY
+    if player_type == 'vidmoly':
+        embed_url = f"https://vidmoly.net/embed-{video_id}.html"
+        m3u8_url = extract_vidmoly_m3u8(embed_url)
+
+        if not m3u8_url:
+            raise ResolveError('M3U8 non trouvé', 404)
+
+        # Toutes les renditions ; seule celle de départ est chargée d'avance
+        variants, default = get_hls_variants(m3u8_url)
+
+        if not variants or not load_variant(variants[default]):
+            raise ResolveError('Segments non trouvés', 500)
+
+        playlist = variants[default]
+        return VideoSession(
+            'vidmoly',
+            playlist.url,
+            variants=variants,
+            default_variant=default,
+            ttl=session_ttl(m3u8_url, playlist.url, playlist.segments[0][0])
+        )
+
+    # SENDVID
+    if player_type == 'sendvid':
+        embed_url = f"https://sendvid.com/embed/{video_id}"
+        video_url = extract_sendvid_video(embed_url)
+
+        if not video_url:
+            raise ResolveError('Vidéo non trouvée', 404)
+
+        try:
+            head_response = upstream.head(video_url, timeout=PAGE_TIMEOUT, allow_redirects=True)
+            accepts_range = 'bytes' in head_response.headers.get('Accept-Ranges', '').lower()
+            total_size = int(head_response.headers.get('Content-Length', 0))
+            video_url = head_response.url
+        except Exception:
+            accepts_range = False
+            total_size = 0
+
+        return VideoSession(
+            'sendvid',
+            video_url,
+            accepts_range=accepts_range,
+            total_size=total_size,
+            ttl=session_ttl(video_url)
+        )
+
+    raise ResolveError('Type non supporté', 400)
+
+
+class HostScores:
+    """Latence et taux d'échec (moyennes mobiles exponentielles) par hôte"""
+
+    def __init__(self, alpha=HOST_EWMA_ALPHA):
+        self.alpha = alpha
+        self._hosts = {}  # hôte -> [latence_ms, taux_échec, tentatives, échecs]
+        self._lock = threading.Lock()
+
+    def record(self, host, elapsed_ms, ok):
+        with self._lock:
+            entry = self._hosts.get(host)
+            if entry is None:
+                self._hosts[host] = [elapsed_ms, 0.0 if ok else 1.0, 1, 0 if ok else 1]
+                return
+            entry[0] += self.alpha * (elapsed_ms - entry[0])
+            entry[1] += self.alpha * ((0.0 if ok else 1.0) - entry[1])
+            entry[2] += 1
+            entry[3] += 0 if ok else 1
+
+    def score(self, host):
+        """Temps attendu avant un flux exploitable (ms) : plus bas = meilleur"""
+        entry = self._hosts.get(host)
+        if entry is None:
+            return HOST_PRIOR_MS
+        return entry[0] / max(1.0 - entry[1], 0.05)
+
+    def stats(self):
+        with self._lock:
+            return {
+                host: {
+                    'latency_ms': round(latency, 1),
+                    'failure_rate': round(failure_rate, 3),
+                    'score': round(latency / max(1.0 - failure_rate, 0.05), 1),
+                    'attempts': attempts,
+                    'failures': failures,
+                }
+                for host, (latency, failure_rate, attempts, failures) in self._hosts.items()
+            }
+
+
+class SourceResolver:
+    """Cache de résolution (video_store) + single-flight par video_key"""
+
+    def __init__(self, store=video_store):
+        self.store = store
+        self.hosts = HostScores()
+        self._inflight = {}  # video_key -> Future(VideoSession)
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=512)  # ms, résolutions récentes
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.errors = 0
+        self.races = {'total': 0, 'decided': 0, 'timeouts': 0}
+
+    def resolve(self, player_type, video_id):
+        """(video_key, VideoSession) ; ResolveError si la source est introuvable"""
+        video_key = f"{player_type}_{video_id}"
+
+        session = self.store.get(video_key)
+        if session is not None:
+            with self._lock:
+                self.hits += 1
+            return video_key, session
+
+        with self._lock:
+            future = self._inflight.get(video_key)
+            owner = future is None
+            if owner:
+                future = self._inflight[video_key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            # Même épisode demandé en rafale : on attend la résolution en cours
+            return video_key, future.result(timeout=RESOLVE_WAIT_TIMEOUT)
+
+        start = time.perf_counter()
+        try:
+            session = resolve_source(player_type, video_id)
+        except Exception as e:
+            self.hosts.record(player_type, (time.perf_counter() - start) * 1000, False)
+            with self._lock:
+                self.errors += 1
+                self._inflight.pop(video_key, None)
+            future.set_exception(e)
+            raise
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.hosts.record(player_type, elapsed_ms, True)
+        self.store.put(video_key, session)
+        with self._lock:
+            self._latencies.append(elapsed_ms)
+            self._inflight.pop(video_key, None)
+        future.set_result(session)
+        return video_key, session
+
+    def is_inflight(self, video_key):
+        return video_key in self._inflight
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses + self.coalesced
+            latencies = sorted(self._latencies)
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'errors': self.errors,
+                'inflight': len(self._inflight),
+                'hit_rate': round((self.hits + self.coalesced) / total, 4) if total else 0.0,
+                'latency_ms': {
+                    'avg': round(sum(latencies) / len(latencies), 1) if latencies else None,
+                    'p50': round(latencies[len(latencies) // 2], 1) if latencies else None,
+                    'p95': round(latencies[int(len(latencies) * 0.95)], 1) if latencies else None,
+                    'max': round(latencies[-1], 1) if latencies else None,
+                },
+                'races': dict(self.races),
+                'hosts': self.hosts.stats(),
+            }
+
+
+# Instance partagée (process)
+source_resolver = SourceResolver()
+
+
+# ==================
+# COURSE ENTRE SOURCES (player)
+# ==================
+
+_race_pool = ThreadPoolExecutor(max_workers=RESOLVE_RACE_WORKERS, thread_name_prefix='resolve')
+
+_STATUS_ORDER = {'ready': 0, 'pending': 1, 'iframe': 2, 'failed': 3}
+
+
+def _language_rank(lang):
+    return LANGUAGE_ORDER.index(lang) if lang in LANGUAGE_ORDER else len(LANGUAGE_ORDER)
+
+
+def _host_rank(player_type, resolver):
+    # Hôtes non segmentables (iframe) après les autres
+    if player_type is None:
+        return (1, 0.0, 0)
+    static = HOST_ORDER.index(player_type) if player_type in HOST_ORDER else len(HOST_ORDER)
+    return (0, resolver.hosts.score(player_type), static)
+
+
+def rank_candidates(urls_dict, resolver=None):
+    """Toutes les URLs de l'épisode, par langue préférée puis meilleur hôte"""
+    resolver = resolver or source_resolver
+    candidates = []
+    seen = set()
+    for position, (lang, urls) in enumerate((urls_dict or {}).items()):
+        if isinstance(urls, str):
+            urls = [urls]
+        for url in urls or ():
+            if not url:
+                continue
+            player_type, video_id = parse_video_url(url)
+            key = f"{player_type}_{video_id}" if player_type else url
+            if key in seen:
+                continue
+            seen.add(key)
+            candidates.append({
+                'url': url,
+                'lang': lang,
+                'player_type': player_type,
+                'video_id': video_id,
+                'video_key': key if player_type else None,
+                'status': 'pending' if player_type else 'iframe',
+                '_rank': (_language_rank(lang), position, _host_rank(player_type, resolver)),
+            })
+    candidates.sort(key=lambda c: c['_rank'])
+    return candidates
+
+
+def _pick(candidates):
+    """Premier flux sain de la langue préférée ; None s'il faut encore attendre"""
+    languages = []
+    for candidate in candidates:
+        if candidate['lang'] not in languages:
+            languages.append(candidate['lang'])
+
+    for lang in languages:
+        group = [c for c in candidates if c['lang'] == lang]
+        ready = [c for c in group if c['status'] == 'ready']
+        if ready:
+            # Arrivée la plus rapide de la langue
+            return min(ready, key=lambda c: c['_ready_at'])
+        if any(c['status'] == 'pending' for c in group):
+            return None
+        iframe = [c for c in group if c['status'] == 'iframe']
+        if iframe:
+            return iframe[0]
+        # Toute la langue a échoué : langue suivante
+    return candidates[0] if candidates else None
+
+
+def resolve_candidates(urls_dict, deadline=RESOLVE_DEADLINE, resolver=None):
+    """Résout toutes les sources en parallèle sous un délai court.
+
+    Renvoie les candidats classés : le premier flux sain (langue préférée,
+    hôte le plus rapide) puis les replis. Les sources déjà dans le store
+    sont prêtes d'emblée ; les résolutions non terminées à l'échéance
+    (immédiate avec deadline=0) continuent en tâche de fond et alimentent
+    le video_store.
+    """
+    resolver = resolver or source_resolver
+    candidates = rank_candidates(urls_dict, resolver)
+    if not candidates:
+        return []
+    start = time.monotonic()
+
+    pending = {}
+    for candidate in candidates:
+        if not candidate['player_type']:
+            continue
+        if resolver.store.get(candidate['video_key'], count=False) is not None:
+            # Déjà résolue : prête sans attendre le pool
+            candidate['status'] = 'ready'
+            candidate['_ready_at'] = start
+        else:
+            future = _race_pool.submit(resolver.resolve, candidate['player_type'], candidate['video_id'])
+            pending[future] = candidate
+
+    with resolver._lock:
+        resolver.races['total'] += 1
+
+    chosen = _pick(candidates)
+    while chosen is None and pending:
+        remaining = start + deadline - time.monotonic()
+        done, _ = wait(pending, timeout=max(remaining, 0), return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            candidate = pending.pop(future)
+            if future.exception() is None:
+                candidate['status'] = 'ready'
+                candidate['_ready_at'] = time.monotonic()
+            else:
+                candidate['status'] = 'failed'
+        chosen = _pick(candidates)
+
+    with resolver._lock:
+        resolver.races['decided' if chosen is not None else 'timeouts'] += 1
+
+    if chosen is None:
+        # Échéance : classement statique, /api/video/info rejoindra la résolution en vol
+        chosen = candidates[0]
+
+    fallbacks = sorted((c for c in candidates if c is not chosen),
+                       key=lambda c: (c['_rank'][0], _STATUS_ORDER[c['status']], c['_rank'][1:]))
+    return [
+        {'url': c['url'], 'lang': c['lang'], 'player_type': c['player_type'],
+         'video_key': c['video_key'], 'status': c['status']}
+        for c in [chosen] + fallbacks
+    ]
+
+
+# ==================
+# PRÉ-RÉSOLUTION DE L'ÉPISODE SUIVANT
+# ==================
+
+class NextEpisodeWarmer:
+    """Résout l'épisode suivant et chauffe ses premiers segments en arrière-plan"""
+
+    def __init__(self, resolver=source_resolver, segments=segment_cache,
+                 threshold=PRERESOLVE_THRESHOLD, segment_count=PRERESOLVE_SEGMENTS):
+        self.resolver = resolver
+        self.segments = segments
+        self.threshold = threshold
+        self.segment_count = segment_count
+        self._recent = OrderedDict()  # (anime_id, saison, épisode) -> dernier lancement
+        self._lock = threading.Lock()
+        # Pool dédié : resolve_candidates() attend lui-même sur _race_pool
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='preresolve')
+
+        self.triggered = 0
+        self.warmed = 0
+        self.failed = 0
+        self.segments_queued = 0
+
+    def should_warm(self, time_position, duration, completed):
+        if completed:
+            return True
+        if not duration or duration <= 0 or time_position is None:
+            return False
+        return time_position / duration >= self.threshold
+
+    def maybe_warm(self, anime_id, season_number, episode_number,
+                   time_position=None, duration=None, completed=False):
+        """Appelé à chaque sauvegarde de progression ; True si un préchauffage est lancé"""
+        if None in (anime_id, season_number, episode_number):
+            return False
+        if not self.should_warm(time_position, duration, completed):
+            return False
+
+        _, next_key = get_episode_links(anime_id, season_number, episode_number)
+        if next_key is None:
+            return False
+        key = (int(anime_id), *next_key)
+
+        now = time.monotonic()
+        with self._lock:
+            last = self._recent.get(key)
+            if last is not None and now - last < PRERESOLVE_COOLDOWN:
+                return False
+            self._recent[key] = now
+            self._recent.move_to_end(key)
+            while len(self._recent) > PRERESOLVE_MAX_TRACKED:
+                self._recent.popitem(last=False)
+            self.triggered += 1
+
+        self._executor.submit(self._warm, key)
+        return True
+
+    def _warm(self, key):
+        try:
+            _, episode = get_episode(*key)
+            if not episode:
+                return
+            # Même classement que player() : la page suivante tombera sur le cache
+            sources = resolve_candidates(episode.get('urls', {}), resolver=self.resolver)
+            best = sources[0] if sources else None
+            if best is None or best['status'] != 'ready':
+                with self._lock:
+                    self.failed += 1
+                return
+
+            session = self.resolver.store.get(best['video_key'], count=False)
+            if session is not None and session.player_type == 'vidmoly' and self.segment_count:
+                self.segments.prefetch(session, -1, self.segment_count)
+                with self._lock:
+                    self.segments_queued += self.segment_count
+            with self._lock:
+                self.warmed += 1
+        except Exception as e:
+            with self._lock:
+                self.failed += 1
+            logger.warning(f"Pré-résolution épisode suivant échouée {key}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'threshold': self.threshold,
+                'segments': self.segment_count,
+                'triggered': self.triggered,
+                'warmed': self.warmed,
+                'failed': self.failed,
+                'segments_queued': self.segments_queued,
+                'tracked': len(self._recent),
+            }
+
+
+next_episode_warmer = NextEpisodeWarmer()
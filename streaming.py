@@ -0,0 +1,247 @@
+"""
+streaming.py - Copie des octets vidéo proxifiés (upstream ou fichier -> client)
+Lectures readinto() dans des buffers réutilisés, taille de chunk adaptée au
+débit observé, et sendfile (wsgi.file_wrapper) quand la source est un
+fichier déjà en cache.
+"""
+
+import os
+import time
+import threading
+
+# ==================
+# CONFIGURATION
+# ==================
+
+# Bornes des chunks envoyés au client
+STREAM_CHUNK_MIN = int(os.environ.get('STREAM_CHUNK_MIN', 64 * 1024))
+STREAM_CHUNK_MAX = int(os.environ.get('STREAM_CHUNK_MAX', 1024 * 1024))
+# Durée visée par lecture : assez grand pour peu d'itérations, assez court
+# pour ne pas retenir les premiers octets quand l'upstream est lent
+STREAM_CHUNK_TARGET_MS = float(os.environ.get('STREAM_CHUNK_TARGET_MS', 50))
+# Buffers STREAM_CHUNK_MAX gardés pour réutilisation
+STREAM_BUFFER_POOL = int(os.environ.get('STREAM_BUFFER_POOL', 64))
+
+_STATS = {'streams': 0, 'file_streams': 0, 'chunks': 0, 'bytes': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(streams=0, file_streams=0, chunks=0, nbytes=0):
+    with _stats_lock:
+        _STATS['streams'] += streams
+        _STATS['file_streams'] += file_streams
+        _STATS['chunks'] += chunks
+        _STATS['bytes'] += nbytes
+
+
+# ==================
+# BUFFERS
+# ==================
+
+class BufferPool:
+    """Pile bornée de bytearray de taille fixe"""
+
+    def __init__(self, size=STREAM_CHUNK_MAX, max_buffers=STREAM_BUFFER_POOL):
+        self.size = size
+        self.max_buffers = max_buffers
+        self._free = []
+        self._lock = threading.Lock()
+        self.allocated = 0
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+            self.allocated += 1
+        return bytearray(self.size)
+
+    def release(self, buffer):
+        with self._lock:
+            if len(self._free) < self.max_buffers:
+                self._free.append(buffer)
+
+    def stats(self):
+        with self._lock:
+            return {'buffer_size': self.size, 'free': len(self._free), 'allocated': self.allocated}
+
+
+buffer_pool = BufferPool()
+
+
+class AdaptiveChunkSize:
+    """Taille de la prochaine lecture : débit mesuré x durée visée, en puissance de 2"""
+
+    def __init__(self, minimum=STREAM_CHUNK_MIN, maximum=STREAM_CHUNK_MAX,
+                 target_ms=STREAM_CHUNK_TARGET_MS):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target = target_ms / 1000
+        # Premier chunk petit : les premiers octets partent vite
+        self.size = minimum
+
+    def update(self, nbytes, elapsed):
+        if nbytes < self.size:
+            # Lecture courte (fin de flux ou upstream lent) : on réduit
+            self.size = max(self.minimum, self.size // 2)
+            return
+        wanted = nbytes / elapsed * self.target if elapsed > 0 else self.maximum
+        if wanted >= self.size * 2:
+            self.size = min(self.maximum, self.size * 2)
+        elif wanted < self.size // 2:
+            self.size = max(self.minimum, self.size // 2)
+
+
+# ==================
+# UPSTREAM -> CLIENT
+# ==================
+
+def _raw_reader(response):
+    """Objet offrant readinto() sans copie intermédiaire, None si le corps est encodé"""
+    encoding = response.headers.get('Content-Encoding', 'identity').lower()
+    if encoding not in ('', 'identity'):
+        return None
+    raw = response.raw
+    # http.client.HTTPResponse sous urllib3 : readinto() direct dans notre buffer
+    # (urllib3.readinto passe par read() et recopie)
+    return getattr(raw, '_fp', None) or raw
+
+
+def close_response(response):
+    """close() qui rend la connexion au pool keep-alive si le corps a été lu.
+
+    Les lectures passent sous urllib3 : requests croit le corps non consommé
+    et close() fermerait le socket. http.client ferme son fp en fin de corps,
+    la connexion peut alors resservir.
+    """
+    raw = response.raw
+    fp = getattr(raw, '_fp', None)
+    if fp is not None and fp.isclosed():
+        raw.release_conn()
+    response.close()
+
+
+def read_body(response):
+    """Corps complet d'une réponse requests (stream=True), puis close_response()"""
+    _count(streams=1)
+    reader = _raw_reader(response)
+    try:
+        # Une lecture à la taille annoncée, sans les chunks de 10 Ko de .content
+        data = response.content if reader is None else reader.read()
+        _count(chunks=1, nbytes=len(data))
+        return data
+    finally:
+        close_response(response)
+
+
+def iter_response(response):
+    """Générateur du corps d'une réponse requests (stream=True), puis close()"""
+    _count(streams=1)
+    reader = _raw_reader(response)
+    try:
+        if reader is None:
+            # Corps compressé : décodage par requests
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_MIN):
+                if chunk:
+                    _count(chunks=1, nbytes=len(chunk))
+                    yield chunk
+            return
+
+        sizer = AdaptiveChunkSize()
+        buffer = buffer_pool.acquire()
+        view = memoryview(buffer)
+        try:
+            while True:
+                start = time.perf_counter()
+                n = reader.readinto(view[:sizer.size])
+                if not n:
+                    break
+                sizer.update(n, time.perf_counter() - start)
+                _count(chunks=1, nbytes=n)
+                # Les serveurs WSGI exigent des bytes : une seule copie par chunk
+                yield bytes(view[:n])
+        finally:
+            view.release()
+            buffer_pool.release(buffer)
+    finally:
+        close_response(response)
+
+
+def read_exact(response, view):
+    """Remplit `view` depuis la réponse ; nombre d'octets lus (< len si fin de flux).
+
+    Fermer ensuite avec close_response() pour garder la connexion.
+    """
+    reader = _raw_reader(response) or response.raw
+    filled = 0
+    while filled < len(view):
+        n = reader.readinto(view[filled:])
+        if not n:
+            break
+        filled += n
+    return filled
+
+
+# ==================
+# FICHIER -> CLIENT
+# ==================
+
+class FileRange:
+    """Fenêtre [start, start + length) d'un fichier, lisible comme un fichier.
+
+    Le descripteur est positionné sur `start` : un file_wrapper à sendfile
+    (gunicorn) envoie Content-Length octets depuis cette position sans
+    passer par Python ; les autres serveurs lisent par read().
+    """
+
+    def __init__(self, fileobj, start, length):
+        self.fileobj = fileobj
+        self.remaining = length
+        fileobj.seek(start)
+
+    def fileno(self):
+        return self.fileobj.fileno()
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        size = self.remaining if size is None or size < 0 else min(size, self.remaining)
+        data = self.fileobj.read(size)
+        self.remaining -= len(data)
+        _count(chunks=1, nbytes=len(data))
+        return data
+
+    def close(self):
+        self.fileobj.close()
+
+
+def file_stream(environ, fileobj, start, length):
+    """Itérable WSGI d'une plage de fichier (sendfile si le serveur le permet).
+
+    À renvoyer avec Response(..., direct_passthrough=True) pour que le
+    serveur reçoive le file_wrapper tel quel.
+    """
+    _count(file_streams=1)
+    window = FileRange(fileobj, start, length)
+    wrapper = environ.get('wsgi.file_wrapper')
+    if wrapper is not None:
+        return wrapper(window, STREAM_CHUNK_MAX)
+    return _iter_file(window)
+
+
+def _iter_file(window):
+    try:
+        while True:
+            data = window.read(STREAM_CHUNK_MAX)
+            if not data:
+                break
+            yield data
+    finally:
+        window.close()
+
+
+def streaming_stats():
+    with _stats_lock:
+        stats = dict(_STATS)
+    stats['avg_chunk_bytes'] = stats['bytes'] // stats['chunks'] if stats['chunks'] else 0
+    stats['buffers'] = buffer_pool.stats()
+    return stats
@@ -0,0 +1,307 @@
+"""
+upstream.py - Client HTTP vers les hébergeurs (Vidmoly, SendVid, CDN)
+Pool keep-alive et plafond de requêtes par hôte, retries bornés avec
+jitter, disjoncteur par hôte (échec immédiat quand l'hôte tombe) et
+statistiques latence / erreurs par hôte.
+"""
+
+import os
+import time
+import random
+import logging
+import threading
+import weakref
+from collections import deque
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# ==================
+# CONFIGURATION
+# ==================
+
+USER_AGENT = os.environ.get('UPSTREAM_USER_AGENT',
+                            "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36")
+
+# Connexions keep-alive gardées par hôte / nombre d'hôtes gardés en pool
+UPSTREAM_POOL_SIZE = int(os.environ.get('UPSTREAM_POOL_SIZE', 32))
+UPSTREAM_POOL_HOSTS = int(os.environ.get('UPSTREAM_POOL_HOSTS', 64))
+# Requêtes simultanées par hôte (au-delà : attente bornée puis échec)
+UPSTREAM_MAX_PER_HOST = int(os.environ.get('UPSTREAM_MAX_PER_HOST', 64))
+UPSTREAM_QUEUE_TIMEOUT = float(os.environ.get('UPSTREAM_QUEUE_TIMEOUT', 5))
+
+# Timeouts (connexion, lecture) par usage
+UPSTREAM_CONNECT_TIMEOUT = float(os.environ.get('UPSTREAM_CONNECT_TIMEOUT', 5))
+PAGE_TIMEOUT = (UPSTREAM_CONNECT_TIMEOUT, float(os.environ.get('UPSTREAM_PAGE_TIMEOUT', 10)))
+SEGMENT_TIMEOUT = (UPSTREAM_CONNECT_TIMEOUT, float(os.environ.get('UPSTREAM_SEGMENT_TIMEOUT', 20)))
+STREAM_TIMEOUT = (UPSTREAM_CONNECT_TIMEOUT, float(os.environ.get('UPSTREAM_STREAM_TIMEOUT', 30)))
+
+# Retries (GET/HEAD uniquement) : backoff exponentiel, jitter complet
+UPSTREAM_RETRIES = int(os.environ.get('UPSTREAM_RETRIES', 2))
+UPSTREAM_BACKOFF = float(os.environ.get('UPSTREAM_BACKOFF', 0.2))
+UPSTREAM_BACKOFF_MAX = 2.0
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+
+# Disjoncteur : N échecs consécutifs -> ouvert pendant COOLDOWN s
+BREAKER_THRESHOLD = int(os.environ.get('UPSTREAM_BREAKER_THRESHOLD', 5))
+BREAKER_COOLDOWN = float(os.environ.get('UPSTREAM_BREAKER_COOLDOWN', 30))
+
+
+class UpstreamUnavailable(requests.ConnectionError):
+    """Hôte refusé sans appel réseau (disjoncteur ouvert ou hôte saturé)"""
+
+
+def host_of(url):
+    return urlsplit(url).hostname or ''
+
+
+# ==================
+# ÉTAT PAR HÔTE
+# ==================
+
+class HostState:
+    """Disjoncteur + plafond de concurrence + statistiques d'un hôte"""
+
+    def __init__(self, host, max_concurrency=UPSTREAM_MAX_PER_HOST,
+                 threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN):
+        self.host = host
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+
+        self.state = 'closed'      # closed / open / half_open
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.rejected = 0
+        self.inflight = 0
+        self.opened = 0
+        self._latencies = deque(maxlen=256)  # ms
+
+    # ---------- Disjoncteur ----------
+
+    def allow(self):
+        """False si l'hôte doit échouer immédiatement"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open':
+                if time.monotonic() - self.opened_at < self.cooldown:
+                    self.rejected += 1
+                    return False
+                self.state = 'half_open'
+                self._probing = False
+            # Semi-ouvert : une seule requête d'essai à la fois
+            if self._probing:
+                self.rejected += 1
+                return False
+            self._probing = True
+            return True
+
+    def record(self, elapsed_ms, ok):
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(elapsed_ms)
+            if ok:
+                self.consecutive_failures = 0
+                if self.state != 'closed':
+                    logger.info(f"🔌 Upstream {self.host} rétabli")
+                self.state = 'closed'
+                self._probing = False
+                return
+
+            self.errors += 1
+            self.consecutive_failures += 1
+            if self.state == 'half_open' or self.consecutive_failures >= self.threshold:
+                if self.state != 'open':
+                    self.opened += 1
+                    logger.warning(f"⚡ Upstream {self.host} coupé {self.cooldown:.0f}s "
+                                   f"({self.consecutive_failures} échecs)")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def stats(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            return {
+                'state': self.state,
+                'requests': self.requests,
+                'errors': self.errors,
+                'error_rate': round(self.errors / self.requests, 4) if self.requests else 0.0,
+                'retries': self.retries,
+                'rejected': self.rejected,
+                'inflight': self.inflight,
+                'breaker_opened': self.opened,
+                'latency_ms': {
+                    'avg': round(sum(latencies) / len(latencies), 1) if latencies else None,
+                    'p50': round(latencies[len(latencies) // 2], 1) if latencies else None,
+                    'p95': round(latencies[int(len(latencies) * 0.95)], 1) if latencies else None,
+                },
+            }
+
+
+# ==================
+# CLIENT
+# ==================
+
+class UpstreamClient:
+    """Session requests partagée, instrumentée par hôte"""
+
+    def __init__(self, pool_size=UPSTREAM_POOL_SIZE, pool_hosts=UPSTREAM_POOL_HOSTS,
+                 retries=UPSTREAM_RETRIES):
+        self.retries = retries
+        self.session = requests.Session()
+        self.session.headers.update({'User-Agent': USER_AGENT, 'Connection': 'keep-alive'})
+        # Retries gérés ici (jitter + disjoncteur), pas par urllib3
+        adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def headers(self):
+        return self.session.headers
+
+    def host(self, url):
+        name = host_of(url)
+        state = self._hosts.get(name)
+        if state is None:
+            with self._lock:
+                state = self._hosts.setdefault(name, HostState(name))
+        return state
+
+    def request(self, method, url, timeout=PAGE_TIMEOUT, retries=None, **kwargs):
+        """Comme Session.request ; UpstreamUnavailable si l'hôte est coupé ou saturé.
+
+        Avec stream=True la place de concurrence est rendue à la fermeture de
+        la réponse (ou à sa destruction) : fermer la réponse après lecture.
+        """
+        state = self.host(url)
+        retries = self.retries if retries is None else retries
+        if method.upper() not in ('GET', 'HEAD'):
+            retries = 0
+
+        attempt = 0
+        while True:
+            if not state.allow():
+                raise UpstreamUnavailable(f"Upstream {state.host} indisponible (disjoncteur ouvert)")
+            if not state.slots.acquire(timeout=UPSTREAM_QUEUE_TIMEOUT):
+                with state._lock:
+                    state.rejected += 1
+                    # Place d'essai semi-ouverte non consommée : on la rend
+                    state._probing = False
+                raise UpstreamUnavailable(f"Upstream {state.host} saturé")
+
+            release = _Release(state)
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.RequestException as e:
+                release()
+                state.record((time.perf_counter() - start) * 1000, False)
+                if attempt >= retries:
+                    raise
+                logger.debug(f"Retry upstream {url}: {e}")
+            except BaseException:
+                # URL invalide, interruption... : pas imputable à l'hôte, mais la place
+                # et l'essai semi-ouvert doivent être rendus
+                release()
+                with state._lock:
+                    state._probing = False
+                raise
+            else:
+                ok = response.status_code < 500 and response.status_code != 429
+                state.record((time.perf_counter() - start) * 1000, ok)
+                if response.status_code not in RETRY_STATUSES or attempt >= retries:
+                    if kwargs.get('stream'):
+                        _release_on_close(response, release)
+                    else:
+                        release()
+                    return response
+                response.close()
+                release()
+
+            attempt += 1
+            with state._lock:
+                state.retries += 1
+            time.sleep(random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF * 2 ** attempt)))
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def stats(self):
+        with self._lock:
+            hosts = list(self._hosts.items())
+        return {
+            'pool_size': UPSTREAM_POOL_SIZE,
+            'max_per_host': UPSTREAM_MAX_PER_HOST,
+            'retries': self.retries,
+            'hosts': {name: state.stats() for name, state in hosts},
+        }
+
+
+class _Release:
+    """Libère une place de concurrence une seule fois"""
+
+    __slots__ = ('state', 'done', '__weakref__')
+
+    def __init__(self, state):
+        self.state = state
+        self.done = False
+        with state._lock:
+            state.inflight += 1
+
+    def __call__(self):
+        if self.done:
+            return
+        self.done = True
+        with self.state._lock:
+            self.state.inflight -= 1
+        self.state.slots.release()
+
+
+class _CloseAndRelease:
+    """response.close() puis libération de la place.
+
+    Référence faible vers la réponse : une closure sur response.close
+    formerait un cycle, et la place ne reviendrait qu'au passage du GC
+    cyclique pour une réponse abandonnée.
+    """
+
+    __slots__ = ('response', 'release')
+
+    def __init__(self, response, release):
+        self.response = weakref.ref(response)
+        self.release = release
+
+    def __call__(self):
+        response = self.response()
+        try:
+            if response is not None:
+                type(response).close(response)
+        finally:
+            self.release()
+
+
+def _release_on_close(response, release):
+    response.close = _CloseAndRelease(response, release)
+    # Réponse abandonnée sans close() : la place revient dès la destruction
+    weakref.finalize(response, release)
+
+
+# Instance partagée (process)
+upstream = UpstreamClient()
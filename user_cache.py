@@ -0,0 +1,143 @@
+"""
+user_cache.py - Cache mémoire de l'état utilisateur (favoris + progression)
+LRU borné en utilisateurs, TTL par utilisateur ; mis à jour par les écritures
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# ==================
+# CONFIGURATION
+# ==================
+
+USER_CACHE_MAX_USERS = int(os.environ.get('USER_CACHE_MAX_USERS', 5000))
+USER_CACHE_MAX_ANIMES = int(os.environ.get('USER_CACHE_MAX_ANIMES', 50))
+# Borne la staleness entre workers (chaque process a son cache)
+USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 300))
+
+
+class UserState:
+    """Favoris (frozenset d'anime_id) + progression par anime"""
+
+    __slots__ = ('favorites', 'progress', 'created_at')
+
+    def __init__(self):
+        self.favorites = None          # None = pas encore chargé
+        self.progress = OrderedDict()  # anime_id -> {(saison, épisode): ProgressEntry}
+        self.created_at = time.monotonic()
+
+
+class UserStateCache:
+    """Cache thread-safe ; les valeurs sont remplacées, jamais mutées en place"""
+
+    def __init__(self, max_users=USER_CACHE_MAX_USERS,
+                 max_animes=USER_CACHE_MAX_ANIMES, ttl=USER_CACHE_TTL):
+        self.max_users = max_users
+        self.max_animes = max_animes
+        self.ttl = ttl
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _state(self, user_id, create=False):
+        state = self._users.get(user_id)
+        if state is not None and time.monotonic() - state.created_at > self.ttl:
+            del self._users[user_id]
+            state = None
+        if state is None:
+            if not create:
+                return None
+            state = self._users[user_id] = UserState()
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    # ---------- Favoris ----------
+
+    def get_favorites(self, user_id):
+        with self._lock:
+            state = self._state(user_id)
+            favorites = state.favorites if state else None
+            if favorites is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return favorites
+
+    def set_favorites(self, user_id, anime_ids):
+        with self._lock:
+            self._state(user_id, create=True).favorites = frozenset(anime_ids)
+
+    def update_favorite(self, user_id, anime_id, added):
+        with self._lock:
+            state = self._state(user_id)
+            if state is None or state.favorites is None:
+                return
+            if added:
+                state.favorites = state.favorites | {anime_id}
+            else:
+                state.favorites = state.favorites - {anime_id}
+
+    # ---------- Progression ----------
+
+    def get_progress(self, user_id, anime_id):
+        """{(saison, épisode): ProgressEntry} ou None si pas en cache"""
+        with self._lock:
+            state = self._state(user_id)
+            progress = state.progress.get(anime_id) if state else None
+            if progress is None:
+                self.misses += 1
+            else:
+                state.progress.move_to_end(anime_id)
+                self.hits += 1
+            return progress
+
+    def set_progress(self, user_id, anime_id, entries):
+        with self._lock:
+            state = self._state(user_id, create=True)
+            state.progress[anime_id] = dict(entries)
+            state.progress.move_to_end(anime_id)
+            while len(state.progress) > self.max_animes:
+                state.progress.popitem(last=False)
+
+    def update_progress(self, user_id, entry):
+        """Applique une écriture si l'anime est déjà en cache"""
+        with self._lock:
+            state = self._state(user_id)
+            current = state.progress.get(entry.anime_id) if state else None
+            if current is None:
+                return
+            updated = dict(current)
+            updated[(entry.season_number, entry.episode_number)] = entry
+            state.progress[entry.anime_id] = updated
+
+    def drop_progress(self, user_id, anime_id):
+        with self._lock:
+            state = self._state(user_id)
+            if state is not None:
+                state.progress.pop(anime_id, None)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'users': len(self._users),
+                'max_users': self.max_users,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,219 @@
+"""
+video_store.py - Store borné des sessions vidéo résolues
+LRU + TTL, budget entrées/octets, compteurs hit/miss/eviction
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+# ==================
+# CONFIGURATION
+# ==================
+
+VIDEO_STORE_MAX_ENTRIES = int(os.environ.get('VIDEO_STORE_MAX_ENTRIES', 500))
+VIDEO_STORE_MAX_BYTES = int(os.environ.get('VIDEO_STORE_MAX_BYTES', 64 * 1024 * 1024))
+VIDEO_STORE_TTL = int(os.environ.get('VIDEO_STORE_TTL', 2 * 3600))
+
+
+# ==================
+# SESSION VIDÉO
+# ==================
+
+class Variant:
+    """Rendition HLS : playlist média upstream, segments chargés à la demande"""
+
+    __slots__ = ('url', 'bandwidth', 'resolution', 'codecs', 'frame_rate',
+                 'segments', 'target_duration', 'lock')
+
+    def __init__(self, url, bandwidth=0, resolution=None, codecs=None, frame_rate=None,
+                 segments=None, target_duration=0):
+        self.url = url
+        self.bandwidth = bandwidth
+        self.resolution = resolution
+        self.codecs = codecs
+        self.frame_rate = frame_rate
+        # Liste de tuples (url_absolue, durée) ; None tant que non chargée
+        self.segments = segments
+        self.target_duration = target_duration
+        self.lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self.segments is not None
+
+    def segment_url(self, index):
+        if self.segments is not None and 0 <= index < len(self.segments):
+            return self.segments[index][0]
+        return None
+
+
+class VideoSession:
+    """Flux résolu : URL upstream + renditions HLS (si Vidmoly)"""
+
+    __slots__ = ('player_type', 'url', 'variants', 'default_variant', 'manifests',
+                 'accepts_range', 'total_size', 'created_at', 'expires_at', 'size')
+
+    def __init__(self, player_type, url, segments=None, target_duration=0,
+                 accepts_range=False, total_size=0, ttl=None,
+                 variants=None, default_variant=0):
+        self.player_type = player_type
+        self.url = url
+        # Une seule rendition connue : variante unique construite sur les segments
+        if variants is None:
+            variants = [Variant(url, segments=segments or [], target_duration=target_duration)]
+        self.variants = variants
+        self.default_variant = default_variant
+        # Playlists réécrites (master + médias), construites une fois par session
+        self.manifests = {}
+        self.accepts_range = accepts_range
+        self.total_size = total_size
+        self.created_at = time.monotonic()
+        # Expiration propre (token des URLs signées), sinon TTL du store
+        self.expires_at = self.created_at + ttl if ttl is not None else None
+        self.size = self._estimate_size()
+
+    def _estimate_size(self):
+        """Estimation grossière de l'empreinte mémoire (octets)"""
+        size = 256 + len(self.url)
+        for variant in self.variants:
+            size += 160 + len(variant.url)
+            for seg_url, _ in variant.segments or ():
+                size += 120 + len(seg_url)
+        for manifest in list(self.manifests.values()):
+            size += 64 + len(manifest)
+        return size
+
+    @property
+    def segments(self):
+        """Segments de la rendition par défaut"""
+        return self.variants[self.default_variant].segments or []
+
+    @property
+    def target_duration(self):
+        return self.variants[self.default_variant].target_duration
+
+    def variant(self, index):
+        if 0 <= index < len(self.variants):
+            return self.variants[index]
+        return None
+
+    def segment_url(self, index):
+        return self.variants[self.default_variant].segment_url(index)
+
+
+# ==================
+# STORE LRU + TTL
+# ==================
+
+class VideoSessionStore:
+    """Store thread-safe, borné en entrées et en octets, avec expiration"""
+
+    def __init__(self, max_entries=VIDEO_STORE_MAX_ENTRIES,
+                 max_bytes=VIDEO_STORE_MAX_BYTES, ttl=VIDEO_STORE_TTL):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, count=True):
+        """Session valide ou None ; count=False pour une simple vérification interne"""
+        with self._lock:
+            session = self._data.get(key)
+            if session is None:
+                if count:
+                    self.misses += 1
+                return None
+            if self._expired(session, time.monotonic()):
+                self._remove(key)
+                self.expirations += 1
+                if count:
+                    self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            if count:
+                self.hits += 1
+            return session
+
+    def put(self, key, session):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = session
+            self._bytes += session.size
+            self._evict()
+
+    def resize(self, key, session):
+        """Recompte une session qui a grossi après insertion (rendition, playlist)"""
+        size = session._estimate_size()
+        with self._lock:
+            if self._data.get(key) is not session:
+                session.size = size
+                return
+            self._bytes += size - session.size
+            session.size = size
+            self._evict()
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _expired(self, session, now):
+        if session.expires_at is not None and now > session.expires_at:
+            return True
+        return now - session.created_at > self.ttl
+
+    def _remove(self, key):
+        session = self._data.pop(key)
+        self._bytes -= session.size
+
+    def _evict(self):
+        """Purge les entrées expirées puis les moins récentes jusqu'au budget"""
+        now = time.monotonic()
+        for key in [k for k, s in self._data.items() if self._expired(s, now)]:
+            self._remove(key)
+            self.expirations += 1
+
+        while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+# Instance partagée (process)
+video_store = VideoSessionStore()